@@ -1,10 +1,10 @@
 """Renders admin pages for ops and other management tasks.
 
-Currently just ``/admin/responses``, which shows active responses with tasks that
-haven't completed yet.
+Includes ``/admin/responses``, which shows active responses with tasks that
+haven't completed yet, and ``/admin/domains``, which shows webmention target
+domains with recent errors.
 """
 import datetime
-import itertools
 import logging
 
 from flask import render_template, request
@@ -70,19 +70,26 @@ def responses():
 @app.route('/admin/sources')
 def sources():
   """Find sources whose last poll errored out."""
-  CLASSES = (flickr.Flickr, github.GitHub, mastodon.Mastodon, reddit.Reddit,
-             bluesky.Bluesky)
-  queries = [cls.query(Source.status == 'enabled',
-                       Source.poll_status == 'error',
-                       Source.rate_limited.IN((False, None)),
-                       Source.features == 'listen',
-                      ).fetch_async(NUM_ENTITIES)
-             for cls in CLASSES]
-
+  healths = models.PollHealth.query(models.PollHealth.poll_status == 'error',
+                                    models.PollHealth.rate_limited == False,
+                                    ).fetch(NUM_ENTITIES * 5)
+  sources = []
+  parents = ndb.get_multi(h.key.parent() for h in healths)
+  for health, source in zip(healths, parents):
+    if source and source.status == 'enabled' and 'listen' in source.features:
+      source.health = health
+      sources.append(source)
+
+  return render_template('admin_sources.html', sources=sources, logs=logs)
+
+
+@app.route('/admin/domains')
+def domains():
+  """Show webmention target domains with recent errors and their circuit breakers."""
   return render_template(
-    'admin_sources.html',
-    sources=itertools.chain(*[q.get_result() for q in queries]),
-    logs=logs,
+    'admin_domains.html',
+    domains=util.DomainHealth.query().order(-util.DomainHealth.updated)
+                                     .fetch(NUM_ENTITIES * 5),
   )
 
 
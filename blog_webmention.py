@@ -37,11 +37,7 @@ class BlogWebmentionView(webmention.Webmention):
     # look up source by domain
     source_cls = models.sources[site]
     domain = domain.lower()
-    self.source = (source_cls.query()
-                   .filter(source_cls.domains == domain)
-                   .filter(source_cls.features == 'webmention')
-                   .filter(source_cls.status == 'enabled')
-                   .get())
+    self.source = self._find_source(source_cls, [domain])
     if not self.source:
       # check for a rel-canonical link. Blogger uses these when it serves a post
       # from multiple domains, e.g country TLDs like epeus.blogspot.co.uk vs
@@ -55,11 +51,7 @@ class BlogWebmentionView(webmention.Webmention):
         util.domain_from_link(url)
         for url in mf2[1]['rels'].get('canonical', []))
       if domains:
-        self.source = (source_cls.query()
-                       .filter(source_cls.domains.IN(domains))
-                       .filter(source_cls.features == 'webmention')
-                       .filter(source_cls.status == 'enabled')
-                       .get())
+        self.source = self._find_source(source_cls, domains)
 
     if not self.source:
       self.error(
@@ -150,6 +142,22 @@ class BlogWebmentionView(webmention.Webmention):
 
     return self.entity.published
 
+  @staticmethod
+  def _find_source(source_cls, domains):
+    """Returns the first enabled source with webmentions on for any domain.
+
+    Args:
+      source_cls (models.Source): subclass for this silo
+      domains (sequence of str): lower case
+
+    Returns:
+      models.Source, or None
+    """
+    for domain in domains:
+      source = source_cls.webmention_source_for_domain(domain)
+      if source:
+        return source
+
   def find_mention_item(self, items):
     """Returns the mf2 item that mentions (or replies to, likes, etc) the target.
 
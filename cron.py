@@ -26,6 +26,10 @@ logger = logging.getLogger(__name__)
 CIRCLECI_TOKEN = util.read('circleci_token')
 PAGE_SIZE = 20
 
+# delete models.CachedItems that expired at least this long ago. that's past
+# handlers.ITEM_CACHE_STALE_IF_ERROR, so they're never served.
+CACHED_ITEM_MAX_STALE = timedelta(days=1)
+
 
 class LastUpdatedPicture(StringIdModel):
   """Stores the last user in a given silo that we updated profile picture for.
@@ -39,15 +43,102 @@ class LastUpdatedPicture(StringIdModel):
 
 @app.route('/cron/replace_poll_tasks')
 def replace_poll_tasks():
-  """Finds sources missing their poll tasks and adds new ones."""
+  """Finds sources missing their poll tasks and adds new ones.
+
+  Not needed with ``util.POLL_TIME_WHEEL``, since :func:`poll_wheel` adds
+  tasks for every due source, including ones whose tasks were lost.
+  """
+  if util.POLL_TIME_WHEEL:
+    return ''
+
   queries = [cls.query(Source.features == 'listen', Source.status == 'enabled',
                        Source.last_poll_attempt <  util.now() - timedelta(days=2))
              for cls in models.sources.values() if cls.AUTO_POLL]
-  for source in itertools.chain(*queries):
-    age = util.now() - source.last_poll_attempt
-    logger.info(f'{source.bridgy_url()} last polled {age} ago. Adding new poll task.')
-    util.add_poll_task(source)
+  with util.task_batch():
+    for source in itertools.chain(*queries):
+      age = util.now() - source.last_poll_attempt
+      logger.info(f'{source.bridgy_url()} last polled {age} ago. Adding new poll task.')
+      util.add_poll_task(source)
+
+  return ''
+
+
+@app.route('/cron/poll_wheel')
+def poll_wheel():
+  """Adds poll tasks for all sources due before the end of the next tick.
+
+  Only runs if ``util.POLL_TIME_WHEEL`` is enabled. Uses a projection query
+  on :attr:`models.Source.next_poll` for each source class, so it only reads
+  index entries, and adds all of the tasks in one :func:`util.task_batch`.
+
+  Sources that are already overdue are included, eg if their task is still
+  queued or failed to be added. Their task names are the same as last time,
+  so adding them again is a no-op until they've been polled and their
+  ``next_poll`` has changed.
+
+  Sources more than ``util.POLL_WHEEL_REPAIR_AFTER`` overdue probably lost
+  their task, eg it was deleted, and Cloud Tasks won't reuse its name for a
+  while. Those get a new task name once per ``POLL_WHEEL_REPAIR_AFTER``.
+  :class:`tasks.Poll` drops any extra tasks after the first one polls.
+  """
+  if not util.POLL_TIME_WHEEL:
+    return ''
+
+  now = util.now()
+  end = now + util.POLL_WHEEL_TICK
+  repair_before = now - util.POLL_WHEEL_REPAIR_AFTER
+  repair = int(util.to_utc_timestamp(now) //
+               util.POLL_WHEEL_REPAIR_AFTER.total_seconds())
+  with util.task_batch() as batch:
+    for cls in models.sources.values():
+      if cls.AUTO_POLL:
+        for source in cls.query(cls.next_poll < end).iter(projection=['next_poll']):
+          util.add_wheel_poll_task(
+            source.key, source.next_poll,
+            repair=repair if source.next_poll < repair_before else None)
+
+  failed = [e for _, e in batch.failed()
+            if not isinstance(e, util.AlreadyExists)]
+  logger.info(f'Added {len(batch.requests) - len(batch.failed())} poll tasks, {len(batch.failed()) - len(failed)} already existed, {len(failed)} failed')
+  if failed:
+    raise failed[0]
+
+  return ''
+
+
+def delete_all(query):
+  """Deletes all entities that a query matches, in batches.
+
+  Args:
+    query (ndb.Query)
+
+  Returns:
+    int: number of entities deleted
+  """
+  deleted = 0
+  keys = query.iter(keys_only=True)
+  while batch := list(itertools.islice(keys, models.PUT_MULTI_BATCH_SIZE)):
+    ndb.delete_multi(batch)
+    deleted += len(batch)
+  return deleted
+
+
+@app.route('/cron/delete_expired_url_caches')
+def delete_expired_url_caches():
+  """Deletes expired :class:`util.ResolvedUrl`\s and :class:`util.WebmentionEndpoint`\s."""
+  now = util.now()
+  for cls in util.ResolvedUrl, util.WebmentionEndpoint:
+    deleted = delete_all(cls.query(cls.expires < now))
+    logger.info(f'Deleted {deleted} expired {cls.__name__}s')
+  return ''
+
 
+@app.route('/cron/delete_expired_cached_items')
+def delete_expired_cached_items():
+  """Deletes :class:`models.CachedItem`\s that are too old to serve."""
+  deleted = delete_all(models.CachedItem.query(
+    models.CachedItem.expires < util.now() - CACHED_ITEM_MAX_STALE))
+  logger.info(f'Deleted {deleted} expired CachedItems')
   return ''
 
 
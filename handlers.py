@@ -16,6 +16,7 @@ URL paths are:
   e.g. /rsvp/facebook/212038/12345/67890
 """
 import datetime
+import hashlib
 import logging
 import re
 import string
@@ -27,7 +28,8 @@ from granary import microformats2
 from granary.microformats2 import first_props
 from oauth_dropins.webutil import flask_util
 from oauth_dropins.webutil.flask_util import error
-from oauth_dropins.webutil.util import json_loads
+from oauth_dropins.webutil.util import json_dumps, json_loads
+from werkzeug.exceptions import HTTPException
 
 from flask_app import app, cache
 import models
@@ -38,6 +40,24 @@ logger = logging.getLogger(__name__)
 
 CACHE_TIME = datetime.timedelta(minutes=15)
 
+# shared tier of the Item response cache, in the datastore as models.CachedItem,
+# under the per-instance flask-caching tier. Successful renders are stored for
+# CACHE_TIME, 404s for ITEM_CACHE_NEGATIVE_TIME. Once an entry expires, the next
+# request rerenders it, and if that fails, we serve the expired response for up
+# to ITEM_CACHE_STALE_IF_ERROR. Entries are keyed by the source's status and
+# blocklist, so disabling the source or changing its blocklist invalidates
+# them. /cron/delete_expired_cached_items deletes old entries.
+ITEM_CACHE_DATASTORE = True
+ITEM_CACHE_NEGATIVE_TIME = datetime.timedelta(minutes=5)
+ITEM_CACHE_STALE_IF_ERROR = datetime.timedelta(hours=6)
+
+# Post, comment, and repost pages render from the models.Response we stored
+# when we found the response, if we have one, and only fall back to the silo
+# API when it's older than this. Twitter is datastore only since we can't fetch
+# from its API. Like, reaction, and RSVP ids are silo-specific, so they don't
+# reliably match stored Response ids, and always come from the silo.
+ITEM_RESPONSE_MAX_AGE = datetime.timedelta(days=1)
+
 TEMPLATE = string.Template("""\
 <!DOCTYPE html>
 <html>
@@ -68,6 +88,24 @@ $body
 """)
 
 
+def item_cache_id(path, format, source):
+  """Returns the :class:`models.CachedItem` key id for an Item request.
+
+  Includes the source's status and a hash of its blocklist, so that entries
+  stored before the source was disabled or its blocklist changed aren't used.
+
+  Args:
+    path (str): request path
+    format (str): ``html`` or ``json``
+    source (models.Source)
+
+  Returns:
+    str
+  """
+  blocks = hashlib.md5(json_dumps(source.blocked_ids or []).encode()).hexdigest()
+  return f'{path} {format} {source.status} {blocks[:8]}'
+
+
 class Item(View):
   """Fetches a post, repost, like, or comment and serves it as mf2 HTML or JSON.
   """
@@ -111,6 +149,56 @@ class Item(View):
     except Exception as e:
       util.interpret_http_exception(e)
 
+  def get_stored(self, id, activity_id=None):
+    """Loads an object and its activity from a stored :class:`models.Response`.
+
+    Args:
+      id (str): site-specific id of the response
+      activity_id (str): site-specific id of the activity it responds to
+
+    The stored JSON is pruned, so it's missing the attachments, tags, etc that
+    we found webmention targets in. The targets themselves come back
+    separately so that callers can link to them, along with the original posts
+    we stored, so that callers can tell those apart from mentions.
+
+    Returns:
+      (dict object, dict activity, set of str targets, set of str originals)
+      tuple. object and activity are ActivityStreams objects, both None if we
+      don't have a fresh :class:`models.Response` for this source, or if we
+      need its activity and don't have it stored, except on Twitter, where we
+      can't fetch it instead. targets are the webmention targets we've sent or
+      will send this response to, originals are its
+      :attr:`models.Response.original_posts`.
+    """
+    none = None, None, set(), set()
+    resp = models.Response.get_by_id(self.source.gr_source.tag_uri(id))
+    if not resp or not resp.response_json or resp.source != self.source.key:
+      return none
+
+    is_twitter = self.source.SHORT_NAME == 'twitter'
+    if (not is_twitter and resp.updated and
+        resp.updated < util.now() - ITEM_RESPONSE_MAX_AGE):
+      logger.info(f'Stored response {resp.key.id()} is stale, fetching from silo')
+      return none
+
+    activity = None
+    if activity_id:
+      tag = self.source.gr_source.tag_uri(activity_id)
+      for stored in resp.activities_json:
+        stored = json_loads(stored)
+        if tag in (stored.get('id'), stored.get('object', {}).get('id')):
+          activity = stored
+          break
+      else:
+        if not is_twitter:
+          logger.info(f"Stored response {resp.key.id()} doesn't have activity {activity_id}, fetching from silo")
+          return none
+
+    logger.info(f'Using stored response {resp.key.id()}')
+    targets = set(resp.sent + resp.unsent + resp.error + resp.skipped)
+    return (json_loads(resp.response_json), activity, targets,
+            set(resp.original_posts))
+
   @flask_util.cached(cache, CACHE_TIME)
   def dispatch_request(self, site, key_id, **kwargs):
     """Handle HTTP request."""
@@ -145,6 +233,70 @@ class Item(View):
     if request.method == 'HEAD':
       return ''
 
+    if not ITEM_CACHE_DATASTORE or request.args.get('cache', '').lower() == 'false':
+      return self.render(site, key_id, format, **kwargs)
+
+    cache_id = item_cache_id(request.path, format, self.source)
+    cached = models.CachedItem.get_by_id(cache_id)
+    now = util.now()
+    if cached and now < cached.expires:
+      logger.info(f'Serving {cache_id} from datastore cache')
+      return self.cached_response(cached, format)
+
+    stale_ok = (cached and cached.status == 200 and
+                now < cached.expires + ITEM_CACHE_STALE_IF_ERROR)
+    try:
+      resp = self.render(site, key_id, format, **kwargs)
+    except HTTPException as e:
+      if e.code == 404:
+        models.CachedItem(id=cache_id, status=404, body=e.description,
+                          expires=now + ITEM_CACHE_NEGATIVE_TIME).put()
+      elif stale_ok and e.code // 100 == 5:
+        logger.info(f'Serving stale {cache_id} after {e.code}')
+        return self.cached_response(cached, format)
+      raise
+    except AssertionError:
+      raise  # for unit tests
+    except Exception:
+      if stale_ok:
+        logger.info(f'Serving stale {cache_id} after error', exc_info=True)
+        return self.cached_response(cached, format)
+      raise
+
+    models.CachedItem(id=cache_id, status=200,
+                      body=resp if format == 'html' else json_dumps(resp),
+                      expires=now + CACHE_TIME).put()
+    return resp
+
+  def cached_response(self, cached, format):
+    """Returns a :class:`models.CachedItem`\'s response.
+
+    Args:
+      cached (models.CachedItem)
+      format (str): ``html`` or ``json``
+
+    Returns:
+      str HTML or dict mf2 JSON
+
+    Raises:
+      :class:`werkzeug.exceptions.NotFound` if it's a cached 404
+    """
+    if cached.status == 404:
+      error(cached.body, 404)
+    return cached.body if format == 'html' else json_loads(cached.body)
+
+  def render(self, site, key_id, format, **kwargs):
+    """Fetches an item and renders it.
+
+    Args:
+      site (str): silo short name
+      key_id (str): source key id
+      format (str): ``html`` or ``json``
+      kwargs: passed through to :meth:`get_item`
+
+    Returns:
+      str HTML or dict mf2 JSON
+    """
     try:
       obj = self.get_item(**kwargs)
     except models.DisableSource:
@@ -221,42 +373,30 @@ class Item(View):
 # likes, reposts, or rsvps. Matches logic in poll() (step 4) in tasks.py!
 class Post(Item):
   def get_item(self, post_id):
-    posts = None
-
-    if self.source.SHORT_NAME == 'twitter':
-      resp = models.Response.get_by_id(self.source.gr_source.tag_uri(post_id))
-      if resp and resp.response_json:
-        posts = [json_loads(resp.response_json)]
-    else:
+    post, _, targets, stored_originals = self.get_stored(post_id)
+    if not post and self.source.SHORT_NAME != 'twitter':
       posts = self.source.get_activities(activity_id=post_id,
                                          user_id=self.source.key_id())
-    if not posts:
+      if posts:
+        post = posts[0]
+    if not post:
       return None
 
-    post = posts[0]
     originals, mentions = original_post_discovery.discover(
       self.source, post, fetch_hfeed=False)
+    originals |= stored_originals
     obj = post.get('object') or post
     obj['upstreamDuplicates'] = list(
       set(util.get_list(obj, 'upstreamDuplicates')) | originals)
-    self.merge_urls(obj, 'tags', mentions, object_type='mention')
+    self.merge_urls(obj, 'tags', mentions | (targets - originals),
+                    object_type='mention')
     return obj
 
 
 class Comment(Item):
   def get_item(self, post_id, comment_id):
-    if self.source.SHORT_NAME == 'twitter':
-      cmt = post = None
-      resp = models.Response.get_by_id(self.source.gr_source.tag_uri(comment_id))
-      if resp and resp.response_json:
-        cmt = json_loads(resp.response_json)
-        if resp.activities_json:
-          for activity in resp.activities_json:
-            activity = json_loads(activity)
-            if activity.get('id') == self.source.gr_source.tag_uri(post_id):
-              post = activity
-
-    else:
+    cmt, post, targets, originals = self.get_stored(comment_id, post_id)
+    if not cmt and self.source.SHORT_NAME != 'twitter':
       fetch_replies = not self.source.gr_source.OPTIMIZED_COMMENTS
       post = self.get_post(post_id, fetch_replies=fetch_replies)
       has_replies = (post.get('object', {}).get('replies', {}).get('items')
@@ -265,11 +405,14 @@ class Comment(Item):
         comment_id, activity_id=post_id, activity_author_id=self.source.key_id(),
         activity=post if fetch_replies or has_replies else None)
 
+    mentions = set()
     if post:
-      originals, mentions = original_post_discovery.discover(
+      discovered, mentions = original_post_discovery.discover(
         self.source, post, fetch_hfeed=False)
-      self.merge_urls(cmt, 'inReplyTo', originals)
-      self.merge_urls(cmt, 'tags', mentions, object_type='mention')
+      originals |= discovered
+    self.merge_urls(cmt, 'inReplyTo', originals)
+    self.merge_urls(cmt, 'tags', mentions | (targets - originals),
+                    object_type='mention')
     return cmt
 
 
@@ -299,18 +442,8 @@ class Reaction(Item):
 
 class Repost(Item):
   def get_item(self, post_id, share_id):
-    if self.source.SHORT_NAME == 'twitter':
-      repost = post = None
-      resp = models.Response.get_by_id(self.source.gr_source.tag_uri(share_id))
-      if resp and resp.response_json:
-        repost = json_loads(resp.response_json)
-        if resp.activities_json:
-          for activity in resp.activities_json:
-            activity = json_loads(activity)
-            if activity.get('id') == self.source.gr_source.tag_uri(post_id):
-              post = activity
-
-    else:
+    repost, post, targets, originals = self.get_stored(share_id, post_id)
+    if not repost and self.source.SHORT_NAME != 'twitter':
       post = self.get_post(post_id, fetch_shares=True)
       repost = self.source.gr_source.get_share(
         self.source.key_id(), post_id, share_id, activity=post)
@@ -320,9 +453,11 @@ class Repost(Item):
     if repost and 'attachments' in repost:
       del repost['attachments']
     if post:
-      originals, mentions = original_post_discovery.discover(
+      discovered, _ = original_post_discovery.discover(
         self.source, post, fetch_hfeed=False)
-      self.merge_urls(repost, 'object', originals)
+      originals |= discovered
+    self.merge_urls(repost, 'object', originals)
+    self.merge_urls(repost, 'tags', targets - originals, object_type='mention')
 
     return repost
 
@@ -134,7 +134,8 @@ class Micropub(PublishBase):
     if action not in ('create', 'delete'):
       self.error('not_implemented', f'Action {action} not supported')
 
-    logger.debug(f'Got microformats2: {json_dumps(mf2, indent=2)}')
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug(f'Got microformats2: {json_dumps(mf2, indent=2)}')
     try:
       obj = microformats2.json_to_object(mf2)
     except (TypeError, ValueError) as e:
@@ -144,7 +145,8 @@ class Micropub(PublishBase):
     # Mastodon to use content, not displayName
     if obj.get('objectType') == 'article':
       obj['objectType'] = 'note'
-    logger.debug(f'Converted to ActivityStreams object: {json_dumps(obj, indent=2)}')
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug(f'Converted to ActivityStreams object: {json_dumps(obj, indent=2)}')
 
     canonicalized = self.source.URL_CANONICALIZER(url or '') or ''
     post_id = self.source.gr_source.post_id(canonicalized)
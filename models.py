@@ -3,8 +3,11 @@ from datetime import datetime, timedelta, timezone
 import logging
 import os
 import re
+import threading
 
+from cachetools import TLRUCache
 from google.cloud import ndb
+from google.cloud.ndb._datastore_types import _MAX_STRING_LENGTH
 from granary import as1
 from granary import microformats2
 from granary import source as gr_source
@@ -33,6 +36,31 @@ REFETCH_HFEED_TRIGGER = datetime.fromtimestamp(-1, tz=timezone.utc)
 # https://cloud.google.com/datastore/docs/concepts/limits
 BLOCKLIST_MAX_IDS = 20000
 
+# max entities per put_multi call. the datastore allows 500 per commit.
+PUT_MULTI_BATCH_SIZE = 500
+# max values in a single IN query filter
+MAX_IN_QUERY_VALUES = 30
+
+# Source.sources_for_domain() and webmention_source_for_domain() cache source
+# keys by domain for this long, or this long if there aren't any. Puts that
+# change any of DOMAIN_SOURCES_CACHE_PROPERTIES invalidate the source's domains
+# right away, but only in this instance.
+DOMAIN_SOURCES_CACHE_TTL = timedelta(minutes=5)
+DOMAIN_SOURCES_CACHE_NEGATIVE_TTL = timedelta(minutes=1)
+DOMAIN_SOURCES_CACHE_PROPERTIES = frozenset(('domains', 'domain_urls',
+                                             'features', 'status'))
+
+# Response.summary_json only keeps this much of each content string. User pages
+# only show the first 40 characters.
+RESPONSE_SUMMARY_CONTENT_LENGTH = 1000
+
+domain_sources_cache_lock = threading.RLock()
+# maps (str kind, str domain) to list of Source keys, and
+# (str kind, str domain, 'webmention') to a single Source key or None
+domain_sources_cache = TLRUCache(5000, lambda key, keys, now: now + (
+  DOMAIN_SOURCES_CACHE_TTL if keys else DOMAIN_SOURCES_CACHE_NEGATIVE_TTL
+).total_seconds())
+
 # maps string short name to Source subclass. populated by SourceMeta.
 sources = {}
 
@@ -104,6 +132,10 @@ class Source(StringIdModel, metaclass=SourceMeta):
   # how long to wait after signup for a successful webmention before dropping to
   # the lower frequency poll
   FAST_POLL_GRACE_PERIOD = timedelta(days=7)
+  # bounds for the adaptive poll period, see util.adaptive_poll_period(). it
+  # never goes below FAST_POLL, which some silos raise for their rate limits.
+  ADAPTIVE_POLL_MIN = timedelta(minutes=5)
+  ADAPTIVE_POLL_MAX = SLOW_POLL
   # how often refetch author url to look for updated syndication links
   FAST_REFETCH = timedelta(hours=6)
   # refetch less often (this often) if it's been >2w since the last synd link
@@ -157,6 +189,12 @@ class Source(StringIdModel, metaclass=SourceMeta):
   #
   last_polled = ndb.DateTimeProperty(default=util.EPOCH, tzinfo=timezone.utc)
   last_poll_attempt = ndb.DateTimeProperty(default=util.EPOCH, tzinfo=timezone.utc)
+  # when to poll next, if util.POLL_TIME_WHEEL is enabled. read by
+  # /cron/poll_wheel.
+  next_poll = ndb.DateTimeProperty(tzinfo=timezone.utc)
+  # new responses per hour, an exponentially weighted moving average maintained
+  # by Poll. see util.update_response_rate().
+  response_rate = ndb.FloatProperty(indexed=False)
   last_webmention_sent = ndb.DateTimeProperty(tzinfo=timezone.utc)
   last_public_post = ndb.DateTimeProperty(tzinfo=timezone.utc)
   recent_private_posts = ndb.IntegerProperty(default=0)
@@ -176,10 +214,18 @@ class Source(StringIdModel, metaclass=SourceMeta):
   last_activity_id = ndb.StringProperty()
   last_activities_etag = ndb.StringProperty()
   last_activities_cache_json = ndb.TextProperty()
+  # maps response id to util.activity_fingerprint() of the responses we saw in
+  # the last poll
+  seen_responses_fingerprints = ndb.JsonProperty()
+  # deprecated, replaced by seen_responses_fingerprints. only read if that's
+  # unset, then cleared.
   seen_responses_cache_json = ndb.TextProperty(compressed=True)
 
   # populated in Poll.poll(), used by handlers
   blocked_ids = ndb.JsonProperty(compressed=True)
+  # UserIndex.name_for() as of the last put, '' if unlisted. lets puts skip
+  # updating the UserIndex entry when it hasn't changed.
+  user_index_name = ndb.StringProperty(indexed=False)
 
   # maps updated property names to values that put_updates() writes back to the
   # datastore transactionally. set this to {} before beginning.
@@ -210,6 +256,119 @@ class Source(StringIdModel, metaclass=SourceMeta):
     """
     raise NotImplementedError()
 
+  @classmethod
+  def sources_for_domain(cls, domain):
+    """Returns this silo's sources that have a given domain.
+
+    Caches the matching source keys in ``domain_sources_cache``, but always
+    loads the sources themselves, so their properties are current.
+
+    Args:
+      domain (str): should be lower case
+
+    Returns:
+      list of Source: in key order, same as a ``domains`` query
+    """
+    cache_key = (cls._get_kind(), domain)
+    with domain_sources_cache_lock:
+      keys = domain_sources_cache.get(cache_key)
+
+    if keys is None:
+      keys = cls.query(cls.domains == domain).fetch(keys_only=True)
+      with domain_sources_cache_lock:
+        domain_sources_cache[cache_key] = keys
+
+    # domains may have changed since we cached the keys
+    return [source for source in ndb.get_multi(keys)
+            if source and domain in source.domains]
+
+  @classmethod
+  def webmention_source_for_domain(cls, domain):
+    """Returns this silo's enabled source with webmentions on for a domain.
+
+    Caches only the matching source's key in ``domain_sources_cache``. If the
+    cached source no longer matches, falls back to querying again.
+
+    Args:
+      domain (str): should be lower case
+
+    Returns:
+      :class:`Source`, or None
+    """
+    def matches(source):
+      return (source and domain in source.domains and
+              'webmention' in source.features and source.status == 'enabled')
+
+    cache_key = (cls._get_kind(), domain, 'webmention')
+    with domain_sources_cache_lock:
+      key = domain_sources_cache.get(cache_key, False)
+
+    if key is None:
+      return None
+    elif key:
+      source = key.get()
+      if matches(source):
+        return source
+
+    key = cls.query(cls.domains == domain,
+                    cls.features == 'webmention',
+                    cls.status == 'enabled').get(keys_only=True)
+    with domain_sources_cache_lock:
+      domain_sources_cache[cache_key] = key
+
+    if key:
+      source = key.get()
+      if matches(source):
+        return source
+
+  def _pre_put_hook(self):
+    """Checks whether this source's :class:`UserIndex` entry needs updating."""
+    name = UserIndex.name_for(self) or ''
+    self._user_index_old_name = self.user_index_name
+    self._user_index_changed = name != self.user_index_name
+    self.user_index_name = name
+
+  def _post_put_hook(self, future):
+    """Invalidates this source's domains in ``domain_sources_cache`` and updates
+    its :class:`UserIndex` entry.
+
+    The cache invalidation is skipped for :meth:`put_updates` calls that don't
+    change any of ``DOMAIN_SOURCES_CACHE_PROPERTIES``. The index update is
+    skipped unless :meth:`UserIndex.name_for` changed, and only happens after
+    the put commits, so failed transactions don't leave stale index entries.
+    """
+    if future.exception():
+      # so that the next put tries again
+      self.user_index_name = getattr(self, '_user_index_old_name', None)
+      return
+
+    updated = self.updates.keys() if self.updates is not None else None
+
+    if updated is None or DOMAIN_SOURCES_CACHE_PROPERTIES & updated:
+      kind = self._get_kind()
+      with domain_sources_cache_lock:
+        for domain in self.domains:
+          domain_sources_cache.pop((kind, domain), None)
+          domain_sources_cache.pop((kind, domain, 'webmention'), None)
+
+    if getattr(self, '_user_index_changed', False):
+      self._user_index_changed = False
+      old_name = self._user_index_old_name
+      committed = []
+
+      def update():
+        committed.append(True)
+        UserIndex.update(self)
+
+      def reset_if_rolled_back():
+        if not committed:
+          self.user_index_name = old_name
+
+      # both run immediately if we're not in a transaction
+      ctx = ndb.get_context()
+      ctx.call_on_commit(update)
+      ctx.call_on_transaction_complete(reset_if_rolled_back)
+
   def __getattr__(self, name):
     """Lazily load the auth entity and instantiate :attr:`self.gr_source`.
 
@@ -339,7 +498,8 @@ class Source(StringIdModel, metaclass=SourceMeta):
     if not source.updates:
       return source
 
-    to_log = {k: v for k, v in source.updates.items() if not k.endswith('_json')}
+    to_log = {k: v for k, v in source.updates.items()
+              if not k.endswith(('_json', '_fingerprints'))}
     logger.info(f'Updating {source.label()} {source.bridgy_path()} : {to_log!r}')
 
     updates = source.updates
@@ -354,14 +514,27 @@ class Source(StringIdModel, metaclass=SourceMeta):
   def poll_period(self):
     """Returns the poll frequency for this source, as a :class:`datetime.timedelta`.
 
-    Defaults to ~15m, depending on silo. If we've never sent a webmention for
-    this source, or the last one we sent was over a month ago, we drop them down
-    to ~1d after a week long grace period.
+    If ``util.ADAPTIVE_POLL`` is on and we have a :attr:`response_rate`
+    estimate, uses :func:`util.adaptive_poll_period`, no faster than
+    ``FAST_POLL``, and exactly ``FAST_POLL`` during the week long grace period
+    after signup.
+
+    Otherwise, defaults to ~15m, depending on silo. If we've never sent a
+    webmention for this source, or the last one we sent was over a month ago,
+    we drop them down to ~1d after a week long grace period.
     """
     now = util.now()
     if self.rate_limited:
       return self.RATE_LIMITED_POLL
-    elif now < self.created + self.FAST_POLL_GRACE_PERIOD:
+
+    in_grace_period = now < self.created + self.FAST_POLL_GRACE_PERIOD
+    if util.ADAPTIVE_POLL and self.response_rate is not None:
+      if in_grace_period:
+        return self.FAST_POLL
+      return util.adaptive_poll_period(
+        self.response_rate, max(self.ADAPTIVE_POLL_MIN, self.FAST_POLL),
+        self.ADAPTIVE_POLL_MAX)
+    elif in_grace_period:
       return self.FAST_POLL
     elif not self.last_webmention_sent:
       return self.SLOW_POLL
@@ -772,9 +945,9 @@ class Source(StringIdModel, metaclass=SourceMeta):
     domain = util.domain_from_link(url)
     if domain == self.gr_source.DOMAIN:
       return url
-    user = self.__class__.query(self.__class__.domains == domain).get()
-    if user:
-      return self.gr_source.user_url(user.key_id())
+    users = self.sources_for_domain(domain)
+    if users:
+      return self.gr_source.user_url(users[0].key_id())
 
   def preprocess_for_publish(self, obj):
     """Preprocess an object before trying to publish it.
@@ -927,9 +1100,7 @@ class Webmentions(StringIdModel):
     self.sent = self.error = self.failed = self.skipped = []
 
     # clear any cached webmention endpoints
-    with util.webmention_endpoint_cache_lock:
-      for url in self.unsent:
-        util.webmention_endpoint_cache.pop(util.webmention_endpoint_cache_key(url), None)
+    util.invalidate_webmention_endpoints(self.unsent)
 
     # this datastore put and task add should be transactional, but Cloud Tasks
     # doesn't support that :(
@@ -944,17 +1115,36 @@ class Webmentions(StringIdModel):
     self.add_task()
 
 
+class _SummaryInputProperty(ndb.Property):
+  """Marks its :class:`Response`\'s summary stale when it's set.
+
+  Only assignments count, not loads from the datastore or in place list
+  mutations, so assign a new value instead of mutating these.
+  """
+  def _set_value(self, entity, value):
+    super()._set_value(entity, value)
+    entity._summary_stale = True
+
+
+class _SummaryInputStringProperty(_SummaryInputProperty, ndb.StringProperty):
+  pass
+
+
+class _SummaryInputTextProperty(_SummaryInputProperty, ndb.TextProperty):
+  pass
+
+
 class Response(Webmentions):
   """A comment, like, or repost to be propagated.
 
   The key name is the comment object id as a tag URI.
   """
   # ActivityStreams JSON activity and comment, like, or repost
-  type = ndb.StringProperty(choices=VERB_TYPES, default='comment')
+  type = _SummaryInputStringProperty(choices=VERB_TYPES, default='comment')
   # These are TextProperty, and not JsonProperty, so that their plain text is
   # visible in the App Engine admin console. (JsonProperty uses a blob. :/)
-  activities_json = ndb.TextProperty(repeated=True)
-  response_json = ndb.TextProperty()
+  activities_json = _SummaryInputTextProperty(repeated=True)
+  response_json = _SummaryInputTextProperty()
   # Old values for response_json. Populated when the silo reports that the
   # response has changed, e.g. the user edited a comment or changed their RSVP
   # to an event. Currently unused, kept for historical records only.
@@ -964,6 +1154,111 @@ class Response(Webmentions):
   urls_to_activity = ndb.TextProperty()
   # Original post links found by original post discovery
   original_posts = ndb.StringProperty(repeated=True)
+  # JSON output of summarize(), for user pages. Maintained by _pre_put_hook.
+  summary_json = ndb.TextProperty()
+  # Canonicalized silo URLs of the activities in activities_json, from
+  # canonical_activity_urls(). Set by Poll. Refetch queries this to find the
+  # responses to repropagate for new SyndicatedPosts.
+  syndication_urls = ndb.StringProperty(repeated=True)
+
+  def _pre_put_hook(self):
+    """Regenerates :attr:`summary_json` if its inputs have been set.
+
+    Puts that only change propagate state, eg lease and complete, skip it.
+    """
+    if self.response_json and (getattr(self, '_summary_stale', False)
+                               or not self.summary_json):
+      self.summary_json = json_dumps(self.summarize())
+      self._summary_stale = False
+
+  def summary(self):
+    """Returns :attr:`summary_json` decoded, or :meth:`summarize` if it's unset."""
+    return json_loads(self.summary_json) if self.summary_json else self.summarize()
+
+  def summarize(self):
+    """Generates a compact summary of this response for user pages.
+
+    Returns:
+      dict: with keys ``public`` (bool, whether the response and all of its
+      activities are public), ``actor`` (dict with ``displayName``, ``url``,
+      and ``image``), ``url``, ``content``, and ``activities`` (list of dicts
+      with ``url`` and ``content``)
+    """
+    response = json_loads(self.response_json)
+    activities = [json_loads(a) for a in self.activities_json]
+
+    public = (as1.is_public(response) and
+              all(as1.is_public(a) for a in activities))
+    if self.type == 'post':
+      activities = []
+
+    verb = response.get('verb')
+    actor = (response.get('object') if verb == 'invite'
+             else response.get('author') or response.get('actor')
+            ) or {}
+
+    activity_content = ''
+    for a in activities + [response]:
+      if not a.get('content'):
+        obj = a.get('object', {})
+        a['content'] = activity_content = (
+          obj.get('content') or obj.get('displayName') or
+          # historical, from a Reddit bug fixed in granary@4f9df7c
+          obj.get('name') or '')
+
+    response_content = response.get('content')
+    phrases = {
+      'like': 'liked this',
+      'repost': 'reposted this',
+      'rsvp-yes': 'is attending',
+      'rsvp-no': 'is not attending',
+      'rsvp-maybe': 'might attend',
+      'rsvp-interested': 'is interested',
+      'invite': 'is invited',
+    }
+    phrase = phrases.get(self.type) or phrases.get(verb)
+    if phrase and (self.type != 'repost' or
+                   activity_content.startswith(response_content)):
+      response['content'] = f'{actor.get("displayName") or ""} {phrase}.'
+
+    def content(obj):
+      return (obj.get('content') or '')[:RESPONSE_SUMMARY_CONTENT_LENGTH]
+
+    image = util.get_first(actor, 'image', {})
+    return {
+      'public': public,
+      'actor': {
+        'displayName': actor.get('displayName'),
+        'url': as1.get_url(actor),
+        'image': {'url': image.get('url')},
+      },
+      'url': response.get('url'),
+      'content': content(response),
+      'activities': [{
+        'url': a.get('url') or a.get('object', {}).get('url'),
+        'content': content(a),
+      } for a in activities],
+    }
+
+  def canonical_activity_urls(self, source):
+    """Returns the canonicalized silo URLs of this response's activities.
+
+    Args:
+      source (Source): canonicalizes the URLs
+
+    Returns:
+      set of str
+    """
+    urls = set()
+    for activity_json in self.activities_json:
+      activity = json_loads(activity_json)
+      url = activity.get('url') or activity.get('object', {}).get('url')
+      if url:
+        url = source.canonicalize_url(url, activity=activity)
+        if url and len(url) <= _MAX_STRING_LENGTH:
+          urls.add(url)
+
+    return urls
 
   def label(self):
     return ' '.join((self.key.kind(), self.type, self.key.id(),
@@ -980,6 +1275,12 @@ class Response(Webmentions):
   def get_or_save(self, source, restart=False):
     resp = super().get_or_save()
 
+    # fill in syndication_urls on responses stored before Poll set it
+    syndication_changed = (resp is not self and self.syndication_urls and
+                           resp.syndication_urls != self.syndication_urls)
+    if syndication_changed:
+      resp.syndication_urls = self.syndication_urls
+
     if (self.type != resp.type or
         as1.activity_changed(json_loads(resp.response_json),
                              json_loads(self.response_json),
@@ -995,25 +1296,61 @@ class Response(Webmentions):
       resp.restart(source)
     elif restart and resp is not self:  # ie it already existed
       resp.restart(source)
+    elif syndication_changed:
+      resp.put()
 
     return resp
 
+  @classmethod
+  def get_or_save_multi(cls, responses, source, restart=False):
+    """Bulk version of :meth:`get_or_save`.
+
+    Looks up all responses with a single ``get_multi``. New responses are
+    stored with batched ``put_multi`` calls, then their propagate tasks are
+    added, coalesced per source by :func:`util.add_propagate_tasks`. Responses
+    that already exist go through :meth:`get_or_save` individually,
+    transactionally, so that target merging and change detection are
+    unchanged.
+
+    Args:
+      responses: sequence of :class:`Response`, with unique keys
+      source: :class:`Source`
+      restart: boolean, passed through to :meth:`get_or_save`
+
+    Returns:
+      list of :class:`Response`, the stored entities, in the same order as
+      ``responses``
+    """
+    existing = ndb.get_multi([r.key for r in responses])
+
+    results = []
+    new = []
+    for resp, stored in zip(responses, existing):
+      if stored:
+        results.append(resp.get_or_save(source, restart=restart))
+      else:
+        if not (resp.unsent or resp.error):
+          resp.status = 'complete'
+        new.append(resp)
+        results.append(resp)
+
+    for i in range(0, len(new), PUT_MULTI_BATCH_SIZE):
+      ndb.put_multi(new[i:i + PUT_MULTI_BATCH_SIZE])
+
+    to_propagate = [resp for resp in new if resp.unsent or resp.error]
+    for resp in to_propagate:
+      logger.debug(f'New webmentions to propagate! {resp.label()}')
+    util.add_propagate_tasks(to_propagate)
+
+    return results
+
   def restart(self, source=None):
     """Moves status and targets to 'new' and adds a propagate task."""
     # add original posts with syndication URLs
-    # TODO: unify with Poll.repropagate_old_responses()
     if not source:
       source = self.source.get()
 
-    synd_urls = set()
-    for activity_json in self.activities_json:
-      activity = json_loads(activity_json)
-      url = activity.get('url') or activity.get('object', {}).get('url')
-      if url:
-        url = source.canonicalize_url(url, activity=activity)
-        if url:
-          synd_urls.add(url)
-
+    synd_urls = self.canonical_activity_urls(source)
     if synd_urls:
       self.unsent += [synd.original for synd in
                       SyndicatedPost.query(SyndicatedPost.syndication.IN(synd_urls))
@@ -1110,6 +1447,106 @@ class BlogWebmention(Publish, StringIdModel):
     return self.key.id().split()[1]
 
 
+class FeedFetch(StringIdModel):
+  """Conditional GET state for an author URL or rel-feed fetched by
+  :mod:`original_post_discovery`.
+
+  Parent is the :class:`Source`, key id is the URL.
+  """
+  etag = ndb.StringProperty(indexed=False)
+  last_modified = ndb.StringProperty(indexed=False)
+  # MD5 hex digest of the response body
+  content_hash = ndb.StringProperty(indexed=False)
+  # feed items from the last fetch, trimmed to the properties that
+  # original_post_discovery uses
+  items = ndb.JsonProperty(compressed=True)
+  # rel-feed and h-feed alternate URLs from the last fetch
+  feed_urls = ndb.StringProperty(repeated=True, indexed=False)
+  updated = ndb.DateTimeProperty(auto_now=True, tzinfo=timezone.utc)
+
+
+class CachedItem(StringIdModel):
+  """A rendered :class:`handlers.Item` response, shared across instances.
+
+  Key id is from :func:`handlers.item_cache_id`, eg
+  ``/like/fa.ke/123/456/789 html enabled 0123abcd``. Stores successful
+  renders and 404s. ``/cron/delete_expired_cached_items`` deletes them once
+  they're too old to serve, even as stale.
+  """
+  # 200 or 404. for 404s, body is the error message.
+  status = ndb.IntegerProperty(indexed=False)
+  # HTML or mf2 JSON
+  body = ndb.TextProperty(compressed=True)
+  # serve this as fresh until then
+  expires = ndb.DateTimeProperty(tzinfo=timezone.utc)
+  updated = ndb.DateTimeProperty(auto_now=True, tzinfo=timezone.utc)
+
+
+class UserIndex(ndb.Model):
+  """A source in the ``/users`` listing, across all silos.
+
+  Child of the source's entity, with key id ``users``. Only sources that are
+  enabled, have features, and have a name have one. Maintained by
+  :meth:`Source._post_put_hook` after each source put commits, but only when
+  :meth:`name_for` changes, tracked in :attr:`Source.user_index_name`.
+  """
+  # lower cased source name
+  name = ndb.StringProperty(required=True)
+
+  @staticmethod
+  def key_for(source):
+    return ndb.Key(UserIndex, 'users', parent=source.key)
+
+  @staticmethod
+  def name_for(source):
+    """Returns a source's index name, or None if it shouldn't be listed.
+
+    Args:
+      source (Source)
+    """
+    if source.name and source.features and source.status != 'disabled':
+      return source.name.lower()
+
+  @staticmethod
+  def update(source):
+    """Creates, updates, or deletes a source's index entry to match it.
+
+    Args:
+      source (Source)
+    """
+    key = UserIndex.key_for(source)
+    name = UserIndex.name_for(source)
+    if name:
+      UserIndex(key=key, name=name).put()
+    else:
+      key.delete()
+
+
+class PollHealth(ndb.Model):
+  """Stats from a source's most recent poll, for admin and user pages.
+
+  Child of the source's entity, with key id ``poll``. Written by
+  :class:`tasks.Poll` at the end of each poll, including failed ones.
+  """
+  # source's SHORT_NAME
+  silo = ndb.StringProperty()
+  poll_status = ndb.StringProperty(choices=('ok', 'polling', 'error'))
+  rate_limited = ndb.BooleanProperty()
+  # seconds
+  duration = ndb.FloatProperty(indexed=False)
+  # from util.count_http_calls(). silo API calls count as one each.
+  http_calls = ndb.IntegerProperty(indexed=False)
+  activities = ndb.IntegerProperty(indexed=False)
+  responses = ndb.IntegerProperty(indexed=False)
+  # ETA of the next poll task, if any
+  next_poll = ndb.DateTimeProperty(tzinfo=timezone.utc)
+  updated = ndb.DateTimeProperty(auto_now=True, tzinfo=timezone.utc)
+
+  @staticmethod
+  def key_for(source):
+    return ndb.Key(PollHealth, 'poll', parent=source.key)
+
+
 class SyndicatedPost(ndb.Model):
   """Represents a syndicated post and its discovered original (or not
   if we found no original post).  We discover the relationship by
@@ -1177,22 +1614,88 @@ class SyndicatedPost(ndb.Model):
     Returns:
       SyndicatedPost: newly created or preexisting entity
     """
-    # check for an exact match
-    duplicate = cls.query(cls.syndication == syndication,
-                          cls.original == original,
-                          ancestor=source.key).get()
-    if duplicate:
-      return duplicate
-
-    # delete blanks (expect at most 1 of each)
-    for filter in (ndb.AND(cls.syndication == syndication, cls.original == None),
-                   ndb.AND(cls.original == original, cls.syndication == None)):
-      for synd in cls.query(filter, ancestor=source.key).fetch(keys_only=True):
-        synd.delete()
-
     r = cls(parent=source.key, original=original, syndication=syndication)
-    r.put()
-    return r
+    by_urls, _ = cls._write_multi(source, inserts=[r])
+    return by_urls[(syndication, original)]
+
+  @classmethod
+  @ndb.transactional()
+  def write_multi(cls, source, inserts=(), original_blanks=(), deletes=()):
+    """Bulk version of :meth:`insert` and :meth:`insert_original_blank`.
+
+    Looks up existing relationships for all of the given URLs with batched IN
+    queries, then commits everything with one ``put_multi`` and one
+    ``delete_multi`` inside a single transaction on the source's entity group.
+
+    Args:
+      source (Source)
+      inserts (sequence of SyndicatedPost): new, unstored non-blank
+        relationships. Exact duplicates of existing relationships are skipped,
+        and blanks for their syndication or original URLs are deleted, like
+        :meth:`insert`.
+      original_blanks (sequence of str): original URLs to store original ->
+        None relationships for, if they don't have any relationships yet, like
+        :meth:`insert_original_blank`
+      deletes (sequence of SyndicatedPost): stored relationships to delete
+
+    Returns:
+      set of ndb.Key: every relationship deleted, including blanks
+    """
+    _, deleted = cls._write_multi(source, inserts=inserts,
+                                  original_blanks=original_blanks,
+                                  deletes=deletes)
+    return deleted
+
+  @classmethod
+  def _write_multi(cls, source, inserts=(), original_blanks=(), deletes=()):
+    """Implements :meth:`insert` and :meth:`write_multi`.
+
+    Should be called inside a transaction. Args are the same as
+    :meth:`write_multi`.
+
+    Returns:
+      (dict, set) tuple: maps (syndication, original) tuple to the stored
+      :class:`SyndicatedPost` for every relationship we looked up or wrote, and
+      set of ndb.Key: every relationship deleted
+    """
+    deleted = {synd.key for synd in deletes}
+
+    existing = {}
+    for prop, urls in ((cls.syndication, {r.syndication for r in inserts}),
+                       (cls.original, ({r.original for r in inserts} |
+                                       set(original_blanks)))):
+      urls = sorted(urls)
+      for i in range(0, len(urls), MAX_IN_QUERY_VALUES):
+        for synd in cls.query(prop.IN(urls[i:i + MAX_IN_QUERY_VALUES]),
+                              ancestor=source.key):
+          if synd.key not in deleted:
+            existing[synd.key] = synd
+
+    by_urls = {(synd.syndication, synd.original): synd
+               for synd in existing.values()}
+    to_put = []
+    for r in inserts:
+      if (r.syndication, r.original) in by_urls:
+        continue
+      # delete blanks (expect at most 1 of each)
+      for blank in ((r.syndication, None), (None, r.original)):
+        synd = by_urls.pop(blank, None)
+        if synd:
+          deleted.add(synd.key)
+      by_urls[(r.syndication, r.original)] = r
+      to_put.append(r)
+
+    originals = {original for _, original in by_urls}
+    for original in original_blanks:
+      if original not in originals:
+        originals.add(original)
+        to_put.append(cls(parent=source.key, original=original, syndication=None))
+
+    if deleted:
+      ndb.delete_multi(deleted)
+    if to_put:
+      ndb.put_multi(to_put)
+    return by_urls, deleted
 
 
 class Domain(StringIdModel):
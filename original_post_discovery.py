@@ -23,10 +23,15 @@ lookups in the following primary cases:
      *each* post permalink.
 """
 import collections
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import itertools
 import logging
 import mf2util
+import threading
+import urllib.parse
 
+from google.cloud import ndb
 from granary import as1
 from granary import microformats2
 from oauth_dropins.webutil.appengine_info import DEBUG
@@ -38,6 +43,10 @@ logger = logging.getLogger(__name__)
 
 MAX_PERMALINK_FETCHES = 10
 MAX_PERMALINK_FETCHES_BETA = 50
+# _process_author fetches up to this many permalinks at once, and at most this
+# many from any single host
+MAX_CONCURRENT_PERMALINK_FETCHES = 10
+MAX_PERMALINK_FETCHES_PER_HOST = 4
 MAX_FEED_ENTRIES = 100
 MAX_ORIGINAL_CANDIDATES = 10
 MAX_MENTION_CANDIDATES = 10
@@ -48,9 +57,17 @@ MAX_ALLOWABLE_QUERIES = 30
 
 MF2_HTML_MIME_TYPE= 'text/mf2+html'
 
+# whether _process_author sends conditional GETs for author URLs and rel-feeds
+# and skips parsing them when they haven't changed. see models.FeedFetch.
+FEED_FETCH_CACHE = True
+# don't store FeedFetch for longer URLs, since they're the key id
+MAX_FEED_FETCH_URL_LENGTH = 500
+# feed item properties that we use, and store in FeedFetch.items
+FEED_ITEM_PROPERTIES = ('url', 'syndication', 'published', 'updated')
+
 
 def discover(source, activity, fetch_hfeed=True, include_redirect_sources=True,
-             already_fetched_hfeeds=None):
+             already_fetched_hfeeds=None, relationships=None):
   """Augments the standard original post discovery algorithm with a
   reverse lookup that supports posts without a backlink or citation.
 
@@ -68,6 +85,9 @@ def discover(source, activity, fetch_hfeed=True, include_redirect_sources=True,
       well as their final destination URLs
     already_fetched_hfeeds (set of str): URLs that we have already fetched and
       run posse-post-discovery on, so we can avoid running it multiple times
+    relationships (dict): optional, from :func:`load_relationships`. If
+      provided, used to look up :class:`models.SyndicatedPost`\s for this
+      activity instead of querying for them.
 
   Returns:
     (set of str, set of str) tuple: (original post URLs, mention URLs)
@@ -129,10 +149,13 @@ def discover(source, activity, fetch_hfeed=True, include_redirect_sources=True,
     logger.info(f'{len(mentions)} mentions, pruning down to {MAX_MENTION_CANDIDATES}')
     mentions = sorted(mentions)[:MAX_MENTION_CANDIDATES]
 
+  # follow redirects for all candidates at once, in parallel
+  targets = util.get_webmention_targets(itertools.chain(originals, mentions))
+
   def resolve(urls):
     resolved = set()
     for url in urls:
-      final, domain, send = util.get_webmention_target(url)
+      final, domain, send = targets[url]
       if send and domain != source.gr_source.DOMAIN:
         resolved.add(final)
         if include_redirect_sources:
@@ -159,7 +182,8 @@ def discover(source, activity, fetch_hfeed=True, include_redirect_sources=True,
     syndication_url = source.canonicalize_url(syndication_url)
     if syndication_url:
       syndicated = _posse_post_discovery(source, activity, syndication_url,
-                                         fetch_hfeed, already_fetched_hfeeds)
+                                         fetch_hfeed, already_fetched_hfeeds,
+                                         relationships=relationships)
       originals.update(syndicated)
     originals = set(util.dedupe_urls(originals))
 
@@ -170,6 +194,44 @@ def discover(source, activity, fetch_hfeed=True, include_redirect_sources=True,
           else (set(syndicated), set()))
 
 
+def load_relationships(source, activities):
+  """Loads the source's :class:`models.SyndicatedPost`\s for many activities.
+
+  Uses batched IN queries instead of one query per activity. The result can be
+  passed to :func:`discover` for each activity.
+
+  Args:
+    source (models.Source)
+    activities (iterable of dict)
+
+  Returns:
+    dict: maps str canonicalized syndication URL to list of
+    :class:`models.SyndicatedPost`\s. Includes every activity's syndication
+    URL, even if it has no relationships yet.
+  """
+  if not source.get_author_urls():
+    return {}
+
+  urls = set()
+  for activity in activities:
+    url = activity.get('object', {}).get('url') or activity.get('url')
+    if url:
+      url = source.canonicalize_url(url)
+      if url:
+        urls.add(url)
+
+  relationships = {url: [] for url in urls}
+  urls = sorted(urls)
+  for i in range(0, len(urls), MAX_ALLOWABLE_QUERIES):
+    for synd in SyndicatedPost.query(
+        SyndicatedPost.syndication.IN(urls[i:i + MAX_ALLOWABLE_QUERIES]),
+        ancestor=source.key):
+      relationships[synd.syndication].append(synd)
+
+  logger.debug(f'loaded relationships for {len(relationships)} syndication URLs')
+  return relationships
+
+
 def refetch(source):
   """Refetch the author's URLs and look for new or updated syndication
   links that might not have been there the first time we looked.
@@ -217,7 +279,7 @@ def targets_for_response(resp, originals, mentions):
 
 
 def _posse_post_discovery(source, activity, syndication_url, fetch_hfeed,
-                          already_fetched_hfeeds):
+                          already_fetched_hfeeds, relationships=None):
   """Performs the actual meat of the posse-post-discover.
 
   Args:
@@ -230,15 +292,22 @@ def _posse_post_discovery(source, activity, syndication_url, fetch_hfeed,
       relationship
     already_fetched_hfeeds (set of str): URLs we've already fetched in a
       previous iteration
+    relationships (dict): optional, from :func:`load_relationships`. Updated
+      with anything we find or store for syndication_url.
 
   Return:
     list of str: original post urls, possibly empty
   """
   logger.info(f'starting posse post discovery with syndicated {syndication_url}')
 
-  relationships = SyndicatedPost.query(
-    SyndicatedPost.syndication == syndication_url,
-    ancestor=source.key).fetch()
+  index = relationships
+  if index is not None and syndication_url in index:
+    relationships = list(index[syndication_url])
+  else:
+    index = None
+    relationships = SyndicatedPost.query(
+      SyndicatedPost.syndication == syndication_url,
+      ancestor=source.key).fetch()
 
   if source.IGNORE_SYNDICATION_LINK_FRAGMENTS:
     relationships += SyndicatedPost.query(
@@ -256,12 +325,17 @@ def _posse_post_discovery(source, activity, syndication_url, fetch_hfeed,
     results = {}
     for url in _get_author_urls(source):
       if url not in already_fetched_hfeeds:
-        results.update(_process_author(source, url))
+        results.update(_process_author(source, url, relationships=index))
         already_fetched_hfeeds.add(url)
       else:
         logger.debug(f'skipping {url}, already fetched this round')
 
     relationships = results.get(syndication_url, [])
+    if index is not None:
+      # keep the index up to date for other activities in this batch
+      for url, new in results.items():
+        if url in index:
+          index[url].extend(new)
 
   if not relationships:
     # No relationships were found. Remember that we've seen this
@@ -269,6 +343,9 @@ def _posse_post_discovery(source, activity, syndication_url, fetch_hfeed,
     logger.debug(f'posse post discovery found no relationship for {syndication_url}')
     if fetch_hfeed:
       SyndicatedPost.insert_syndication_blank(source, syndication_url)
+      if index is not None:
+        index[syndication_url].append(SyndicatedPost(
+          parent=source.key, syndication=syndication_url, original=None))
 
   originals = [r.original for r in relationships if r.original]
   if originals:
@@ -276,7 +353,8 @@ def _posse_post_discovery(source, activity, syndication_url, fetch_hfeed,
   return originals
 
 
-def _process_author(source, author_url, refetch=False, store_blanks=True):
+def _process_author(source, author_url, refetch=False, store_blanks=True,
+                    relationships=None):
   """Fetch the author's domain URL, and look for syndicated posts.
 
   Args:
@@ -285,6 +363,8 @@ def _process_author(source, author_url, refetch=False, store_blanks=True):
     refetch (bool): whether to refetch and process entries we've seen before
     store_blanks (bool): whether we should store blank
       :class:`models.SyndicatedPost`\s when we don't find a relationship
+    relationships (dict): optional, from :func:`load_relationships`.
+      Relationships we delete are removed from it.
 
   Return:
     dict: maps syndicated_url to a list of new :class:`models.SyndicatedPost`\s
@@ -297,7 +377,7 @@ def _process_author(source, author_url, refetch=False, store_blanks=True):
 
   logger.debug(f'fetching author url {author_url}')
   try:
-    author_mf2 = util.fetch_mf2(author_url)
+    author = _fetch_feed(source, author_url)
   except AssertionError:
     raise  # for unit tests
   except BaseException:
@@ -306,18 +386,16 @@ def _process_author(source, author_url, refetch=False, store_blanks=True):
     logger.info(f'Could not fetch author url {author_url}', exc_info=True)
     return {}
 
-  if not author_mf2:
+  if not author:
     logger.debug('nothing found')
     return {}
 
-  feeditems = _find_feed_items(author_mf2)
+  fetches = [author]
+  feeditems = list(author.items)
 
   # try rel=feeds and rel=alternates
   feed_urls = set()
-  candidates = (author_mf2['rels'].get('feed', []) +
-                [a.get('url') for a in author_mf2.get('alternates', [])
-                 if a.get('type') == MF2_HTML_MIME_TYPE])
-  for feed_url in candidates:
+  for feed_url in author.feed_urls:
     # check that it's html, not too big, etc
     feed_url, _, feed_ok = util.get_webmention_target(feed_url)
     if feed_url == author_url:
@@ -330,11 +408,12 @@ def _process_author(source, author_url, refetch=False, store_blanks=True):
   for feed_url in feed_urls:
     try:
       logger.debug(f"fetching author's rel-feed {feed_url}")
-      feed_mf2 = util.fetch_mf2(feed_url)
-      if not feed_mf2:
+      feed = _fetch_feed(source, feed_url)
+      if not feed:
         logger.debug('nothing found')
         continue
-      feeditems = _merge_hfeeds(feeditems, _find_feed_items(feed_mf2))
+      fetches.append(feed)
+      feeditems = _merge_hfeeds(feeditems, feed.items)
       domain = util.domain_from_link(feed_url)
       if source.updates is not None and domain not in source.domains:
         domains = source.updates.setdefault('domains', source.domains)
@@ -347,6 +426,13 @@ def _process_author(source, author_url, refetch=False, store_blanks=True):
     except BaseException:
       logger.info(f'Could not fetch h-feed url {feed_url}.', exc_info=True)
 
+  # we've already processed everything in unchanged feeds. refetches still look
+  # at their permalinks, since those may have new syndication links even if the
+  # feed itself hasn't changed.
+  if not refetch and not any(fetch.changed for fetch in fetches):
+    logger.info(f"{author_url} and its feeds haven't changed since we last processed them")
+    return {}
+
   # sort by dt-updated/dt-published
   def updated_or_published(item):
     props = microformats2.first_props(item.get('properties'))
@@ -384,14 +470,21 @@ def _process_author(source, author_url, refetch=False, store_blanks=True):
   for r in preexisting_list:
     preexisting.setdefault(r.original, []).append(r)
 
+  # fetch permalinks in parallel, then process them serially in feed order
+  fetched = _fetch_permalinks(source, permalink_to_entry, refetch, preexisting)
+
   results = {}
+  failed = []
+  writes = _SyndicatedPostWrites(source, relationships=relationships)
   for permalink, entry in permalink_to_entry.items():
     logger.debug(f'processing permalink: {permalink}')
     new_results = process_entry(
       source, permalink, entry, refetch, preexisting.get(permalink, []),
-      store_blanks=store_blanks)
+      store_blanks=store_blanks, fetched=fetched.get(permalink), writes=writes,
+      failed=failed)
     for key, value in new_results.items():
       results.setdefault(key, []).extend(value)
+  writes.commit()
 
   if source.updates is not None and results:
     # keep track of the last time we've seen rel=syndication urls for
@@ -400,9 +493,85 @@ def _process_author(source, author_url, refetch=False, store_blanks=True):
     # Source will be saved at the end of each round of polling
     source.updates['last_syndication_url'] = util.now()
 
+  # only store feed state once we've processed it, and all of its permalinks
+  # fetched ok. otherwise an unchanged feed would skip the failed ones next time.
+  if failed:
+    logger.info(f"{len(failed)} permalinks failed, not storing feed state so we'll retry them: {failed}")
+  else:
+    changed = [fetch for fetch in fetches if fetch.changed and fetch.key.id()]
+    if changed:
+      ndb.put_multi(changed)
+
   return results
 
 
+def _fetch_feed(source, url):
+  """Fetches an author URL or rel-feed and extracts its feed items.
+
+  Sends a conditional GET with the ETag and Last-Modified from the last fetch,
+  if we have them. If the server returns 304, or the response body is the same
+  as last time, doesn't parse it and uses the stored feed items instead.
+
+  Args:
+    source (models.Source)
+    url (str)
+
+  Returns:
+    models.FeedFetch: with ``items`` and ``feed_urls`` populated, and
+    ``changed`` set to whether the page changed since we last stored it. Not
+    stored, and has no key id if ``FEED_FETCH_CACHE`` is off or the URL is too
+    long. Returns None if the URL has a fragment and it isn't found.
+  """
+  cacheable = FEED_FETCH_CACHE and len(url) <= MAX_FEED_FETCH_URL_LENGTH
+  fetch = None
+  headers = {}
+  if cacheable:
+    fetch = models.FeedFetch.get_by_id(url, parent=source.key)
+    if fetch:
+      if fetch.etag:
+        headers['If-None-Match'] = fetch.etag
+      if fetch.last_modified:
+        headers['If-Modified-Since'] = fetch.last_modified
+
+  resp = util.requests_get(util.fragmentless(url), headers=headers)
+  if fetch and resp.status_code == 304:
+    logger.debug(f'{url} not modified')
+    fetch.changed = False
+    return fetch
+  resp.raise_for_status()
+  body = util.read_body(resp, util.MAX_MF2_FETCH_BYTES)
+
+  content_hash = hashlib.md5(body).hexdigest()
+  if fetch and fetch.content_hash == content_hash:
+    logger.debug(f"{url} hasn't changed")
+    fetch.changed = False
+    return fetch
+
+  mf2 = util.parse_mf2(util.html_input(resp, body), url=resp.url,
+                       id=urllib.parse.urlparse(url).fragment)
+  if not mf2:
+    return None
+
+  props = FEED_ITEM_PROPERTIES
+  fetch = models.FeedFetch(
+    id=url if cacheable else None, parent=source.key,
+    etag=resp.headers.get('ETag'),
+    last_modified=resp.headers.get('Last-Modified'),
+    content_hash=content_hash,
+    items=[{
+      'type': item.get('type', []),
+      'properties': {name: val for name, val in item.get('properties', {}).items()
+                     if name in props},
+    } for item in _find_feed_items(mf2)],
+    feed_urls=[feed_url for feed_url in
+               mf2['rels'].get('feed', []) +
+               [a.get('url') for a in mf2.get('alternates', [])
+                if a.get('type') == MF2_HTML_MIME_TYPE]
+               if feed_url])
+  fetch.changed = True
+  return fetch
+
+
 def _merge_hfeeds(feed1, feed2):
   """Merge items from two ``h-feeds`` into a composite feed.
 
@@ -453,8 +622,137 @@ def _find_feed_items(mf2):
   return feeditems
 
 
+def _fetch_permalinks(source, permalink_to_entry, refetch, preexisting):
+  """Fetches the permalinks that :func:`process_entry` will need, concurrently.
+
+  Only fetches permalinks whose ``h-feed`` entries have no ``u-syndication``
+  links, since :func:`process_entry` doesn't need the others. Uses a thread
+  pool of up to ``MAX_CONCURRENT_PERMALINK_FETCHES`` threads, with at most
+  ``MAX_PERMALINK_FETCHES_PER_HOST`` fetches to any one host at a time. Threads
+  only make HTTP requests; all datastore work stays in :func:`process_entry`.
+
+  Args:
+    source (models.Source)
+    permalink_to_entry (dict): maps str permalink to its ``h-feed`` entry
+    refetch (bool): whether we're refetching entries we've seen before
+    preexisting (dict): maps str permalink to list of previously discovered
+      :class:`models.SyndicatedPost`\s
+
+  Returns:
+    dict: maps str permalink to (str resolved permalink, bool type ok, dict
+    mf2 or None, bool success) tuple for :func:`process_entry`. Empty if
+    ``MAX_CONCURRENT_PERMALINK_FETCHES`` is 1 or less, or if the source has
+    had ``u-syndication`` links in its feed before, since then
+    :func:`process_entry` doesn't fetch permalinks at all.
+  """
+  if MAX_CONCURRENT_PERMALINK_FETCHES <= 1 or source.last_feed_syndication_url:
+    return {}
+
+  permalinks = [
+    permalink for permalink, entry in permalink_to_entry.items()
+    if (refetch or not preexisting.get(permalink)) and
+    not any(isinstance(url, str) for url in
+            entry.get('properties', {}).get('syndication', []))]
+  if len(permalinks) <= 1:
+    return {}
+
+  host_limits = {util.domain_from_link(permalink):
+                 threading.BoundedSemaphore(MAX_PERMALINK_FETCHES_PER_HOST)
+                 for permalink in permalinks}
+
+  def fetch(permalink):
+    with host_limits[util.domain_from_link(permalink)]:
+      resolved, _, type_ok = util.get_webmention_target(permalink)
+      return (resolved, type_ok) + _fetch_permalink(resolved, type_ok)
+
+  workers = min(len(permalinks), MAX_CONCURRENT_PERMALINK_FETCHES)
+  logger.debug(f'fetching {len(permalinks)} permalinks with {workers} threads')
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    return dict(zip(permalinks, executor.map(util.in_context(fetch), permalinks)))
+
+
+def _fetch_permalink(permalink, type_ok):
+  """Fetches and parses a post permalink.
+
+  Args:
+    permalink (str): already resolved with :func:`util.get_webmention_target`
+    type_ok (bool): whether it's HTML. If False, doesn't fetch it.
+
+  Returns:
+    (dict mf2 or None, bool success) tuple
+  """
+  try:
+    if type_ok:
+      logger.debug(f'fetching post permalink {permalink}')
+      return util.fetch_mf2(permalink), True
+  except AssertionError:
+    raise  # for unit tests
+  except BaseException:
+    # TODO limit the number of allowed failures
+    logger.info(f'Could not fetch permalink {permalink}', exc_info=True)
+    return None, False
+
+  return None, True
+
+
+class _SyndicatedPostWrites:
+  """Collects :class:`models.SyndicatedPost` writes so we can commit them at once.
+
+  Used by :func:`_process_author` to store everything it finds in one
+  transaction with :meth:`models.SyndicatedPost.write_multi`, instead of one
+  transaction per relationship.
+
+  Attributes:
+    source (models.Source)
+    inserts (list of models.SyndicatedPost): new, unstored relationships
+    original_blanks (list of str): original URLs with no relationships
+    deletes (list of models.SyndicatedPost): stored relationships to delete
+    relationships (dict): optional, from :func:`load_relationships`. Deleted
+      relationships are removed from it on :meth:`commit`.
+  """
+  def __init__(self, source, relationships=None):
+    self.source = source
+    self.relationships = relationships
+    self.inserts = []
+    self.original_blanks = []
+    self.deletes = []
+
+  def insert(self, syndication, original):
+    """Adds a new relationship, or returns one we've already added.
+
+    Args:
+      syndication (str)
+      original (str)
+
+    Returns:
+      models.SyndicatedPost: not stored until :meth:`commit`
+    """
+    for r in self.inserts:
+      if r.syndication == syndication and r.original == original:
+        return r
+
+    r = SyndicatedPost(parent=self.source.key, syndication=syndication,
+                       original=original)
+    self.inserts.append(r)
+    return r
+
+  def commit(self):
+    """Stores all pending writes."""
+    if self.inserts or self.original_blanks or self.deletes:
+      logger.debug(f'storing {len(self.inserts)} relationships and {len(self.original_blanks)} blanks, deleting {len(self.deletes)}')
+      deleted = SyndicatedPost.write_multi(
+        self.source, inserts=self.inserts,
+        original_blanks=self.original_blanks, deletes=self.deletes)
+      if self.relationships and deleted:
+        for url, synds in self.relationships.items():
+          self.relationships[url] = [s for s in synds if s.key not in deleted]
+    self.inserts = []
+    self.original_blanks = []
+    self.deletes = []
+
+
 def process_entry(source, permalink, feed_entry, refetch, preexisting,
-                  store_blanks=True):
+                  store_blanks=True, fetched=None, writes=None, failed=None):
   """Fetch and process an h-entry and save a new :class:`models.SyndicatedPost`.
 
   Args:
@@ -467,10 +765,26 @@ def process_entry(source, permalink, feed_entry, refetch, preexisting,
       for this permalink
     store_blanks (bool): whether we should store blank
       :class:`models.SyndicatedPost`\s when we don't find a relationship
+    fetched (tuple): optional, this permalink's result from
+      :func:`_fetch_permalinks`. If not provided, we fetch it here if necessary.
+    writes (_SyndicatedPostWrites): optional. If provided, new and deleted
+      relationships are added to it, and the caller should commit them. If not,
+      they're stored before returning.
+    failed (list): optional. If provided, and fetching the permalink fails,
+      it's appended here.
 
   Returns:
     dict: maps syndicated url to a list of new :class:`models.SyndicatedPost`\s
   """
+  if writes is None:
+    writes = _SyndicatedPostWrites(source)
+    try:
+      return process_entry(source, permalink, feed_entry, refetch, preexisting,
+                           store_blanks=store_blanks, fetched=fetched,
+                           writes=writes, failed=failed)
+    finally:
+      writes.commit()
+
   # if the post has already been processed, do not add to the results
   # since this method only returns *newly* discovered relationships.
   if preexisting:
@@ -485,29 +799,25 @@ def process_entry(source, permalink, feed_entry, refetch, preexisting,
 
   # first try with the h-entry from the h-feed. if we find the syndication url
   # we're looking for, we don't have to fetch the permalink
-  permalink, _, type_ok = util.get_webmention_target(permalink)
+  if fetched:
+    permalink, type_ok = fetched[:2]
+  else:
+    permalink, _, type_ok = util.get_webmention_target(permalink)
   usynd = feed_entry.get('properties', {}).get('syndication', [])
   usynd_urls = {url for url in usynd if isinstance(url, str)}
   if usynd_urls:
     logger.debug(f'u-syndication links on the h-feed h-entry: {usynd_urls}')
-  results = _process_syndication_urls(source, permalink, usynd_urls, preexisting)
+  results = _process_syndication_urls(source, permalink, usynd_urls, preexisting,
+                                      writes)
   success = True
 
   if results:
     source.updates['last_feed_syndication_url'] = util.now()
   elif not source.last_feed_syndication_url or not feed_entry:
     # fetch the full permalink page if we think it might have more details
-    mf2 = None
-    try:
-      if type_ok:
-        logger.debug(f'fetching post permalink {permalink}')
-        mf2 = util.fetch_mf2(permalink)
-    except AssertionError:
-      raise  # for unit tests
-    except BaseException:
-      # TODO limit the number of allowed failures
-      logger.info(f'Could not fetch permalink {permalink}', exc_info=True)
-      success = False
+    mf2, success = fetched[2:] if fetched else _fetch_permalink(permalink, type_ok)
+    if not success and failed is not None:
+      failed.append(permalink)
 
     if mf2:
       syndication_urls = set()
@@ -526,7 +836,7 @@ def process_entry(source, permalink, feed_entry, refetch, preexisting,
         syndication_urls.update(url for url in usynd
                                 if isinstance(url, str))
       results = _process_syndication_urls(
-        source, permalink, syndication_urls, preexisting)
+        source, permalink, syndication_urls, preexisting, writes)
 
   # detect and delete SyndicatedPosts that were removed from the site
   if success:
@@ -534,7 +844,7 @@ def process_entry(source, permalink, feed_entry, refetch, preexisting,
     for syndpost in preexisting:
       if syndpost.syndication and syndpost not in result_syndposts:
         logger.info(f'deleting relationship that disappeared: {syndpost}')
-        syndpost.key.delete()
+        writes.deletes.append(syndpost)
         preexisting.remove(syndpost)
 
   if not results:
@@ -544,7 +854,7 @@ def process_entry(source, permalink, feed_entry, refetch, preexisting,
       # remember that this post doesn't have syndication links for this
       # particular source
       logger.debug(f'saving empty relationship so that {permalink} will not be searched again')
-      SyndicatedPost.insert_original_blank(source, permalink)
+      writes.original_blanks.append(permalink)
 
   # only return results that are not in the preexisting list
   new_results = {}
@@ -559,23 +869,23 @@ def process_entry(source, permalink, feed_entry, refetch, preexisting,
 
 
 def _process_syndication_urls(source, permalink, syndication_urls,
-                              preexisting):
+                              preexisting, writes):
   """Process a list of syndication URLs looking for one that matches the
-  current source. If one is found, stores a new :class:`models.SyndicatedPost`
-  in the db.
+  current source. If one is found, adds a new :class:`models.SyndicatedPost`
+  to writes.
 
   Args:
     source (models.Source)
     permalink (str): the current ``h-entry`` permalink
     syndication_urls (sequence of str): the unfitered list of syndication urls
     preexisting: list of models.SyndicatedPost: previously discovered
+    writes (_SyndicatedPostWrites)
 
   Returns:
     dict: maps str syndication url to list of :class:`models.SyndicatedPost`\s
   """
   results = {}
-  # save the results (or lack thereof) to the db, and put them in a
-  # map for immediate use
+  # add the results to writes, and put them in a map for immediate use
   for url in syndication_urls:
     # source-specific logic to standardize the URL
     url = source.canonicalize_url(url)
@@ -593,7 +903,7 @@ def _process_syndication_urls(source, permalink, syndication_urls,
                          and sp.original == permalink), None)
     if not relationship:
       logger.debug(f'saving discovered relationship {url} -> {permalink}')
-      relationship = SyndicatedPost.insert(source, syndication=url, original=permalink)
+      relationship = writes.insert(url, permalink)
     results.setdefault(url, []).append(relationship)
 
   return results
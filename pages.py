@@ -33,6 +33,13 @@ SITES = ','.join(list(models.sources.keys()) + ['fake'])  # for unit tests
 
 RECENT_PRIVATE_POSTS_THRESHOLD = 5
 
+# user pages cache each response's prepared template data for this long. keyed
+# on the response's updated timestamp, which every put changes, so entries never
+# go stale.
+USER_RESPONSE_CACHE_TIME = datetime.timedelta(days=1)
+USER_RESPONSES_PAGE_SIZE = 10
+USER_RESPONSES_MAX_SCAN = 200
+
 
 @app.route('/', methods=['HEAD'])
 @app.route('/users', methods=['HEAD'])
@@ -68,28 +75,32 @@ def which_bridgy():
 def users():
   """View for ``/users``.
 
-  Semi-optimized. Pages by source name. Queries each source type for results
-  with name greater than the start_name query param, then merge sorts the
-  results and truncates at ``PAGE_SIZE``\.
-
-  The start_name param is expected to be capitalized because capital letters
-  sort lexicographically before lower case letters. An alternative would be to
-  store a lower cased version of the name in another property and query on that.
+  Pages through :class:`models.UserIndex`\, which has one entry per enabled
+  source with features across all silos, in lower cased name order. Starts at
+  the ``start_name`` query param if provided, continues from ``cursor`` if
+  provided.
   """
   PAGE_SIZE = 50
 
-  start_name = request.values.get('start_name', '')
-  queries = [cls.query(cls.name >= start_name).fetch_async(PAGE_SIZE)
-             for cls in models.sources.values()]
+  query = models.UserIndex.query().order(models.UserIndex.name)
+  start_name = request.values.get('start_name', '').lower()
+  if start_name:
+    query = query.filter(models.UserIndex.name >= start_name)
+
+  cursor = request.values.get('cursor')
+  try:
+    cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+  except Exception:
+    error(f'Invalid cursor {cursor}')
 
-  sources = sorted(itertools.chain(*[q.get_result() for q in queries]),
-                   key=lambda s: (s.name.lower(), s.GR_CLASS.NAME))
-  sources = [util.preprocess_source(s) for s in sources
-             if s.name.lower() >= start_name.lower() and s.features
-                and s.status != 'disabled'
-             ][:PAGE_SIZE]
+  keys, next_cursor, more = query.fetch_page(PAGE_SIZE, start_cursor=cursor,
+                                             keys_only=True)
+  sources = [util.preprocess_source(s) for s in
+             ndb.get_multi([key.parent() for key in keys]) if s]
+  next_cursor = next_cursor.urlsafe().decode() if more and next_cursor else None
 
-  return render_template('users.html', PAGE_SIZE=PAGE_SIZE, sources=sources)
+  return render_template('users.html', sources=sources, next_cursor=next_cursor,
+                         start_name=start_name)
 
 
 @app.route(f'/<any({SITES}):site>/<id>')
@@ -139,106 +150,14 @@ def user(site, id):
 
   # Responses
   if 'listen' in source.features or 'email' in source.features:
-    vars['responses'] = []
-    query = Response.query().filter(Response.source == source.key)
-
-    # if there's a paging param (responses_before or responses_after), update
-    # query with it
-    def get_paging_param(param):
-      val = request.values.get(param)
-      try:
-        return util.parse_iso8601(val.replace(' ', '+')) if val else None
-      except BaseException:
-        error(f"Couldn't parse {param}, {val!r} as ISO8601")
-
-    before = get_paging_param('responses_before')
-    after = get_paging_param('responses_after')
-    if before and after:
-      error("can't handle both responses_before and responses_after")
-    elif after:
-      query = query.filter(Response.updated > after).order(Response.updated)
-    elif before:
-      query = query.filter(Response.updated < before).order(-Response.updated)
-    else:
-      query = query.order(-Response.updated)
-
-    query_iter = query.iter()
-    for i, r in enumerate(query_iter):
-      r.response = json_loads(r.response_json)
-      r.activities = [json_loads(a) for a in r.activities_json]
-
-      if (not as1.is_public(r.response) or
-          not all(as1.is_public(a) for a in r.activities)):
-        continue
-      elif r.type == 'post':
-        r.activities = []
-
-      verb = r.response.get('verb')
-      r.actor = (r.response.get('object') if verb == 'invite'
-                 else r.response.get('author') or r.response.get('actor')
-                ) or {}
-      r.actor['url'] = as1.get_url(r.actor)
-
-      activity_content = ''
-      for a in r.activities + [r.response]:
-        if not a.get('content'):
-          obj = a.get('object', {})
-          a['content'] = activity_content = (
-            obj.get('content') or obj.get('displayName') or
-            # historical, from a Reddit bug fixed in granary@4f9df7c
-            obj.get('name') or '')
-
-      response_content = r.response.get('content')
-      phrases = {
-        'like': 'liked this',
-        'repost': 'reposted this',
-        'rsvp-yes': 'is attending',
-        'rsvp-no': 'is not attending',
-        'rsvp-maybe': 'might attend',
-        'rsvp-interested': 'is interested',
-        'invite': 'is invited',
-      }
-      phrase = phrases.get(r.type) or phrases.get(verb)
-      if phrase and (r.type != 'repost' or
-                     activity_content.startswith(response_content)):
-        r.response['content'] = f'{r.actor.get("displayName") or ""} {phrase}.'
-
-      # convert image URL to https if we're serving over SSL
-      # account for fact image might be a list
-      image = util.get_first(r.actor, 'image', {})
-      image_url = image.get('url')
-      if image_url:
-        image['url'] = util.update_scheme(image_url, request)
-      r.actor['image'] = image
-      # generate original post links
-      r.links = process_webmention_links(r)
-      r.original_links = [util.pretty_link(url, new_tab=True)
-                          for url in r.original_posts]
-
-      vars['responses'].append(r)
-      if len(vars['responses']) >= 10 or i > 200:
-        break
-
-    vars['responses'].sort(key=lambda r: r.updated, reverse=True)
-
-    # calculate new paging param(s)
-    new_after = (
-      before if before else
-      vars['responses'][0].updated if
-        vars['responses'] and query_iter.probably_has_next() and (before or after)
-      else None)
-    if new_after:
-      vars['responses_after_link'] = f'?responses_after={new_after.isoformat()}#responses'
-
-    new_before = (
-      after if after else
-      vars['responses'][-1].updated if
-        vars['responses'] and query_iter.probably_has_next()
-      else None)
-    if new_before:
-      vars['responses_before_link'] = f'?responses_before={new_before.isoformat()}#responses'
-
-    vars['next_poll'] = max(source.last_poll_attempt + source.poll_period(),
+    vars['responses_html'] = render_template(
+      '_user_responses.html', source=source, logs=logs,
+      **user_responses(source))
+
+    health = models.PollHealth.key_for(source).get()
+    next_poll = (health.next_poll if health and health.next_poll
+                 else source.last_poll_attempt + source.poll_period())
+    vars['next_poll'] = max(next_poll,
                             # lower bound is 1 minute from now
                             util.now() + datetime.timedelta(seconds=90))
 
@@ -301,6 +220,136 @@ def user(site, id):
   return render_template(f'{source.SHORT_NAME}_user.html', **vars)
 
 
+def user_responses(source):
+  """Loads and prepares a source's recent responses for its user page.
+
+  Queries only keys and ``updated`` timestamps, then loads each response's
+  template data from the cache, or from its precomputed
+  :meth:`models.Response.summary` on a miss. Pages with the
+  ``responses_before`` and ``responses_after`` query params.
+
+  Args:
+    source (models.Source)
+
+  Returns:
+    dict: template vars, ``responses`` and optionally
+    ``responses_after_link`` and ``responses_before_link``
+  """
+  vars = {}
+  responses = []
+  query = Response.query().filter(Response.source == source.key)
+
+  # if there's a paging param (responses_before or responses_after), update
+  # query with it
+  def get_paging_param(param):
+    val = request.values.get(param)
+    try:
+      return util.parse_iso8601(val.replace(' ', '+')) if val else None
+    except BaseException:
+      error(f"Couldn't parse {param}, {val!r} as ISO8601")
+
+  before = get_paging_param('responses_before')
+  after = get_paging_param('responses_after')
+  if before and after:
+    error("can't handle both responses_before and responses_after")
+  elif after:
+    query = query.filter(Response.updated > after).order(Response.updated)
+  elif before:
+    query = query.filter(Response.updated < before).order(-Response.updated)
+  else:
+    query = query.order(-Response.updated)
+
+  query_iter = query.iter(projection=[Response.updated])
+  scanned = 0
+  has_more = False
+  while len(responses) < USER_RESPONSES_PAGE_SIZE and scanned <= USER_RESPONSES_MAX_SCAN:
+    batch = list(itertools.islice(query_iter, USER_RESPONSES_PAGE_SIZE))
+    if not batch:
+      break
+    scanned += len(batch)
+
+    cache_keys = [user_response_cache_key(r) for r in batch]
+    cached = cache.get_many(*cache_keys)
+    misses = [r.key for r, data in zip(batch, cached) if data is None]
+    loaded = {r.key: r for r in ndb.get_multi(misses) if r}
+
+    for i, (r, cache_key, data) in enumerate(zip(batch, cache_keys, cached)):
+      if data is None:
+        if r.key not in loaded:
+          continue
+        # non-public responses are cached as False so they're skipped quickly
+        data = prepare_user_response(loaded[r.key]) or False
+        cache.set(cache_key, data,
+                  timeout=USER_RESPONSE_CACHE_TIME.total_seconds())
+
+      if data:
+        # convert image URL to https if we're serving over SSL
+        image_url = data['actor']['image'].get('url')
+        if image_url:
+          data['actor']['image']['url'] = util.update_scheme(image_url, request)
+        responses.append(data)
+        if len(responses) >= USER_RESPONSES_PAGE_SIZE:
+          has_more = i < len(batch) - 1
+          break
+
+  has_more = has_more or query_iter.probably_has_next()
+  responses.sort(key=lambda r: r['updated'], reverse=True)
+
+  # calculate new paging param(s)
+  new_after = (
+    before if before else
+    responses[0]['updated'] if responses and has_more and (before or after)
+    else None)
+  if new_after:
+    vars['responses_after_link'] = f'?responses_after={new_after.isoformat()}#responses'
+
+  new_before = (
+    after if after else
+    responses[-1]['updated'] if responses and has_more
+    else None)
+  if new_before:
+    vars['responses_before_link'] = f'?responses_before={new_before.isoformat()}#responses'
+
+  vars['responses'] = responses
+  return vars
+
+
+def user_response_cache_key(response):
+  """Returns the cache key for a response's user page template data.
+
+  Args:
+    response (models.Response): may be a projection with only ``updated``
+  """
+  return f'user_response {response.key.urlsafe().decode()} {response.updated.isoformat()}'
+
+
+def prepare_user_response(r):
+  """Generates the user page template data for a response.
+
+  Args:
+    r (models.Response)
+
+  Returns:
+    dict, or None if the response or any of its activities isn't public
+  """
+  summary = r.summary()
+  if not summary['public']:
+    return None
+
+  return {
+    'key': r.key,
+    'type': r.type,
+    'status': r.status,
+    'updated': r.updated,
+    'response': {'url': summary['url'], 'content': summary['content']},
+    'activities': summary['activities'],
+    'actor': summary['actor'],
+    'links': process_webmention_links(r),
+    'original_links': [util.pretty_link(url, new_tab=True)
+                       for url in r.original_posts],
+  }
+
+
 def process_webmention_links(e):
   """Generates pretty HTML for the links in a :class:`models.Webmentions` entity.
 
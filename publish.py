@@ -303,7 +303,7 @@ class PublishBase(webmention.Webmention):
     if util.domain_or_parent_in(domain, util.DOMAINS):
       return self.error(f'Source URL should be on your own site, not {domain}')
 
-    sources = source_cls.query().filter(source_cls.domains == domain).fetch(100)
+    sources = source_cls.sources_for_domain(domain)
     if not sources:
       msg = f'Could not find <b>{source_cls.GR_CLASS.NAME}</b> account for <b>{domain}</b>. Check that your {source_cls.GR_CLASS.NAME} profile has {domain} in its <em>web site</em> or <em>link</em> field, then try signing up again.'
       return self.error(msg, html=msg)
@@ -364,7 +364,8 @@ class PublishBase(webmention.Webmention):
       obj['url'] = self.source_url()
     elif 'url' not in obj:
       obj['url'] = self.fetched.url
-    logger.debug(f'Converted to ActivityStreams object: {json_dumps(obj, indent=2)}')
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug(f'Converted to ActivityStreams object: {json_dumps(obj, indent=2)}')
 
     # posts and comments need content
     obj_type = obj.get('objectType')
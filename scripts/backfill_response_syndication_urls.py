@@ -0,0 +1,36 @@
+#!/usr/local/bin/python
+"""Populates :attr:`models.Response.syndication_urls` for existing responses.
+
+Poll sets it on new responses, so this only needs to run once, for responses
+stored before it was added. Set tasks.RESPONSE_SYNDICATION_URLS_BACKFILLED to
+True afterward so that Refetch stops scanning for responses without it.
+"""
+from google.cloud import ndb
+
+import models
+import blogger, bluesky, facebook, flickr, github, instagram, mastodon, medium, reddit, tumblr, twitter, wordpress_rest
+
+sources = {}
+batch = []
+
+for resp in models.Response.query():
+  if resp.syndication_urls or not resp.source:
+    continue
+
+  if resp.source not in sources:
+    sources[resp.source] = resp.source.get()
+  source = sources[resp.source]
+  if not source:
+    continue
+
+  resp.syndication_urls = sorted(resp.canonical_activity_urls(source))
+  if resp.syndication_urls:
+    print(resp.key.id())
+    batch.append(resp)
+
+  if len(batch) >= models.PUT_MULTI_BATCH_SIZE:
+    ndb.put_multi(batch)
+    batch = []
+
+if batch:
+  ndb.put_multi(batch)
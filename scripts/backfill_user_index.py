@@ -0,0 +1,17 @@
+#!/usr/local/bin/python
+"""Creates :class:`models.UserIndex` entries for all existing sources.
+
+Source puts maintain these, so this only needs to run once, for sources that
+haven't been written since :class:`models.UserIndex` was added.
+"""
+import models
+import blogger, bluesky, facebook, flickr, github, instagram, mastodon, medium, reddit, tumblr, twitter, wordpress_rest
+
+
+for cls in models.sources.values():
+  for src in cls.query(cls.features > ''):
+    print(src.bridgy_path())
+    models.UserIndex.update(src)
+    # so that later puts don't rewrite the index entry
+    src.updates = {'user_index_name': models.UserIndex.name_for(src) or ''}
+    models.Source.put_updates(src)
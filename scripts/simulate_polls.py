@@ -0,0 +1,129 @@
+#!/usr/local/bin/python
+"""Replays historical responses to compare fixed and adaptive poll scheduling.
+
+Input is a CSV file with one row per response, with columns source and
+created, eg exported from BigQuery with:
+
+  SELECT source.name AS source, created FROM `brid-gy.datastore.Response`
+
+For each source, simulates polling every --fixed minutes, and polling with
+util.update_response_rate() and util.adaptive_poll_period(). Reports the
+number of polls, ie silo API calls, and the mean backfeed latency, ie time from
+response to the poll that finds it, for both. Then searches for the adaptive
+target responses per poll that matches the fixed schedule's mean latency, and
+reports how many polls that saves.
+
+Usage: simulate_polls.py responses.csv [--fixed 30] [--min 5] [--max 1440]
+"""
+import argparse
+import collections
+import csv
+from datetime import timedelta
+
+from oauth_dropins.webutil import util as webutil_util
+
+import util
+
+
+def simulate(times, next_period):
+  """Simulates polling one source.
+
+  Args:
+    times (sequence of datetime): response creation times, sorted
+    next_period (callable): takes the current response rate and returns the
+      next poll period as a :class:`datetime.timedelta`
+
+  Returns:
+    (int polls, list of timedelta latencies) tuple
+  """
+  polls = 0
+  latencies = []
+  rate = None
+  now = times[0]
+  end = times[-1]
+  i = 0
+
+  while i < len(times) and now <= end + timedelta(days=1):
+    period = next_period(rate)
+    last = now
+    now += period
+    polls += 1
+
+    found = 0
+    while i < len(times) and times[i] <= now:
+      latencies.append(now - times[i])
+      found += 1
+      i += 1
+
+    rate = util.update_response_rate(rate, found, now - last)
+
+  return polls, latencies
+
+
+def run(by_source, next_period):
+  """Simulates all sources. Returns (int polls, timedelta mean latency)."""
+  total_polls = 0
+  latencies = []
+  for times in by_source.values():
+    polls, source_latencies = simulate(times, next_period)
+    total_polls += polls
+    latencies += source_latencies
+
+  mean = sum(latencies, timedelta()) / len(latencies) if latencies else timedelta()
+  return total_polls, mean
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Compare fixed and adaptive poll scheduling on historical responses.')
+  parser.add_argument('csv', help='CSV file with source and created columns')
+  parser.add_argument('--fixed', type=float, default=30,
+                      help='fixed poll period, in minutes')
+  parser.add_argument('--min', type=float, default=5,
+                      help='adaptive poll period lower bound, in minutes')
+  parser.add_argument('--max', type=float, default=24 * 60,
+                      help='adaptive poll period upper bound, in minutes')
+  args = parser.parse_args()
+
+  by_source = collections.defaultdict(list)
+  with open(args.csv, newline='') as f:
+    for row in csv.DictReader(f):
+      by_source[row['source']].append(webutil_util.parse_iso8601(row['created']))
+  for times in by_source.values():
+    times.sort()
+
+  fixed = timedelta(minutes=args.fixed)
+  min_period = timedelta(minutes=args.min)
+  max_period = timedelta(minutes=args.max)
+
+  def adaptive(target):
+    return lambda rate: (fixed if rate is None else
+                         util.adaptive_poll_period(rate, min_period, max_period,
+                                                   target=target))
+
+  fixed_polls, fixed_latency = run(by_source, lambda rate: fixed)
+  print(f'{len(by_source)} sources, {sum(len(t) for t in by_source.values())} responses')
+  print(f'fixed:    {fixed_polls} polls, mean latency {fixed_latency}')
+
+  target = util.ADAPTIVE_POLL_TARGET_RESPONSES
+  polls, latency = run(by_source, adaptive(target))
+  print(f'adaptive: {polls} polls, mean latency {latency} (target {target})')
+
+  # latency grows with the target, so binary search for the one that matches
+  low, high = 0.001, 100.0
+  for _ in range(30):
+    target = (low + high) / 2
+    polls, latency = run(by_source, adaptive(target))
+    if latency > fixed_latency:
+      high = target
+    else:
+      low = target
+
+  polls, latency = run(by_source, adaptive(low))
+  print(f'adaptive at equal latency: {polls} polls, mean latency {latency} (target {low:.3f})')
+  if fixed_polls:
+    print(f'saves {fixed_polls - polls} polls, {(fixed_polls - polls) / fixed_polls:.0%}')
+
+
+if __name__ == '__main__':
+  main()
@@ -1,7 +1,9 @@
 """Task queue handlers."""
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import gc
 import logging
+import time
 
 from flask import g, request
 from flask.views import View
@@ -11,6 +13,7 @@ from granary import as1
 from oauth_dropins.webutil import logs, webmention
 from oauth_dropins.webutil.flask_util import error
 from oauth_dropins.webutil.util import json_dumps, json_loads
+import requests
 
 import models, original_post_discovery, util
 from flask_background import app
@@ -24,6 +27,12 @@ logger = logging.getLogger(__name__)
 # Used as a sentinel value in the webmention endpoint cache
 NO_ENDPOINT = 'NONE'
 
+# Refetch queries Response.syndication_urls to find responses to repropagate.
+# Responses stored before that property existed don't have it until
+# scripts/backfill_response_syndication_urls.py runs, so until then, also scan
+# all of the source's responses the old way. Set to True once it has run.
+RESPONSE_SYNDICATION_URLS_BACKFILLED = False
+
 
 def is_quote_mention(activity, source):
   obj = activity.get('object') or activity
@@ -40,6 +49,8 @@ class Poll(View):
 
   * ``source_key``: string key of source entity
   * ``last_polled``: timestamp, ``YYYY-MM-DD-HH-MM-SS``
+  * ``next_poll``: POSIX timestamp, for ``/cron/poll_wheel`` tasks instead of
+    ``last_polled``
 
   Inserts a propagate task for each response that hasn't been seen before.
 
@@ -47,14 +58,16 @@ class Poll(View):
 
   1. Fetch activities: posts by the user, links to the user's domain(s).
   2. Extract responses, store their activities.
-  3. Filter out responses we've already seen, using :class:`models.Response`\s
-     in the datastore.
+  3. Filter out responses we've already seen, using
+     :attr:`models.Source.seen_responses_fingerprints`.
   4. Store new responses and enqueue propagate tasks.
-  5. Possibly refetch updated syndication urls.
+  5. Possibly add a :class:`Refetch` task to refetch updated syndication urls.
 
   1-4 are in :meth:`backfeed`; 5 is in :meth:`poll`.
   """
   RESTART_EXISTING_TASKS = False  # overridden in Discover
+  # whether to search for links concurrently with fetching the user's activities
+  CONCURRENT_FETCHES = True
 
   def _last_poll_url(self, source):
     return util.host_url(logs.url(source.last_poll_attempt, source.key))
@@ -66,15 +79,28 @@ class Poll(View):
     source = g.source = ndb.Key(urlsafe=key).get()
     if not source or source.status == 'disabled' or 'listen' not in source.features:
       logger.error('Source not found or disabled. Dropping task.')
+      if source and source.next_poll:
+        # stop /cron/poll_wheel from dispatching it
+        source.updates = {'next_poll': None}
+        models.Source.put_updates(source)
       return ''
     logger.info(f'Source: {source.label()} {source.key_id()}, {source.bridgy_url()}')
 
-    if source.AUTO_POLL:
-      last_polled = request.values['last_polled']
+    last_polled = request.values.get('last_polled')
+    if source.AUTO_POLL and last_polled is not None:
       if last_polled != source.last_polled.strftime(util.POLL_TASK_DATETIME_FORMAT):
         logger.warning('duplicate poll task! deferring to the other task.')
         return ''
 
+    # /cron/poll_wheel tasks have the next_poll they were added for instead. if
+    # it's changed, another task, eg poll-now, has polled the source since.
+    wheel_next_poll = request.values.get('next_poll')
+    if wheel_next_poll is not None and (
+        not source.next_poll or
+        wheel_next_poll != str(int(util.to_utc_timestamp(source.next_poll)))):
+      logger.warning(f'stale poll wheel task for {wheel_next_poll}, source next_poll is {source.next_poll}. dropping.')
+      return ''
+
     logger.info(f'Last poll: {self._last_poll_url(source)}')
 
     # mark this source as polling
@@ -86,29 +112,39 @@ class Poll(View):
     source = models.Source.put_updates(source)
 
     source.updates = {}
-    try:
-      self.poll(source)
-    except Exception as e:
-      source.updates['poll_status'] = 'error'
-      code, _ = util.interpret_http_exception(e)
-      if code in source.DISABLE_HTTP_CODES or isinstance(e, models.DisableSource):
-        # the user deauthorized the bridgy app, so disable this source.
-        # let the task complete successfully so that it's not retried.
-        logger.warning(f'Disabling source due to: {e}', exc_info=True)
-        source.updates.update({
-          'status': 'disabled',
-          'poll_status': 'ok',
-        })
-      elif code in source.RATE_LIMIT_HTTP_CODES:
-        logger.info(f'Rate limited. Marking as error and finishing. {e}')
-        source.updates['rate_limited'] = True
+    self.num_activities = self.num_responses = None
+    started = time.monotonic()
+    with util.count_http_calls() as http_calls:
+      try:
+        self.poll(source)
+      except Exception as e:
+        source.updates['poll_status'] = 'error'
+        code, _ = util.interpret_http_exception(e)
+        if code in source.DISABLE_HTTP_CODES or isinstance(e, models.DisableSource):
+          # the user deauthorized the bridgy app, so disable this source.
+          # let the task complete successfully so that it's not retried.
+          logger.warning(f'Disabling source due to: {e}', exc_info=True)
+          source.updates.update({
+            'status': 'disabled',
+            'poll_status': 'ok',
+          })
+        elif code in source.RATE_LIMIT_HTTP_CODES:
+          logger.info(f'Rate limited. Marking as error and finishing. {e}')
+          source.updates['rate_limited'] = True
+        else:
+          self.put_poll_health(source, started, http_calls)
+          raise
+        self.set_next_poll(source)
       else:
-        raise
-    finally:
-      source = models.Source.put_updates(source)
+        self.set_next_poll(source)
+      finally:
+        source = models.Source.put_updates(source)
 
+    next_poll = None
     if source.AUTO_POLL:
-      util.add_poll_task(source)
+      next_poll = (source.next_poll if util.POLL_TIME_WHEEL
+                   else util.add_poll_task(source))
+    self.put_poll_health(source, started, http_calls, next_poll=next_poll)
 
     # feeble attempt to avoid hitting the instance memory limit
     source = None
@@ -116,6 +152,48 @@ class Poll(View):
 
     return 'OK'
 
+  def set_next_poll(self, source):
+    """Adds the source's next poll time to its updates, for the time wheel.
+
+    No-op unless ``util.POLL_TIME_WHEEL`` is enabled. Applies the pending
+    ``source.updates`` to ``source`` in memory first, since they can change its
+    poll period. :meth:`models.Source.put_updates` reloads it anyway.
+
+    Args:
+      source (models.Source)
+    """
+    if not (util.POLL_TIME_WHEEL and source.AUTO_POLL):
+      return
+
+    for name, val in source.updates.items():
+      setattr(source, name, val)
+
+    source.updates['next_poll'] = (None if source.status == 'disabled'
+                                   else util.poll_eta(source))
+
+  def put_poll_health(self, source, started, http_calls, next_poll=None):
+    """Stores this poll's :class:`models.PollHealth`.
+
+    Args:
+      source (models.Source): may have pending ``updates``
+      started (float): :func:`time.monotonic` when the poll started
+      http_calls (util.HttpCalls)
+      next_poll (datetime): ETA of the next poll task, if any
+    """
+    updates = source.updates or {}
+    health = models.PollHealth(
+      key=models.PollHealth.key_for(source),
+      silo=source.SHORT_NAME,
+      poll_status=updates.get('poll_status', source.poll_status),
+      rate_limited=bool(updates.get('rate_limited', source.rate_limited)),
+      duration=time.monotonic() - started,
+      http_calls=http_calls.count,
+      activities=self.num_activities,
+      responses=self.num_responses,
+      next_poll=next_poll)
+    logger.info(f'Poll took {health.duration:.1f}s, {health.http_calls} HTTP calls, found {health.activities} activities, {health.responses} responses')
+    health.put()
+
   def poll(self, source):
     """Actually runs the poll.
 
@@ -133,15 +211,46 @@ class Poll(View):
     if source.last_activities_cache_json:
       cache.update(json_loads(source.last_activities_cache_json))
 
-    # search for links first so that the user's activities and responses
-    # override them if they overlap
-    links = source.search_for_links()
+    timings = {}
 
-    # this user's own activities (and user mentions)
-    resp = source.get_activities_response(
-      fetch_replies=True, fetch_likes=True, fetch_shares=True,
-      fetch_mentions=True, count=30, etag=source.last_activities_etag,
-      min_id=source.last_activity_id, cache=cache)
+    def timed(name, fn, *args, **kwargs):
+      start = time.monotonic()
+      try:
+        return fn(*args, **kwargs)
+      finally:
+        timings[name] = time.monotonic() - start
+
+    searches_links = (type(source).search_for_links
+                      is not models.Source.search_for_links)
+
+    # each of these is one silo API call for count_http_calls()
+    def fetch_activities():
+      # this user's own activities (and user mentions)
+      util.count_http_call()
+      return timed('activities', source.get_activities_response,
+        fetch_replies=True, fetch_likes=True, fetch_shares=True,
+        fetch_mentions=True, count=30, etag=source.last_activities_etag,
+        min_id=source.last_activity_id, cache=cache)
+
+    def fetch_links():
+      if searches_links:
+        util.count_http_call()
+      return timed('links', source.search_for_links)
+
+    # the link search and the user's activities are independent, so if this
+    # source searches for links, run the search in another thread while we
+    # fetch activities in this one. the merge below still lets the user's
+    # activities and responses override links if they overlap.
+    if self.CONCURRENT_FETCHES and searches_links:
+      with ThreadPoolExecutor(max_workers=1) as executor:
+        links_future = executor.submit(util.in_context(fetch_links))
+        resp = fetch_activities()
+        links = links_future.result()
+    else:
+      links = fetch_links()
+      resp = fetch_activities()
+
+    logger.info(f"Fetched {len(links)} links in {timings['links']:.1f}s, {len(resp.get('items', []))} activities in {timings['activities']:.1f}s")
     etag = resp.get('etag')  # used later
     user_activities = resp.get('items', [])
 
@@ -182,6 +291,15 @@ class Poll(View):
       {k: v for k, v in cache.items() if k.split()[-1] in silo_activity_ids})
 
     self.backfeed(source, responses, activities=activities)
+    self.num_activities = len(activities)
+    self.num_responses = len(responses)
+
+    if source.last_polled > util.EPOCH:
+      rate = util.update_response_rate(
+        source.response_rate, self.num_responses,
+        source.last_poll_attempt - source.last_polled)
+      if rate != source.response_rate:
+        source.updates['response_rate'] = rate
 
     source.updates.update({'last_polled': source.last_poll_attempt,
                            'poll_status': 'ok'})
@@ -194,25 +312,14 @@ class Poll(View):
     # if the author has added syndication urls since the first time
     # original_post_discovery ran, we'll miss them. this cleanup task will
     # periodically check for updated urls. only kicks in if the author has
-    # *ever* published a rel=syndication url
+    # *ever* published a rel=syndication url. the refetch can crawl the user's
+    # whole site, so it runs in its own task, Refetch, on its own queue.
     if source.should_refetch():
-      logger.info(f'refetching h-feed for source {source.label()}')
-      relationships = original_post_discovery.refetch(source)
-
-      now = util.now()
-      source.updates['last_hfeed_refetch'] = now
-
-      if relationships:
-        logger.info(f'refetch h-feed found new rel=syndication relationships: {relationships}')
-        try:
-          self.repropagate_old_responses(source, relationships)
-        except BaseException as e:
-          if ('BadRequestError' in str(e.__class__) or
-              'Timeout' in str(e.__class__) or
-              util.is_connection_failure(e)):
-            logger.info('Timeout while repropagating responses.', exc_info=True)
-          else:
-            raise
+      logger.info(f'adding refetch h-feed task for source {source.label()}')
+      util.add_refetch_task(source)
+      # claim this refetch so that later polls don't add more tasks before it
+      # runs. Refetch sets this again when it finishes.
+      source.updates['last_hfeed_refetch'] = util.now()
     else:
       logger.info(
           'skipping refetch h-feed. last-syndication-url %s, last-refetch %s',
@@ -245,6 +352,10 @@ class Poll(View):
     logger.info(f'Found {len(public)} public activities: {public.keys()}')
     logger.info(f'Found {len(private)} private activities: {private.keys()}')
 
+    # load SyndicatedPosts for all public activities at once, for discover()
+    relationships = original_post_discovery.load_relationships(
+      source, public.values())
+
     last_public_post = (source.last_public_post or util.EPOCH).isoformat()
     public_published = util.trim_nulls(
       [a.get('object', {}).get('published') for a in public.values()])
@@ -280,7 +391,8 @@ class Poll(View):
               original_post_discovery.discover(
                 source, activity, fetch_hfeed=True,
                 include_redirect_sources=False,
-                already_fetched_hfeeds=fetched_hfeeds)
+                already_fetched_hfeeds=fetched_hfeeds,
+                relationships=relationships)
             activity['mentions'].update(u.get('value') for u in urls)
             responses[id] = activity
             break
@@ -294,7 +406,8 @@ class Poll(View):
             original_post_discovery.discover(
               source, activity, fetch_hfeed=True,
               include_redirect_sources=False,
-              already_fetched_hfeeds=fetched_hfeeds)
+              already_fetched_hfeeds=fetched_hfeeds,
+              relationships=relationships)
         responses[id] = activity
 
       # extract replies, likes, reactions, reposts, and rsvps
@@ -334,20 +447,27 @@ class Poll(View):
     #
     # Step 3: filter out responses we've already seen
     #
-    # seen responses (JSON objects) for each source are stored in its entity.
-    unchanged_responses = []
-    if source.seen_responses_cache_json:
-      for seen in json_loads(source.seen_responses_cache_json):
-        id = seen['id']
-        resp = responses.get(id)
-        if resp and not as1.activity_changed(seen, resp, log=True):
-          unchanged_responses.append(seen)
-          del responses[id]
+    # fingerprints of seen responses for each source are stored in its entity.
+    seen = source.seen_responses_fingerprints
+    migrated = False
+    if seen is None and source.seen_responses_cache_json:
+      # convert from the old format, full response JSON objects
+      seen = {r['id']: util.activity_fingerprint(r)
+              for r in json_loads(source.seen_responses_cache_json)}
+      migrated = True
+
+    unchanged_responses = {}
+    for id, resp in list(responses.items()):
+      fingerprint = util.activity_fingerprint(resp)
+      if seen and seen.get(id) == fingerprint:
+        unchanged_responses[id] = fingerprint
+        del responses[id]
 
     #
     # Step 4: store new responses and enqueue propagate tasks
     #
-    pruned_responses = []
+    new_fingerprints = {}
+    resp_entities = []
     source.blocked_ids = None
 
     for id, resp in responses.items():
@@ -367,7 +487,8 @@ class Poll(View):
             original_post_discovery.discover(
               source, activity, fetch_hfeed=True,
               include_redirect_sources=False,
-              already_fetched_hfeeds=fetched_hfeeds)
+              already_fetched_hfeeds=fetched_hfeeds,
+              relationships=relationships)
 
         targets = original_post_discovery.targets_for_response(
           resp, originals=activity['originals'], mentions=activity['mentions'])
@@ -388,7 +509,7 @@ class Poll(View):
       # remove circular references in link responses, which are their own
       # activities. details in the step 2 comment above.
       pruned_response = util.prune_response(resp)
-      pruned_responses.append(pruned_response)
+      new_fingerprints[id] = util.activity_fingerprint(pruned_response)
       resp_entity = Response(
         id=id,
         source=source.key,
@@ -401,36 +522,93 @@ class Poll(View):
         original_posts=resp.get('originals', []))
       if urls_to_activity and len(activities) > 1:
         resp_entity.urls_to_activity=json_dumps(urls_to_activity)
-      resp_entity.get_or_save(source, restart=self.RESTART_EXISTING_TASKS)
+      resp_entity.syndication_urls = sorted(
+        resp_entity.canonical_activity_urls(source))
+      resp_entities.append(resp_entity)
+
+    if resp_entities:
+      with util.task_batch() as batch:
+        Response.get_or_save_multi(resp_entities, source,
+                                   restart=self.RESTART_EXISTING_TASKS)
+      batch.raise_for_failures()
 
     # update cache
-    if pruned_responses:
-      source.updates['seen_responses_cache_json'] = json_dumps(
-        pruned_responses + unchanged_responses)
+    if new_fingerprints or migrated:
+      source.updates.update({
+        'seen_responses_fingerprints': {**unchanged_responses, **new_fingerprints},
+        'seen_responses_cache_json': None,
+      })
+
+
+class Refetch(View):
+  """Task handler that refetches a source's h-feed for new syndication urls.
+
+  Request parameters:
+
+  * ``source_key``: string key of source entity
+
+  Added by :class:`Poll` when :meth:`models.Source.should_refetch` is true.
+  Runs :func:`original_post_discovery.refetch`, stores
+  :attr:`models.Source.last_hfeed_refetch` and
+  :attr:`models.Source.last_syndication_url`, and repropagates old responses
+  that match newly discovered syndication urls.
+  """
+  def dispatch_request(self):
+    logger.debug(f'Params: {list(request.values.items())}')
+
+    key = request.values['source_key']
+    source = g.source = ndb.Key(urlsafe=key).get()
+    if not source or source.status == 'disabled' or 'listen' not in source.features:
+      logger.error('Source not found or disabled. Dropping task.')
+      return ''
+    logger.info(f'Source: {source.label()} {source.key_id()}, {source.bridgy_url()}')
+
+    logger.info(f'refetching h-feed for source {source.label()}')
+    source.updates = {}
+    relationships = original_post_discovery.refetch(source)
+    source.updates['last_hfeed_refetch'] = util.now()
+    source = models.Source.put_updates(source)
+
+    if relationships:
+      logger.info(f'refetch h-feed found new rel=syndication relationships: {relationships}')
+      try:
+        self.repropagate_old_responses(source, relationships)
+      except BaseException as e:
+        if ('BadRequestError' in str(e.__class__) or
+            'Timeout' in str(e.__class__) or
+            util.is_connection_failure(e)):
+          logger.info('Timeout while repropagating responses.', exc_info=True)
+        else:
+          raise
+
+    return 'OK'
 
   def repropagate_old_responses(self, source, relationships):
     """Find old Responses that match a new SyndicatedPost and repropagate them.
 
-    We look through as many responses as we can until the datastore query expires.
+    Queries :attr:`models.Response.syndication_urls` for the relationships'
+    syndication urls, up to :data:`models.MAX_IN_QUERY_VALUES` at a time, so
+    that we only load the affected responses. Until
+    ``RESPONSE_SYNDICATION_URLS_BACKFILLED`` is set, then also looks through
+    the source's responses without ``syndication_urls``, newest first, as many
+    as we can until the datastore query expires.
 
     Args:
       source (models.Source):
-      relationships: refetch result
+      relationships: refetch result, dict mapping canonicalized syndication
+        url to list of :class:`models.SyndicatedPost`
     """
-    for response in (Response.query(Response.source == source.key)
-                     .order(-Response.updated)):
+    urls = sorted(relationships.keys())
+    responses = {}
+    for i in range(0, len(urls), models.MAX_IN_QUERY_VALUES):
+      for response in Response.query(
+          Response.source == source.key,
+          Response.syndication_urls.IN(urls[i:i + models.MAX_IN_QUERY_VALUES])):
+        responses[response.key] = response
+
+    def repropagate(response):
       new_orig_urls = set()
-      for activity_json in response.activities_json:
-        activity = json_loads(activity_json)
-        activity_url = activity.get('url') or activity.get('object', {}).get('url')
-        if not activity_url:
-          logger.warning(f'activity has no url {activity_json}')
-          continue
-
-        activity_url = source.canonicalize_url(activity_url, activity=activity)
-        if not activity_url:
-          continue
-
+      for activity_url in response.syndication_urls:
         # look for activity url in the newly discovered list of relationships
         for relationship in relationships.get(activity_url, []):
           # won't re-propagate if the discovered link is already among
@@ -455,6 +633,21 @@ class Poll(View):
         response.put()
         response.add_task()
 
+    with util.task_batch() as batch:
+      for response in responses.values():
+        repropagate(response)
+
+      if not RESPONSE_SYNDICATION_URLS_BACKFILLED:
+        for response in (Response.query(Response.source == source.key)
+                         .order(-Response.updated)):
+          if not response.syndication_urls:
+            # stored if it's repropagated
+            response.syndication_urls = sorted(
+              response.canonical_activity_urls(source))
+            repropagate(response)
+
+    batch.raise_for_failures()
+
 
 class Discover(Poll):
   """Task handler that fetches and processes new responses to a single post.
@@ -514,6 +707,79 @@ class Discover(Poll):
     return 'OK'
 
 
+def send_webmentions_to_domain(targets, headers):
+  """Discovers endpoints for and sends webmentions to targets, serially.
+
+  Doesn't touch the datastore or Flask's request context, so it's safe to run
+  in a thread. All targets should be on the same domain.
+
+  Waits for ``util.domain_rate_limiter`` before each HTTP request. If that
+  times out, or if we can't connect to the domain, defers the remaining targets
+  with :class:`util.DomainDeferred` instead of trying them.
+
+  Args:
+    targets (list of (str source URL, str target URL) tuples)
+    headers (dict): HTTP request headers to include
+
+  Returns:
+    dict: maps str target URL to (str endpoint, :class:`requests.Response`,
+    :class:`BaseException`) tuple. endpoint is ``NO_ENDPOINT`` or None if we
+    didn't find one. exception is None if we didn't hit an error.
+  """
+  results = {}
+  deferred = None
+
+  def rate_limit(domain):
+    if not util.domain_rate_limiter.acquire(
+        domain, timeout=util.DOMAIN_RATE_LIMIT_MAX_WAIT.total_seconds()):
+      raise util.DomainDeferred(f'{domain} is rate limited')
+
+  for source_url, target in targets:
+    if deferred:
+      results[target] = (None, None, deferred)
+      continue
+
+    endpoint = resp = None
+    try:
+      logger.info(f'Webmention from {source_url} to {target}')
+      domain = util.domain_from_link(target)
+
+      # see if we've cached webmention discovery for this domain. the cache
+      # value is a string URL endpoint if discovery succeeded, NO_ENDPOINT if
+      # no endpoint was found.
+      cache_key = util.webmention_endpoint_cache_key(target)
+      with util.webmention_endpoint_cache_lock:
+        endpoint = util.webmention_endpoint_cache.get(cache_key)
+      if endpoint:
+        logger.info(f'Webmention discovery: using cached endpoint {cache_key}: {endpoint}')
+
+      # send! and handle response or error
+      if not endpoint:
+        rate_limit(domain)
+        endpoint, resp = webmention.discover(target, follow_meta_refresh=True, headers=headers)
+        with util.webmention_endpoint_cache_lock:
+          util.webmention_endpoint_cache[cache_key] = endpoint or NO_ENDPOINT
+
+      if endpoint and endpoint != NO_ENDPOINT:
+        logger.info(f'Sending to {endpoint}...')
+        rate_limit(domain)
+        resp = webmention.send(endpoint, source_url, target, timeout=999,
+                               headers=headers)
+        logger.info(f'Sent! {resp}')
+
+      results[target] = (endpoint, resp, None)
+
+    except BaseException as e:
+      results[target] = (endpoint, resp, e)
+      if isinstance(e, util.DomainDeferred):
+        deferred = e
+      elif (isinstance(e, (requests.ConnectionError, requests.Timeout))
+            and 'DNS lookup failed' not in str(e)):
+        deferred = util.DomainDeferred(f"Couldn't connect to {domain}")
+
+  return results
+
+
 class SendWebmentions(View):
   """Abstract base task handler that can send webmentions.
 
@@ -521,9 +787,16 @@ class SendWebmentions(View):
 
   * entity (models.Webmentions): subclass instance (set in :meth:`lease_entity`)
   * source (models.Source): entity (set in :meth:`send_webmentions`)
+  * batch_sent (list of (str endpoint, str target) tuples): when propagating a
+    batch of entities, accumulates the webmentions sent for all of them so that
+    :meth:`record_source_webmention` runs once at the end. None otherwise.
   """
   # request deadline (10m) plus some padding
   LEASE_LENGTH = datetime.timedelta(minutes=12)
+  # max number of target domains to send webmentions to in parallel
+  MAX_CONCURRENT_DOMAINS = 5
+
+  batch_sent = None
 
   def source_url(self, target_url):
     """Return the source URL to use for a given target URL.
@@ -573,58 +846,115 @@ class SendWebmentions(View):
           self.entity.failed.append(orig_url)
     self.entity.unsent = sorted(unsent)
 
-    while self.entity.unsent:
-      resp = None
-      target = self.entity.unsent.pop(0)
-
+    # load shared cached endpoints up front, since the sending threads below
+    # only use the in-process cache
+    cache_keys = {util.webmention_endpoint_cache_key(t) for t in self.entity.unsent}
+    prefetched = util.prefetch_webmention_endpoints(self.entity.unsent)
+
+    # group targets by domain. each domain's targets are sent serially, so we
+    # never hit a single host in parallel, but different domains are sent
+    # concurrently.
+    headers = util.request_headers(source=g.source)
+    by_domain = {}
+    results = {}
+    for target in self.entity.unsent:
       try:
         source_url = self.source_url(target)
-        logger.info(f'Webmention from {source_url} to {target}')
+      except BaseException as e:
+        results[target] = (None, None, e)
+        continue
+      by_domain.setdefault(util.domain_from_link(target), []).append(
+        (source_url, target))
+
+    # don't send to domains whose circuit breakers are open. if one is
+    # half-open, send to just one of its targets as a probe.
+    health = util.load_domain_health(by_domain.keys())
+    for domain, targets in list(by_domain.items()):
+      state = health[domain].state()
+      if state == 'closed':
+        continue
+      elif state == 'half-open':
+        logger.info(f'Circuit breaker for {domain} is half-open, probing with {targets[0][1]}')
+        # re-open while we probe so that other tasks keep deferring
+        health[domain].opened = util.now()
+        util.store_domain_health([health[domain]])
+        by_domain[domain], targets = targets[:1], targets[1:]
+      else:
+        del by_domain[domain]
 
-        # see if we've cached webmention discovery for this domain. the cache
-        # value is a string URL endpoint if discovery succeeded, NO_ENDPOINT if
-        # no endpoint was found.
-        cache_key = util.webmention_endpoint_cache_key(target)
-        endpoint = util.webmention_endpoint_cache.get(cache_key)
-        if endpoint:
-          logger.info(f'Webmention discovery: using cached endpoint {cache_key}: {endpoint}')
+      for _, target in targets:
+        results[target] = (None, None, util.DomainDeferred(
+          f'Circuit breaker for {domain} is open'))
 
-        # send! and handle response or error
-        headers = util.request_headers(source=g.source)
-        if not endpoint:
-          endpoint, resp = webmention.discover(target, follow_meta_refresh=True, headers=headers)
-          with util.webmention_endpoint_cache_lock:
-            util.webmention_endpoint_cache[cache_key] = endpoint or NO_ENDPOINT
+    def send(targets):
+      return send_webmentions_to_domain(targets, headers)
 
+    groups = list(by_domain.values())
+    if len(groups) <= 1 or self.MAX_CONCURRENT_DOMAINS <= 1:
+      for group in groups:
+        results.update(send(group))
+    else:
+      workers = min(len(groups), self.MAX_CONCURRENT_DOMAINS)
+      with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(send, groups):
+          results.update(result)
+
+    sent = []
+    # maps domain to transient error, or None if it responded
+    domain_results = {}
+    for target in self.entity.unsent:
+      endpoint, resp, e = results[target]
+      domain = util.domain_from_link(target)
+      if e is None:
+        domain_results[domain] = None
         if endpoint and endpoint != NO_ENDPOINT:
-          logger.info('Sending...')
-          resp = webmention.send(endpoint, source_url, target, timeout=999,
-                                 headers=headers)
-          logger.info(f'Sent! {resp}')
-          self.record_source_webmention(endpoint, target)
+          sent.append((endpoint, target))
           self.entity.sent.append(target)
         else:
-          logger.info('Giving up this target.')
+          logger.info(f'Giving up on {target}')
           self.entity.skipped.append(target)
 
-      except ValueError:
-        logger.info('Bad URL; giving up this target.')
+      elif isinstance(e, ValueError):
+        logger.info(f'Bad URL; giving up on {target}')
         self.entity.skipped.append(target)
 
-      except BaseException as e:
-        logger.info('', exc_info=True)
+      elif isinstance(e, util.DomainDeferred):
+        logger.info(f'Deferring {target}: {e}')
+        self.fail(f'Deferred {target}: {e}')
+        self.entity.error.append(target)
+
+      else:
+        logger.info(f'Error sending to {target}', exc_info=e)
         # Give up on 4XX and DNS errors; we don't expect retries to succeed.
         code, _ = util.interpret_http_exception(e)
         if ((code and code.startswith('4') and code != '429')
             or 'DNS lookup failed' in str(e)):
-          logger.info('Giving up this target.')
+          logger.info(f'Giving up on {target}')
           self.entity.failed.append(target)
+          if code:
+            domain_results[domain] = None
         else:
           self.fail(f'Error sending to endpoint: {resp}')
           self.entity.error.append(target)
-
-      if target in self.entity.unsent:
-        self.entity.unsent.remove(target)
+          # only connection errors, timeouts, 5xx, and 429 count against the
+          # domain's circuit breaker. others, eg parse errors, are this
+          # target's problem.
+          if (util.is_connection_failure(e) or
+              (code and (code.startswith('5') or code == '429'))):
+            domain_results.setdefault(domain, e)
+
+    # update circuit breakers
+    util.record_domain_health({domain: e for domain, e in domain_results.items()
+                               if domain in health})
+
+    # share newly discovered endpoints with other instances
+    util.store_webmention_endpoints(cache_keys - prefetched)
+
+    self.entity.unsent = []
+    if self.batch_sent is not None:
+      self.batch_sent.extend(sent)
+    elif sent:
+      self.record_source_webmention(sent)
 
     if self.entity.error:
       logger.info('Some targets failed')
@@ -637,7 +967,8 @@ class SendWebmentions(View):
     """Attempts to acquire and lease the :class:`models.Webmentions` entity.
 
     Also loads and sets ``g.source``, and returns False if the source doesn't
-    exist or is disabled.
+    exist or is disabled. When propagating a batch, reuses ``g.source`` if it's
+    already loaded.
 
     Args:
       key (ndb.Key):
@@ -657,7 +988,9 @@ class SendWebmentions(View):
           util.now() < self.entity.leased_until):
       return self.fail('duplicate task is currently processing!')
 
-    g.source = self.entity.source.get()
+    if not (self.batch_sent is not None and g.get('source') and
+            g.source.key == self.entity.source):
+      g.source = self.entity.source.get()
     if not g.source or g.source.status == 'disabled':
       logger.error('Source not found or disabled. Dropping task.')
       return False
@@ -716,27 +1049,33 @@ class SendWebmentions(View):
     g.failed = True
 
   @ndb.transactional()
-  def record_source_webmention(self, endpoint, target):
+  def record_source_webmention(self, sent):
     """Sets this source's last_webmention_sent and maybe webmention_endpoint.
 
     Args:
-      endpoint (str): URL
-      target (str): URL
+      sent (list of (str endpoint, str target) tuples): webmentions sent by
+        this task, in order
     """
     g.source = g.source.key.get()
     logger.info('Setting last_webmention_sent')
     g.source.last_webmention_sent = util.now()
 
-    if (endpoint != g.source.webmention_endpoint and
-        util.domain_from_link(target) in g.source.domains):
-      logger.info(f'Also setting webmention_endpoint to {endpoint} (discovered in {target}; was {g.source.webmention_endpoint})')
-      g.source.webmention_endpoint = endpoint
+    for endpoint, target in sent:
+      if (endpoint != g.source.webmention_endpoint and
+          util.domain_from_link(target) in g.source.domains):
+        logger.info(f'Also setting webmention_endpoint to {endpoint} (discovered in {target}; was {g.source.webmention_endpoint})')
+        g.source.webmention_endpoint = endpoint
 
     g.source.put()
 
 
 class PropagateResponse(SendWebmentions):
-  """Task handler that sends webmentions for a :class:`models.Response`.
+  """Task handler that sends webmentions for :class:`models.Response` entities.
+
+  Usually propagates a single response. Coalesced tasks from
+  :func:`util.add_propagate_tasks` include multiple responses for the same
+  source. Each one is still leased and completed individually, but the source
+  is only loaded once, and :meth:`record_source_webmention` only runs once.
 
   Attributes:
 
@@ -744,13 +1083,40 @@ class PropagateResponse(SendWebmentions):
 
   Request parameters:
 
-  * response_key (str): key of :class:`models.Response` entity
+  * response_key (str): key of :class:`models.Response` entity. may be repeated.
   """
 
   def dispatch_request(self):
-    logger.debug(f'Params: {list(request.values.items())}')
-    if not self.lease(ndb.Key(urlsafe=request.values['response_key'])):
-      return ('', ERROR_HTTP_RETURN_CODE) if getattr(g, 'failed', None) else 'OK'
+    logger.debug(f'Params: {list(request.values.items(multi=True))}')
+    keys = [ndb.Key(urlsafe=key) for key in request.values.getlist('response_key')]
+
+    if len(keys) == 1:
+      self.propagate(keys[0])
+    else:
+      logger.info(f'Propagating {len(keys)} responses')
+      self.batch_sent = []
+      for key in keys:
+        try:
+          self.propagate(key)
+        except Exception:
+          # send_webmentions() has already released it. keep going with the
+          # rest of the batch, then fail the task so that it gets retried.
+          logger.info(f'Propagating {key} failed', exc_info=True)
+          g.failed = True
+
+      if self.batch_sent:
+        self.record_source_webmention(self.batch_sent)
+
+    return ('', ERROR_HTTP_RETURN_CODE) if getattr(g, 'failed', None) else 'OK'
+
+  def propagate(self, key):
+    """Leases and sends webmentions for a single :class:`models.Response`.
+
+    Args:
+      key (ndb.Key)
+    """
+    if not self.lease(key):
+      return
 
     source = g.source
     poll_estimate = self.entity.created - datetime.timedelta(seconds=61)
@@ -763,10 +1129,9 @@ class PropagateResponse(SendWebmentions):
         not all(as1.is_public(a) for a in self.activities)):
       logger.info('Response or activity is non-public. Dropping.')
       self.complete()
-      return ''
+      return
 
     self.send_webmentions()
-    return ('', ERROR_HTTP_RETURN_CODE) if getattr(g, 'failed', None) else 'OK'
 
   def source_url(self, target_url):
     # determine which activity to use. default to response.
@@ -835,6 +1200,7 @@ class PropagateBlogPost(SendWebmentions):
 
 app.add_url_rule('/_ah/queue/poll', view_func=Poll.as_view('poll'), methods=['POST'])
 app.add_url_rule('/_ah/queue/poll-now', view_func=Poll.as_view('poll-now'), methods=['POST'])
+app.add_url_rule('/_ah/queue/refetch', view_func=Refetch.as_view('refetch'), methods=['POST'])
 app.add_url_rule('/_ah/queue/discover', view_func=Discover.as_view('discover'), methods=['POST'])
 app.add_url_rule('/_ah/queue/propagate', view_func=PropagateResponse.as_view('propagate'), methods=['POST'])
 app.add_url_rule('/_ah/queue/propagate-blogpost', view_func=PropagateBlogPost.as_view('propagate_blogpost'), methods=['POST'])
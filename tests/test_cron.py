@@ -27,6 +27,7 @@ import util
 class CronTest(testutil.BackgroundTest):
   def setUp(self):
     super().setUp()
+    self.run_serially()
     oauth_dropins.flickr_auth.FLICKR_APP_KEY = 'my_app_key'
     oauth_dropins.flickr_auth.FLICKR_APP_SECRET = 'my_app_secret'
 
@@ -65,6 +66,93 @@ class CronTest(testutil.BackgroundTest):
     resp = self.client.get('/cron/replace_poll_tasks')
     self.assertEqual(200, resp.status_code)
 
+  def test_replace_poll_tasks_time_wheel(self):
+    self.mox.stubs.Set(util, 'POLL_TIME_WHEEL', True)
+    FakeSource.new(features=['listen']).put()
+    self.stub_create_task()
+    self.mox.ReplayAll()
+
+    resp = self.client.get('/cron/replace_poll_tasks')
+    self.assertEqual(200, resp.status_code)
+
+  def test_poll_wheel(self):
+    self.mox.stubs.Set(util, 'POLL_TIME_WHEEL', True)
+    now = util.now()
+
+    self.clear_datastore()
+    sources = [
+      # due before the end of the next tick
+      FakeSource.new(features=['listen'], next_poll=now - datetime.timedelta(minutes=1)),
+      FakeSource.new(features=['listen'], next_poll=now + datetime.timedelta(minutes=3)),
+      # not due yet
+      FakeSource.new(features=['listen'], next_poll=now + datetime.timedelta(hours=1)),
+      # no next poll
+      FakeSource.new(features=['listen']),
+    ]
+    for source in sources:
+      source.put()
+
+    for source in sources[:2]:
+      self.expect_task('poll', source_key=source, next_poll=str(int(
+        util.to_utc_timestamp(source.next_poll))))
+    self.mox.ReplayAll()
+
+    resp = self.client.get('/cron/poll_wheel')
+    self.assertEqual(200, resp.status_code)
+
+  def test_poll_wheel_repair(self):
+    self.mox.stubs.Set(util, 'POLL_TIME_WHEEL', True)
+    now = util.now()
+
+    self.clear_datastore()
+    recent = FakeSource.new(features=['listen'],
+                            next_poll=now - datetime.timedelta(minutes=1))
+    lost = FakeSource.new(features=['listen'], next_poll=now - util.POLL_WHEEL_REPAIR_AFTER
+                          - datetime.timedelta(minutes=1))
+    recent.put()
+    lost.put()
+
+    repair = int(util.to_utc_timestamp(now) //
+                 util.POLL_WHEEL_REPAIR_AFTER.total_seconds())
+    self.mox.StubOutWithMock(util, 'add_wheel_poll_task')
+    util.add_wheel_poll_task(recent.key, recent.next_poll, repair=None).InAnyOrder()
+    util.add_wheel_poll_task(lost.key, lost.next_poll, repair=repair).InAnyOrder()
+    self.mox.ReplayAll()
+
+    resp = self.client.get('/cron/poll_wheel')
+    self.assertEqual(200, resp.status_code)
+
+  def test_poll_wheel_disabled(self):
+    FakeSource.new(features=['listen'], next_poll=util.now()).put()
+    self.stub_create_task()
+    self.mox.ReplayAll()
+
+    resp = self.client.get('/cron/poll_wheel')
+    self.assertEqual(200, resp.status_code)
+
+  def test_delete_expired_url_caches(self):
+    now = util.now()
+    for cls in util.ResolvedUrl, util.WebmentionEndpoint:
+      cls(id='fresh', expires=now + datetime.timedelta(hours=1)).put()
+      cls(id='expired', expires=now - datetime.timedelta(hours=1)).put()
+
+    resp = self.client.get('/cron/delete_expired_url_caches')
+    self.assertEqual(200, resp.status_code)
+    for cls in util.ResolvedUrl, util.WebmentionEndpoint:
+      self.assertEqual(['fresh'], [k.id() for k in cls.query().iter(keys_only=True)])
+
+  def test_delete_expired_cached_items(self):
+    now = util.now()
+    for id, expires in (('fresh', now + datetime.timedelta(minutes=5)),
+                        ('stale', now - datetime.timedelta(hours=1)),
+                        ('old', now - cron.CACHED_ITEM_MAX_STALE * 2)):
+      models.CachedItem(id=id, status=200, body='x', expires=expires).put()
+
+    resp = self.client.get('/cron/delete_expired_cached_items')
+    self.assertEqual(200, resp.status_code)
+    self.assertEqual(['fresh', 'stale'],
+                     sorted(k.id() for k in models.CachedItem.query().iter(keys_only=True)))
+
   def test_update_flickr_pictures(self):
     flickrs = self._setup_flickr()
 
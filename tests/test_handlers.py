@@ -1,15 +1,17 @@
 """Unit tests for handlers.py."""
+import datetime
 import html
 import io
 import urllib.request, urllib.error, urllib.parse
 
 from mox3 import mox
-from oauth_dropins.webutil.testutil import enable_flask_caching
+from oauth_dropins.webutil.testutil import enable_flask_caching, NOW
 from util import json_dumps, json_loads
 
 from flask_app import app, cache
 import handlers
 import models
+import util
 from . import testutil
 from .testutil import FakeGrSource, FakeSource
 
@@ -18,6 +20,7 @@ class HandlersTest(testutil.AppTest):
 
   def setUp(self):
     super().setUp()
+    self.run_serially()
     self.source = testutil.FakeSource.new(
       features=['listen'], domains=['or.ig', 'fa.ke'],
       domain_urls=['http://or.ig', 'https://fa.ke'])
@@ -237,6 +240,88 @@ asdf http://other/link qwert
 </article>
 """)
 
+  def _store_comment(self):
+    comment = {
+      'objectType': 'comment',
+      'id': 'tag:fa.ke,2013:a1-b2.c3',
+      'url': 'http://fa.ke/000#a1-b2.c3',
+      'content': 'stored reply',
+    }
+    models.Response(id='tag:fa.ke,2013:a1-b2.c3', source=self.source.key,
+                    type='comment', response_json=json_dumps(comment),
+                    activities_json=[json_dumps(self.activities[0])]).put()
+
+  def test_comment_stored_response(self):
+    self._store_comment()
+
+    # shouldn't touch the silo API
+    self.mox.StubOutWithMock(testutil.FakeSource, 'get_activities')
+    self.mox.StubOutWithMock(testutil.FakeSource, 'get_comment')
+    self.mox.ReplayAll()
+
+    resp = self.check_response('/comment/fake/%s/000/a1-b2.c3')
+    body = resp.get_data(as_text=True)
+    self.assertIn('stored reply', body)
+    self.assertIn('<a class="u-in-reply-to" href="http://or.ig/post"></a>', body)
+
+  def test_comment_stored_response_pruned(self):
+    # the stored activity is pruned, so it doesn't have the original post link
+    # any more, but the page should still link to the targets we sent to
+    comment = {
+      'objectType': 'comment',
+      'id': 'tag:fa.ke,2013:a1-b2.c3',
+      'content': 'stored reply',
+    }
+    models.Response(id='tag:fa.ke,2013:a1-b2.c3', source=self.source.key,
+                    type='comment', response_json=json_dumps(comment),
+                    activities_json=[json_dumps(util.prune_activity(
+                      {'id': 'tag:fa.ke,2013:000', 'content': 'foo'},
+                      self.source))],
+                    sent=['http://or.ig/post'], unsent=['http://other/link'],
+                    original_posts=['http://or.ig/post']).put()
+
+    self.mox.StubOutWithMock(testutil.FakeSource, 'get_activities')
+    self.mox.StubOutWithMock(testutil.FakeSource, 'get_comment')
+    self.mox.ReplayAll()
+
+    body = self.check_response('/comment/fake/%s/000/a1-b2.c3').get_data(as_text=True)
+    self.assertIn('stored reply', body)
+    self.assertIn('<a class="u-in-reply-to" href="http://or.ig/post"></a>', body)
+    self.assertIn('href="http://other/link"', body)
+    self.assertNotIn('<a class="u-in-reply-to" href="http://other/link"', body)
+
+  def test_comment_stored_response_without_activity(self):
+    # we can't tell original posts from mentions without the activity, so
+    # this should fetch from the silo
+    models.Response(id='tag:fa.ke,2013:a1-b2.c3', source=self.source.key,
+                    type='comment', response_json=json_dumps({
+                      'content': 'stored reply',
+                    }), sent=['http://or.ig/post']).put()
+
+    resp = self.check_response('/comment/fake/%s/000/a1-b2.c3')
+    self.assertNotIn('stored reply', resp.get_data(as_text=True))
+    self.assertIn('qwert', resp.get_data(as_text=True))
+
+  def test_comment_stored_response_stale(self):
+    self._store_comment()
+    util.now = lambda **kwargs: (datetime.datetime.now(datetime.timezone.utc) +
+                                 handlers.ITEM_RESPONSE_MAX_AGE * 2)
+
+    resp = self.check_response('/comment/fake/%s/000/a1-b2.c3')
+    self.assertNotIn('stored reply', resp.get_data(as_text=True))
+    self.assertIn('qwert', resp.get_data(as_text=True))
+
+  def test_comment_stored_response_other_source(self):
+    other = FakeSource.new()
+    other.put()
+    models.Response(id='tag:fa.ke,2013:a1-b2.c3', source=other.key,
+                    type='comment', response_json=json_dumps({
+                      'content': 'stored reply',
+                    })).put()
+
+    resp = self.check_response('/comment/fake/%s/000/a1-b2.c3')
+    self.assertNotIn('stored reply', resp.get_data(as_text=True))
+
   def test_comment_optimized_comments(self):
     self.mox.StubOutWithMock(self.source.gr_source, 'OPTIMIZED_COMMENTS')
     self.source.gr_source.OPTIMIZED_COMMENTS = True
@@ -566,6 +651,70 @@ asdf http://other/link qwert
     self.assertEqual(200, resp.status_code)
     self.assertNotEqual('', resp.text)
 
+  def cache_id(self, path='/post/fake/%s/000'):
+    return handlers.item_cache_id(path % self.source.key.string_id(), 'html',
+                                  self.source.key.get())
+
+  def test_datastore_cache(self):
+    orig = self.check_response('/post/fake/%s/000')
+    cached = models.CachedItem.get_by_id(self.cache_id())
+    self.assertEqual(200, cached.status)
+    self.assertEqual(NOW + handlers.CACHE_TIME, cached.expires)
+
+    # should serve the stored response and not refetch
+    self.mox.StubOutWithMock(FakeGrSource, 'get_activities_response')
+    self.mox.ReplayAll()
+    resp = self.check_response('/post/fake/%s/000')
+    self.assertEqual(orig.get_data(as_text=True), resp.get_data(as_text=True))
+
+  def test_datastore_cache_404(self):
+    FakeGrSource.activities = []
+    self.check_response('/post/fake/%s/000', expected_status=404)
+    cached = models.CachedItem.get_by_id(self.cache_id())
+    self.assertEqual(404, cached.status)
+    self.assertEqual(NOW + handlers.ITEM_CACHE_NEGATIVE_TIME, cached.expires)
+
+    # should serve the cached 404 even though the post exists now
+    FakeGrSource.activities = self.activities
+    self.check_response('/post/fake/%s/000', expected_status=404)
+
+  def test_datastore_cache_blocklist_changed(self):
+    cache_id = self.cache_id()
+    models.CachedItem(id=cache_id, status=200, body='cached',
+                      expires=NOW + datetime.timedelta(minutes=1)).put()
+    self.assertEqual('cached', self.check_response('/post/fake/%s/000')
+                                   .get_data(as_text=True))
+
+    self.source.blocked_ids = ['123']
+    self.source.put()
+    self.assertNotEqual(cache_id, self.cache_id())
+    self.check_response('/post/fake/%s/000', self.post_html)
+
+  def test_datastore_cache_stale(self):
+    cache_id = self.cache_id()
+    models.CachedItem(id=cache_id, status=200, body='stale',
+                      expires=NOW - datetime.timedelta(minutes=1)).put()
+
+    # rerendering fails. serve stale, and don't write.
+    self.mox.StubOutWithMock(testutil.FakeSource, 'get_activities')
+    testutil.FakeSource.get_activities(
+      activity_id='000', user_id=self.source.key.string_id()
+    ).AndRaise(Exception('Connection closed unexpectedly'))
+    self.mox.ReplayAll()
+    resp = self.check_response('/post/fake/%s/000')
+    self.assertEqual('stale', resp.get_data(as_text=True))
+    self.assertEqual('stale', models.CachedItem.get_by_id(cache_id).body)
+
+  def test_datastore_cache_revalidate(self):
+    cache_id = self.cache_id()
+    models.CachedItem(id=cache_id, status=200, body='stale',
+                      expires=NOW - datetime.timedelta(minutes=1)).put()
+
+    self.check_response('/post/fake/%s/000', self.post_html)
+    cached = models.CachedItem.get_by_id(cache_id)
+    self.assertNotEqual('stale', cached.body)
+    self.assertEqual(NOW + handlers.CACHE_TIME, cached.expires)
+
   def test_in_blocklist(self):
     self.mox.StubOutWithMock(FakeSource, 'is_blocked')
     FakeSource.is_blocked(mox.IgnoreArg()).AndReturn(True)
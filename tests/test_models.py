@@ -2,6 +2,7 @@
 from datetime import datetime, timedelta, timezone
 from unittest import skip
 import copy
+import urllib.parse
 
 from flask import get_flashed_messages
 from google.cloud import ndb
@@ -40,6 +41,83 @@ class ResponseTest(testutil.AppTest):
     self.assertEqual('comment', saved.type)
     self.assertEqual([], saved.old_response_jsons)
 
+  def test_summary(self):
+    response = self.responses[0]
+    response.type = 'like'
+    response.response_json = json_dumps({
+      'objectType': 'activity',
+      'verb': 'like',
+      'url': 'http://fa.ke/like',
+      'author': {
+        'displayName': 'Alice',
+        'url': 'http://fa.ke/alice',
+        'image': [{'url': 'http://fa.ke/alice.jpg'}],
+      },
+    })
+    response.put()
+
+    summary = json_loads(response.key.get().summary_json)
+    self.assertEqual({
+      'public': True,
+      'actor': {
+        'displayName': 'Alice',
+        'url': 'http://fa.ke/alice',
+        'image': {'url': 'http://fa.ke/alice.jpg'},
+      },
+      'url': 'http://fa.ke/like',
+      'content': 'Alice liked this.',
+      'activities': [{
+        'url': json_loads(response.activities_json[0])['url'],
+        'content': json_loads(response.activities_json[0])['object']['content'],
+      }],
+    }, summary)
+
+  def test_summary_only_regenerated_when_inputs_set(self):
+    response = self.responses[0]
+    response.put()
+    summary_json = response.key.get().summary_json
+    self.assertIsNotNone(summary_json)
+
+    self.mox.StubOutWithMock(Response, 'summarize')
+    self.mox.ReplayAll()
+
+    # loading and changing propagate state shouldn't regenerate
+    loaded = response.key.get()
+    loaded.status = 'complete'
+    loaded.sent = ['http://tar/get']
+    loaded.put()
+    self.assertEqual(summary_json, response.key.get().summary_json)
+
+  def test_canonical_activity_urls(self):
+    response = self.responses[0]
+    response.activities_json = [
+      json_dumps({'url': 'http://fa.ke/post/url'}),
+      json_dumps({'object': {'url': 'https://www.fa.ke/other'}}),
+      json_dumps({'url': 'http://not/fake'}),
+      json_dumps({'content': 'no url'}),
+    ]
+    self.assertEqual({'https://fa.ke/post/url', 'https://fa.ke/other'},
+                     response.canonical_activity_urls(self.sources[0]))
+
+    # regenerated when the response changes
+    response.activities_json = []
+    response.put()
+    self.assertEqual([], json_loads(response.key.get().summary_json)['activities'])
+
+  def test_get_or_save_fills_in_syndication_urls(self):
+    """Existing responses stored before syndication_urls get it."""
+    self.responses[0].put()
+
+    new = Response(id=self.responses[0].key.id(), source=self.sources[0].key,
+                   unsent=self.responses[0].unsent,
+                   response_json=self.responses[0].response_json,
+                   activities_json=self.responses[0].activities_json,
+                   syndication_urls=['https://fa.ke/post/url'])
+    got = new.get_or_save(self.sources[0])
+    self.assertEqual(['https://fa.ke/post/url'], got.syndication_urls)
+    self.assertEqual(['https://fa.ke/post/url'],
+                     self.responses[0].key.get().syndication_urls)
+
   def test_get_or_save_existing(self):
     """existing. shouldn't add a new propagate task."""
     self.responses[0].put()
@@ -195,6 +273,42 @@ class ResponseTest(testutil.AppTest):
     saved = self.responses[0].get_or_save(self.sources[0])
     self.assertEqual('complete', saved.status)
 
+  def test_get_or_save_multi(self):
+    # existing, with a new target. should merge and add a propagate task.
+    self.responses[0].put()
+    existing = Response(id=self.responses[0].key.id(),
+                        unsent=['http://new'],
+                        response_json=self.responses[0].response_json)
+
+    # new, with and without targets
+    self.responses[2].unsent = []
+    new = [self.responses[1], self.responses[2]]
+
+    self.expect_task('propagate', response_key=self.responses[0])
+    self.expect_task('propagate', response_key=self.responses[1])
+    self.mox.ReplayAll()
+
+    got = Response.get_or_save_multi([existing] + new, self.sources[0])
+    self.assertEqual([r.key for r in [existing] + new], [r.key for r in got])
+    self.assertEqual(['http://target1/post/url', 'http://new'], got[0].unsent)
+
+    stored = ndb.get_multi(r.key for r in [existing] + new)
+    self.assertEqual(['http://target1/post/url', 'http://new'],
+                     stored[0].unsent)
+    self.assertEqual('new', stored[1].status)
+    self.assertEqual('complete', stored[2].status)
+
+  def test_get_or_save_multi_coalesces_propagate_tasks(self):
+    bodies = []
+    self.mox.stubs.Set(util.tasks_client, 'create_task',
+                       lambda req: bodies.append(urllib.parse.parse_qs(
+                         req.task.app_engine_http_request.body.decode())))
+
+    Response.get_or_save_multi(self.responses[:3], self.sources[0])
+    self.assertEqual([{
+      'response_key': [r.key.urlsafe().decode() for r in self.responses[:3]],
+    }], bodies)
+
   def test_get_type(self):
     self.assertEqual('repost', Response.get_type(
         {'objectType': 'activity', 'verb': 'share'}))
@@ -677,6 +791,112 @@ class SourceTest(testutil.AppTest):
     Source.put_updates(source)
     self.assertEqual('disabled', source.key.get().status)
 
+  def test_sources_for_domain(self):
+    cache_key = (FakeSource._get_kind(), 'foo.com')
+    self.assertEqual([], FakeSource.sources_for_domain('foo.com'))
+    self.assertEqual([], models.domain_sources_cache[cache_key])
+
+    # put invalidates
+    source = FakeSource(id='x', domains=['foo.com'])
+    source.put()
+    self.assertNotIn(cache_key, models.domain_sources_cache)
+    self.assertEqual([source.key], [s.key for s in
+                                    FakeSource.sources_for_domain('foo.com')])
+    self.assertEqual([source.key], models.domain_sources_cache[cache_key])
+
+    # put_updates that don't change domains, features, or status don't
+    source.updates = {'last_poll_attempt': NOW}
+    Source.put_updates(source)
+    self.assertIn(cache_key, models.domain_sources_cache)
+
+    source.updates = {'features': ['listen']}
+    Source.put_updates(source)
+    self.assertNotIn(cache_key, models.domain_sources_cache)
+
+    # sources whose domains changed since we cached them are filtered out
+    other = FakeSource(id='y', domains=['bar.com'])
+    other.put()
+    models.domain_sources_cache[cache_key] = [source.key, other.key]
+    self.assertEqual([source.key], [s.key for s in
+                                    FakeSource.sources_for_domain('foo.com')])
+
+  def test_sources_for_domain_no_limit(self):
+    sources = [FakeSource(id=str(i), domains=['foo.com']) for i in range(120)]
+    ndb.put_multi(sources)
+    self.assertEqual(120, len(FakeSource.sources_for_domain('foo.com')))
+
+  def test_webmention_source_for_domain(self):
+    cache_key = (FakeSource._get_kind(), 'foo.com', 'webmention')
+    self.assertIsNone(FakeSource.webmention_source_for_domain('foo.com'))
+    self.assertIsNone(models.domain_sources_cache[cache_key])
+
+    # only the matching source's key is cached
+    FakeSource(id='a', domains=['foo.com'], features=['listen']).put()
+    source = FakeSource(id='b', domains=['foo.com'], features=['webmention'])
+    source.put()
+    self.assertEqual(source.key,
+                     FakeSource.webmention_source_for_domain('foo.com').key)
+    self.assertEqual(source.key, models.domain_sources_cache[cache_key])
+
+    # if the cached source doesn't match anymore, query again
+    other = FakeSource(id='c', domains=['foo.com'], features=['webmention'])
+    other.put()
+    FakeSource(id='b', domains=['foo.com'], features=['listen']).put()
+    models.domain_sources_cache[cache_key] = source.key
+    self.assertEqual(other.key,
+                     FakeSource.webmention_source_for_domain('foo.com').key)
+    self.assertEqual(other.key, models.domain_sources_cache[cache_key])
+
+  def test_user_index(self):
+    source = FakeSource(id='x', name='Alice Foo', features=['listen'])
+    source.put()
+    index_key = models.UserIndex.key_for(source)
+    self.assertEqual('alice foo', index_key.get().name)
+
+    source.updates = {'name': 'Bob'}
+    source = Source.put_updates(source)
+    self.assertEqual('bob', index_key.get().name)
+
+    source.updates = {'status': 'disabled'}
+    source = Source.put_updates(source)
+    self.assertIsNone(index_key.get())
+
+    source.updates = {'status': 'enabled', 'features': []}
+    source = Source.put_updates(source)
+    self.assertIsNone(index_key.get())
+
+  def test_user_index_unchanged(self):
+    source = FakeSource(id='x', name='Alice', features=['listen'])
+    source.put()
+    models.UserIndex.key_for(source).delete()
+
+    # puts that don't change the index name don't touch the index
+    source.last_webmention_sent = util.now()
+    source.put()
+    self.assertIsNone(models.UserIndex.key_for(source).get())
+
+    source.name = 'Alice Foo'
+    source.put()
+    self.assertEqual('alice foo', models.UserIndex.key_for(source).get().name)
+
+  def test_user_index_failed_transaction(self):
+    source = FakeSource(id='x', name='Alice', features=['listen'])
+
+    @ndb.transactional()
+    def put_and_fail():
+      source.put()
+      raise RuntimeError('fail')
+
+    with self.assertRaises(RuntimeError):
+      put_and_fail()
+
+    self.assertIsNone(source.key.get())
+    self.assertIsNone(models.UserIndex.key_for(source).get())
+
+    # the next put still writes the index entry
+    source.put()
+    self.assertEqual('alice', models.UserIndex.key_for(source).get().name)
+
   def test_poll_period(self):
     source = FakeSource.new()
     source.put()
@@ -696,6 +916,35 @@ class SourceTest(testutil.AppTest):
     source.rate_limited = True
     self.assertEqual(source.RATE_LIMITED_POLL, source.poll_period())
 
+  def test_poll_period_adaptive(self):
+    self.mox.stubs.Set(util, 'ADAPTIVE_POLL', True)
+    source = FakeSource.new(response_rate=0)
+    source.put()
+
+    # grace period caps at FAST_POLL
+    self.assertEqual(source.FAST_POLL, source.poll_period())
+
+    source.created = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    self.assertEqual(source.ADAPTIVE_POLL_MAX, source.poll_period())
+
+    source.response_rate = util.ADAPTIVE_POLL_TARGET_RESPONSES  # one per hour
+    self.assertEqual(timedelta(hours=1), source.poll_period())
+
+    # never faster than FAST_POLL
+    source.response_rate = 1000
+    self.assertEqual(source.FAST_POLL, source.poll_period())
+
+    self.mox.stubs.Set(FakeSource, 'FAST_POLL', timedelta(hours=2))
+    self.assertEqual(timedelta(hours=2), source.poll_period())
+
+    source.rate_limited = True
+    self.assertEqual(source.RATE_LIMITED_POLL, source.poll_period())
+
+  def test_poll_period_adaptive_off(self):
+    source = FakeSource.new(response_rate=1000,
+                            created=datetime(2000, 1, 1, tzinfo=timezone.utc))
+    self.assertEqual(source.SLOW_POLL, source.poll_period())
+
   def test_should_refetch(self):
     source = FakeSource.new()  # haven't found a synd url yet
     self.assertFalse(source.should_refetch())
@@ -915,3 +1164,26 @@ class SyndicatedPostTest(testutil.AppTest):
     ).fetch()
 
     self.assertEqual(1, len(rs))
+
+  def test_write_multi(self):
+    SyndicatedPost.write_multi(self.source, inserts=[
+      # replaces blank
+      SyndicatedPost(parent=self.source.key, original='http://original/new',
+                     syndication='http://silo/no-original'),
+      # duplicate
+      SyndicatedPost(parent=self.source.key, original='http://original/post/url',
+                     syndication='http://silo/post/url'),
+    ], original_blanks=[
+      'http://original/no-syndication',  # existing blank
+      'http://original/post/url',  # existing relationship
+      'http://original/blank',
+    ], deletes=[self.relationships[1]])
+
+    self.assertCountEqual([
+      ('http://original/post/url', 'http://silo/post/url'),
+      ('http://original/another/post', 'http://silo/post/url'),
+      ('http://original/new', 'http://silo/no-original'),
+      ('http://original/no-syndication', None),
+      ('http://original/blank', None),
+    ], [(r.original, r.syndication)
+        for r in SyndicatedPost.query(ancestor=self.source.key)])
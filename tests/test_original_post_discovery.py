@@ -1,13 +1,17 @@
 """Unit tests for original_post_discovery.py"""
+import collections
+import copy
 from datetime import datetime, timezone
 from string import hexdigits
+import threading
+import time
 
 from oauth_dropins.webutil.testutil import NOW
 from oauth_dropins.webutil.util import json_dumps, json_loads
 from requests.exceptions import HTTPError
 
 from github import GitHub
-from models import SyndicatedPost
+from models import FeedFetch, SyndicatedPost
 import original_post_discovery
 from original_post_discovery import (
   discover,
@@ -23,6 +27,7 @@ class OriginalPostDiscoveryTest(testutil.AppTest):
 
   def setUp(self):
     super().setUp()
+    self.run_serially()
     self.source = self.sources[0]
     self.source.domain_urls = ['http://author/']
     self.source.domains = ['author']
@@ -669,6 +674,8 @@ class OriginalPostDiscoveryTest(testutil.AppTest):
     # syndication url or permalink again
     self.assert_syndicated_posts(('http://author/nonexistent.html', None),
                                  (None, 'https://fa.ke/post/url'))
+    # ...but not the feed's state, so that we'll process it again
+    self.assertIsNone(FeedFetch.get_by_id('http://author/', parent=self.source.key))
 
   def test_post_permalink_not_found(self):
     """Make sure something reasonable happens when the permalink of an
@@ -884,6 +891,99 @@ class OriginalPostDiscoveryTest(testutil.AppTest):
     self.mox.ReplayAll()
     discover(self.source, self.activity)
 
+  def test_concurrent_permalink_fetches(self):
+    """Permalinks are fetched in parallel, up to the per-host limit, and
+    permalinks with u-syndication in the h-feed aren't fetched at all.
+    """
+    self.run_concurrently()
+    self.mox.stubs.Set(original_post_discovery, 'MAX_PERMALINK_FETCHES_PER_HOST', 2)
+
+    self.expect_requests_get('http://author/', """
+    <html class="h-feed">
+      <a class="h-entry" href="/1"></a>
+      <a class="h-entry" href="/2"></a>
+      <a class="h-entry" href="/3"></a>
+      <a class="h-entry" href="http://other/4"></a>
+      <div class="h-entry">
+        <a class="u-url" href="/5"></a>
+        <a class="u-syndication" href="https://fa.ke/post/5"></a>
+      </div>
+    </html>""")
+    self.mox.ReplayAll()
+
+    lock = threading.Lock()
+    fetched = []
+    in_flight = collections.Counter()
+    max_in_flight = collections.Counter()
+
+    def fetch_mf2(url, **kwargs):
+      domain = util.domain_from_link(url)
+      with lock:
+        fetched.append(url)
+        in_flight[domain] += 1
+        max_in_flight[domain] = max(max_in_flight[domain], in_flight[domain])
+      time.sleep(.01)
+      with lock:
+        in_flight[domain] -= 1
+      synd = ('https://fa.ke/post/url' if url == 'http://author/2'
+              else 'http://elsewhere/')
+      return {'items': [], 'rels': {'syndication': [synd]}}
+
+    self.mox.stubs.Set(util, 'fetch_mf2', fetch_mf2)
+    self.mox.stubs.Set(util, 'get_webmention_target', lambda url, **kwargs:
+                       (url, util.domain_from_link(url), True))
+
+    self.assert_discover(['http://author/2'])
+    self.assertCountEqual(['http://author/1', 'http://author/2',
+                           'http://author/3', 'http://other/4'], fetched)
+    self.assertLessEqual(max_in_flight['author'], 2)
+    self.assert_syndicated_posts(('http://author/1', None),
+                                 ('http://author/2', 'https://fa.ke/post/url'),
+                                 ('http://author/3', None),
+                                 ('http://other/4', None),
+                                 ('http://author/5', 'https://fa.ke/post/5'))
+
+  def test_load_relationships(self):
+    """discover() should use relationships from load_relationships()."""
+    stored = SyndicatedPost(parent=self.source.key, original='http://author/post',
+                            syndication='https://fa.ke/post/url')
+    stored.put()
+
+    other = copy.deepcopy(self.activity)
+    other['object']['url'] = 'https://fa.ke/post/other'
+    relationships = original_post_discovery.load_relationships(
+      self.source, [self.activity, other])
+    self.assertEqual({
+      'https://fa.ke/post/url': [stored],
+      'https://fa.ke/post/other': [],
+    }, relationships)
+
+    # not in the datastore, only the index
+    relationships['https://fa.ke/post/other'].append(SyndicatedPost(
+      parent=self.source.key, original='http://author/other',
+      syndication='https://fa.ke/post/other'))
+
+    self.assert_discover(['http://author/post'], relationships=relationships)
+    self.activity = other
+    self.assert_discover(['http://author/other'], relationships=relationships)
+
+  def test_load_relationships_removes_deleted(self):
+    """Relationships deleted during discovery should be dropped from the index."""
+    blank = SyndicatedPost(parent=self.source.key, original=None,
+                           syndication='https://fa.ke/post/url')
+    blank.put()
+    relationships = original_post_discovery.load_relationships(
+      self.source, [self.activity])
+    self.assertEqual([blank], relationships['https://fa.ke/post/url'])
+
+    writes = original_post_discovery._SyndicatedPostWrites(
+      self.source, relationships=relationships)
+    writes.insert('https://fa.ke/post/url', 'http://author/post')
+    writes.commit()
+
+    self.assertIsNone(blank.key.get())
+    self.assertEqual([], relationships['https://fa.ke/post/url'])
+
   def test_do_not_fetch_hfeed(self):
     """Confirms behavior of discover() when fetch_hfeed=False.
     Discovery should only check the database for previously discovered matches.
@@ -1139,6 +1239,40 @@ class OriginalPostDiscoveryTest(testutil.AppTest):
     refetch(self.source)
     self.assert_syndicated_posts(('http://author/permalink', 'https://fa.ke/post/url'))
 
+  def test_unchanged_feed_skips_parsing(self):
+    """If the author URL hasn't changed since we last processed it, discovery
+    shouldn't look at its permalinks again. Refetch still should.
+    """
+    hfeed = """<html class="h-feed">
+    <a class="h-entry" href="/permalink"></a>
+    </html>"""
+    unsyndicated = """<html class="h-entry">
+    <a class="u-url" href="/permalink"></a>
+    </html>"""
+
+    self.expect_requests_get('http://author/', hfeed,
+                             response_headers={'ETag': '"abc"'})
+    self.expect_requests_get('http://author/permalink', unsyndicated)
+
+    # not modified
+    self.expect_requests_get('http://author/', status_code=304,
+                             headers={'If-None-Match': '"abc"'})
+
+    # same content, refetch
+    self.expect_requests_get('http://author/', hfeed)
+    self.expect_requests_get('http://author/permalink', unsyndicated)
+
+    self.mox.ReplayAll()
+    discover(self.source, self.activities[0])
+    fetch = FeedFetch.get_by_id('http://author/', parent=self.source.key)
+    self.assertEqual('"abc"', fetch.etag)
+    self.assertEqual([['http://author/permalink']],
+                     [item['properties']['url'] for item in fetch.items])
+
+    self.activities[1]['object']['url'] = 'https://fa.ke/post/other'
+    discover(self.source, self.activities[1])
+    refetch(self.source)
+
   def test_refetch_two_permalinks_same_syndication(self):
     """
     This causes a problem if refetch assumes that syndication-url is
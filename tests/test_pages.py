@@ -4,6 +4,7 @@ import urllib.request, urllib.parse, urllib.error
 from urllib.parse import urlencode, urlparse, parse_qs
 
 from flask import get_flashed_messages
+from flask_caching.backends import SimpleCache
 from google.cloud import ndb
 from mox3 import mox
 from oauth_dropins.webutil.testutil import NOW
@@ -33,6 +34,7 @@ class PagesTest(testutil.AppTest):
 
   def setUp(self):
     super().setUp()
+    self.run_serially()
     self.sources[0].put()
 
   def test_front_page(self):
@@ -79,6 +81,7 @@ class PagesTest(testutil.AppTest):
 
     # cached webmention endpoint
     util.webmention_endpoint_cache['https skipped /'] = 'asdf'
+    util.WebmentionEndpoint(id='https skipped /', endpoint='asdf').put()
 
     response = self.client.post('/retry', data={'key': key})
     self.assertEqual(302, response.status_code)
@@ -96,6 +99,7 @@ class PagesTest(testutil.AppTest):
 
     # webmention endpoints for URL domains should be refreshed
     self.assertNotIn('https skipped /', util.webmention_endpoint_cache)
+    self.assertIsNone(util.WebmentionEndpoint.get_by_id('https skipped /'))
 
     # shouldn't have refetched h-feed
     self.assertEqual(last_hfeed_refetch, source.key.get().last_hfeed_refetch)
@@ -480,6 +484,34 @@ class PagesTest(testutil.AppTest):
     self.assertEqual(200, resp.status_code)
     self.assertIn('Not polled yet,', resp.get_data(as_text=True))
 
+  def test_user_page_responses_cache(self):
+    self.mox.stubs.Set(pages, 'cache', SimpleCache())
+    self.sources[0].features = ['listen']
+    self.sources[0].put()
+    self.responses[0].status = 'new'
+    self.responses[0].put()
+
+    prepared = []
+    orig_prepare = pages.prepare_user_response
+    def prepare(r):
+      prepared.append(r.key)
+      return orig_prepare(r)
+    self.mox.stubs.Set(pages, 'prepare_user_response', prepare)
+
+    path = self.sources[0].bridgy_path()
+    for _ in range(2):
+      resp = self.client.get(path)
+      self.assertEqual(200, resp.status_code)
+      self.assertIn('value="new"', resp.get_data(as_text=True))
+    self.assertEqual([self.responses[0].key], prepared)
+
+    # any put changes updated, which changes the cache key
+    self.responses[0].status = 'complete'
+    self.responses[0].put()
+    resp = self.client.get(path)
+    self.assertIn('value="complete"', resp.get_data(as_text=True))
+    self.assertEqual([self.responses[0].key] * 2, prepared)
+
   def test_user_page_responses_before_after(self):
     for param in 'responses_before', 'responses_after':
       resp = self.client.get(f'{self.sources[0].bridgy_path()}?{param}=2022-05-09T10:13:28')
@@ -526,6 +558,19 @@ class PagesTest(testutil.AppTest):
         f'<a href="{entity.bridgy_path()}" title="{entity.label()}"',
         resp.get_data(as_text=True))
 
+  def test_users_page_start_name(self):
+    before = testutil.FakeSource.new(name='abc', features=['listen'])
+    before.put()
+    after = testutil.FakeSource.new(name='Xyz', features=['listen'])
+    after.put()
+
+    resp = self.client.get('/users?start_name=X')
+    self.assertEqual(200, resp.status_code)
+    body = resp.get_data(as_text=True)
+    self.assertIn(f'<a href="{after.bridgy_path()}"', body)
+    self.assertNotIn(f'<a href="{before.bridgy_path()}"', body)
+    self.assertNotIn('cursor=', body)
+
   def test_logout(self):
     util.now = lambda: datetime(2000, 1, 1, tzinfo=timezone.utc)
     resp = self.client.get('/logout')
@@ -654,6 +699,7 @@ class DiscoverTest(testutil.AppTest):
 
   def setUp(self):
     super().setUp()
+    self.run_serially()
     self.source = self.sources[0]
     self.source.domains = ['si.te']
     self.source.put()
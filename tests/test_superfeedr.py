@@ -17,6 +17,7 @@ class SuperfeedrTest(testutil.AppTest):
 
   def setUp(self):
     super().setUp()
+    self.run_serially()
 
     self.app = Flask('test_superfeedr')
     self.app.add_url_rule('/notify/<id>', methods=['POST'],
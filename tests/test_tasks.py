@@ -1,10 +1,12 @@
 """Unit tests for tasks.py."""
+import collections
 import copy
 import datetime
 import http.client
 import socket
 import string
 import io
+import threading
 import time
 from unittest import skip
 import urllib.request, urllib.parse, urllib.error
@@ -39,6 +41,7 @@ class TaskTest(testutil.BackgroundTest):
 
   def setUp(self):
     super().setUp()
+    self.run_serially()
     self.sources[0].put()
 
   def post_task(self, expected_status=200, params={}, **kwargs):
@@ -62,8 +65,10 @@ class TaskTest(testutil.BackgroundTest):
       if 'response_json' not in ignore:
         resp.response_json = json_dumps(json_loads(resp.response_json), sort_keys=True)
 
-    self.assert_entities_equal(expected, stored,
-                               ignore=('created', 'updated') + ignore)
+    self.assert_entities_equal(
+      expected, stored,
+      ignore=('created', 'updated', 'summary_json',
+              'syndication_urls') + ignore)
 
   def expect_get_activities(self, **kwargs):
     """Adds and returns an expected get_activities_response() call."""
@@ -149,11 +154,64 @@ class PollTest(TaskTest):
     self.post_task(expect_poll=FakeSource.FAST_POLL)
     self.assertEqual(12, Response.query().count())
     self.assert_responses()
+    for resp in Response.query():
+      self.assertEqual(['https://fa.ke/post/url'], resp.syndication_urls)
 
     source = self.sources[0].key.get()
     self.assertEqual(NOW, source.last_polled)
     self.assertEqual('ok', source.poll_status)
 
+    health = models.PollHealth.key_for(source).get()
+    self.assertEqual('fake', health.silo)
+    self.assertEqual('ok', health.poll_status)
+    self.assertFalse(health.rate_limited)
+    self.assertEqual(3, health.activities)
+    self.assertEqual(12, health.responses)
+    self.assertLessEqual(NOW + FakeSource.FAST_POLL * .8, health.next_poll)
+    self.assertGreaterEqual(NOW + FakeSource.FAST_POLL * 1.2, health.next_poll)
+    self.assertGreaterEqual(health.duration, 0)
+    self.assertGreaterEqual(health.http_calls, 1)  # at least get_activities
+
+  def test_poll_time_wheel(self):
+    """With the time wheel, poll stores next_poll instead of adding a task."""
+    self.mox.stubs.Set(util, 'POLL_TIME_WHEEL', True)
+    for resp in self.responses:
+      self.expect_task('propagate', response_key=resp)
+    self.mox.ReplayAll()
+
+    self.post_task()
+
+    source = self.sources[0].key.get()
+    self.assertLessEqual(NOW + FakeSource.FAST_POLL * .8, source.next_poll)
+    self.assertGreaterEqual(NOW + FakeSource.FAST_POLL * 1.2, source.next_poll)
+    self.assertEqual(source.next_poll,
+                     models.PollHealth.key_for(source).get().next_poll)
+
+  def test_poll_time_wheel_disabled_source(self):
+    """A disabled source's next_poll is cleared so the wheel drops it."""
+    self.mox.stubs.Set(util, 'POLL_TIME_WHEEL', True)
+    self.sources[0].status = 'disabled'
+    self.sources[0].next_poll = NOW
+    self.sources[0].put()
+
+    self.post_task()
+    self.assertIsNone(self.sources[0].key.get().next_poll)
+
+  def test_poll_time_wheel_stale_task(self):
+    """A wheel task for an old next_poll is dropped, eg after a poll-now."""
+    self.mox.stubs.Set(util, 'POLL_TIME_WHEEL', True)
+    self.sources[0].next_poll = NOW + datetime.timedelta(minutes=10)
+    self.sources[0].put()
+    self.mox.StubOutWithMock(FakeSource, 'get_activities_response')
+    self.mox.ReplayAll()
+
+    self.client.post(self.post_url, data={
+      'source_key': self.sources[0].key.urlsafe().decode(),
+      'next_poll': str(int(util.to_utc_timestamp(NOW))),
+    })
+    self.assertEqual(self.sources[0].last_poll_attempt,
+                     self.sources[0].key.get().last_poll_attempt)
+
   def test_poll_no_auto_poll(self):
     FakeGrSource.clear()
     self.stub_create_task()
@@ -179,6 +237,11 @@ class PollTest(TaskTest):
     self.assertRaises(Exception, self.post_task, expect_poll=False)
     self.assertEqual('error', self.sources[0].key.get().poll_status)
 
+    health = models.PollHealth.key_for(self.sources[0]).get()
+    self.assertEqual('error', health.poll_status)
+    self.assertIsNone(health.next_poll)
+    self.assertIsNone(health.responses)
+
   def test_poll_silo_500(self):
     """If a silo HTTP request 500s, we should quietly retry the task."""
     self.expect_get_activities().AndRaise(
@@ -723,6 +786,28 @@ class PollTest(TaskTest):
       unsent=['http://foo/post', 'http://foo/'],
     )], ignore=('activities_json', 'response_json', 'source', 'original_posts'))
 
+  def test_search_for_links_error(self):
+    """An error from the concurrent link search fails the poll."""
+    # search_for_links runs in a worker thread, and mox isn't thread safe, so
+    # stub it with a plain function
+    def search_for_links(_):
+      raise Exception('foo')
+    self.mox.stubs.Set(FakeSource, 'search_for_links', search_for_links)
+
+    self.expect_get_activities().AndReturn({'items': []})
+    self.mox.ReplayAll()
+
+    self.assertRaises(Exception, self.post_task, expect_poll=False)
+    self.assertEqual('error', self.sources[0].key.get().poll_status)
+
+  def test_search_for_links_not_concurrent(self):
+    self.mox.stubs.Set(tasks.Poll, 'CONCURRENT_FETCHES', False)
+    for resp in self.responses:
+      self.expect_task('propagate', response_key=resp)
+
+    self.post_task(expect_poll=FakeSource.FAST_POLL)
+    self.assert_responses()
+
   def test_search_links_returns_comment_with_link(self):
     """Legendary KeyError bug, https://github.com/snarfed/bridgy/issues/237"""
     source = self.sources[0]
@@ -1041,6 +1126,12 @@ class PollTest(TaskTest):
     self.mox.ReplayAll()
     self.post_task()
 
+  def post_refetch_task(self, expected_status=200):
+    resp = self.client.post('/_ah/queue/refetch', data={
+      'source_key': self.sources[0].key.urlsafe().decode(),
+    })
+    self.assertEqual(expected_status, resp.status_code)
+
   def _setup_refetch_hfeed(self):
     self.sources[0].domain_urls = ['http://author']
     ten_min = datetime.timedelta(minutes=10)
@@ -1059,6 +1150,7 @@ class PollTest(TaskTest):
     # and all the status have already been sent
     for r in self.responses:
       r.status = 'complete'
+      r.syndication_urls = sorted(r.canonical_activity_urls(self.sources[0]))
       r.put()
 
   def test_do_not_refetch_hfeed(self):
@@ -1098,29 +1190,48 @@ class PollTest(TaskTest):
       source=self.sources[0].key,
       status='complete',
       original_posts=['http://author/permalink'],
+      syndication_urls=['https://fa.ke/post/url'],
     )
     resp.put()
     self.responses = [resp]
 
     self._expect_fetch_hfeed()
-    self.post_task(expect_poll=FakeSource.FAST_POLL)
+    self.mox.ReplayAll()
+    self.post_refetch_task()
 
     # shouldn't repropagate it
     self.assertEqual('complete', resp.key.get().status)
 
+  def test_poll_adds_refetch_task(self):
+    """Every two hours or so, poll should add a task to refetch the author's
+    page, and not fetch it inline."""
+    self._setup_refetch_hfeed()
+    self.expect_task('refetch', source_key=self.sources[0])
+
+    self.post_task(expect_poll=FakeSource.FAST_POLL)
+    self.assertEqual(NOW, self.sources[0].key.get().last_hfeed_refetch)
+
+    # should still be a blank SyndicatedPost
+    relationships = SyndicatedPost.query(
+      SyndicatedPost.original == 'http://author/permalink',
+      ancestor=self.sources[0].key).fetch()
+    self.assertEqual(1, len(relationships))
+    self.assertIsNone(relationships[0].syndication)
+
   def test_do_refetch_hfeed(self):
     """Emulate a situation where we've done posse-post-discovery earlier and
-    found no rel=syndication relationships for a particular silo URL. Every
-    two hours or so, we should refetch the author's page and check to see if
-    any new syndication links have been added or updated.
+    found no rel=syndication relationships for a particular silo URL. The
+    refetch task should refetch the author's page and check to see if any new
+    syndication links have been added or updated.
     """
     self._setup_refetch_hfeed()
     self._expect_fetch_hfeed()
     # should repropagate all 12 responses
     for resp in self.responses:
       self.expect_task('propagate', response_key=resp)
+    self.mox.ReplayAll()
 
-    self.post_task(expect_poll=FakeSource.FAST_POLL)
+    self.post_refetch_task()
 
     # should have a new SyndicatedPost
     relationships = SyndicatedPost.query(
@@ -1133,6 +1244,40 @@ class PollTest(TaskTest):
     self.assertEqual(NOW, source.last_syndication_url)
     self.assertEqual(NOW, source.last_hfeed_refetch)
 
+  def test_refetch_hfeed_responses_without_syndication_urls(self):
+    """Until the backfill is done, refetch also scans responses without
+    syndication_urls, and stores it on the ones it repropagates."""
+    self._setup_refetch_hfeed()
+    for resp in self.responses:
+      resp.syndication_urls = []
+      resp.put()
+
+    self._expect_fetch_hfeed()
+    for resp in self.responses:
+      self.expect_task('propagate', response_key=resp)
+    self.mox.ReplayAll()
+
+    self.post_refetch_task()
+    for resp in self.responses:
+      stored = resp.key.get()
+      self.assertEqual('new', stored.status)
+      self.assertEqual(['https://fa.ke/post/url'], stored.syndication_urls)
+
+  def test_refetch_hfeed_backfilled_doesnt_scan(self):
+    self.mox.stubs.Set(tasks, 'RESPONSE_SYNDICATION_URLS_BACKFILLED', True)
+    self._setup_refetch_hfeed()
+    for resp in self.responses:
+      resp.syndication_urls = []
+      resp.put()
+
+    self._expect_fetch_hfeed()
+    self.stub_create_task()  # shouldn't add any tasks
+    self.mox.ReplayAll()
+
+    self.post_refetch_task()
+    for resp in self.responses:
+      self.assertEqual('complete', resp.key.get().status)
+
   def test_refetch_hfeed_trigger(self):
     self.sources[0].domain_urls = ['http://author']
     FakeGrSource.DOMAIN = 'source'
@@ -1142,9 +1287,16 @@ class PollTest(TaskTest):
 
     FakeGrSource.activities = []
 
-    self._expect_fetch_hfeed()
+    self.expect_task('refetch', source_key=self.sources[0])
+    self.post_task(expect_poll=FakeSource.FAST_POLL)
+    self.assertEqual(NOW, self.sources[0].key.get().last_hfeed_refetch)
+
+  def test_refetch_disabled_source(self):
+    self.sources[0].status = 'disabled'
+    self.sources[0].put()
+    # mox will complain if it fetches the h-feed
     self.mox.ReplayAll()
-    self.post_task()
+    self.post_refetch_task()
 
   def test_refetch_hfeed_repropagate_responses_query_expired(self):
     """https://github.com/snarfed/bridgy/issues/515"""
@@ -1171,11 +1323,12 @@ class PollTest(TaskTest):
     self._expect_fetch_hfeed()
 
     self.mox.StubOutWithMock(Response, 'query')
-    Response.query(Response.source == self.sources[0].key).AndRaise(exception)
+    Response.query(Response.source == self.sources[0].key, mox.IgnoreArg()
+                   ).AndRaise(exception)
     self.mox.ReplayAll()
 
     # should 200
-    self.post_task()
+    self.post_refetch_task()
     self.assertEqual(NOW, self.sources[0].key.get().last_hfeed_refetch)
 
   def test_response_changed(self):
@@ -1196,14 +1349,14 @@ class PollTest(TaskTest):
     self._change_response_and_poll()
 
     # return new response *and* existing response. both should be stored in
-    # Source.seen_responses_cache_json
+    # Source.seen_responses_fingerprints
     replies = activity['object']['replies']['items']
     replies.append(self.activities[1]['object']['replies']['items'][0])
 
     self.expect_task('propagate', response_key=self.responses[4])
 
     self.post_task(reset=True, expect_poll=FakeSource.FAST_POLL)
-    self.assert_equals(replies, json_loads(source.key.get().seen_responses_cache_json))
+    self.assert_seen_responses(replies)
     self.responses[4].key.delete()
 
     # new responses that don't include existing response. cache will have
@@ -1220,7 +1373,29 @@ class PollTest(TaskTest):
     self.post_task(reset=True, expect_poll=FakeSource.FAST_POLL)
     self.assert_equals([r.key for r in self.responses[:4]],
                        list(Response.query().iter(keys_only=True)))
-    self.assert_equals(tags, json_loads(source.key.get().seen_responses_cache_json))
+    self.assert_seen_responses(tags)
+
+  def assert_seen_responses(self, responses):
+    source = self.sources[0].key.get()
+    self.assertEqual({r['id']: util.activity_fingerprint(r) for r in responses},
+                     source.seen_responses_fingerprints)
+    self.assertIsNone(source.seen_responses_cache_json)
+
+  def test_seen_responses_cache_json_migration(self):
+    """Old seen_responses_cache_json blobs should be converted to fingerprints."""
+    activity = self.activities[0]
+    del activity['object']['tags']
+    FakeGrSource.activities = [activity]
+    reply = activity['object']['replies']['items'][0]
+
+    source = self.sources[0]
+    source.seen_responses_cache_json = json_dumps([reply])
+    source.put()
+
+    # reply is unchanged, so it shouldn't be propagated
+    self.post_task(expect_poll=FakeSource.FAST_POLL)
+    self.assertEqual(0, Response.query().count())
+    self.assert_seen_responses([reply])
 
   def _change_response_and_poll(self):
     resp = self.responses[0].key.get() or self.responses[0]
@@ -1244,8 +1419,7 @@ class PollTest(TaskTest):
     self.assertEqual(targets, resp.unsent)
     self.assertEqual([], resp.sent)
 
-    source = self.sources[0].key.get()
-    self.assert_equals([reply], json_loads(source.seen_responses_cache_json))
+    self.assert_seen_responses([reply])
 
     self.mox.VerifyAll()
     self.mox.UnsetStubs()
@@ -1435,6 +1609,11 @@ class PropagateTest(TaskTest):
     for r in self.responses[:4]:
       r.put()
 
+  def send_serially(self):
+    """Sends to one domain at a time. For tests with mox expectations for
+    multiple domains, since mox isn't thread safe."""
+    self.mox.stubs.Set(tasks.SendWebmentions, 'MAX_CONCURRENT_DOMAINS', 1)
+
   def post_task(self, expected_status=200, response=None, **kwargs):
     if response is None:
       response = self.responses[0]
@@ -1507,7 +1686,7 @@ class PropagateTest(TaskTest):
       self.assert_response_is('complete', now + LEASE_LENGTH,
                               sent=['http://target1/post/url'], response=r)
       self.assert_equals(now, self.sources[0].key.get().last_webmention_sent)
-      util.webmention_endpoint_cache.clear()
+      util.invalidate_webmention_endpoints(['http://target1/post/url'])
 
   def test_propagate_from_error(self):
     """A normal propagate task, with a response starting as 'error'."""
@@ -1523,6 +1702,7 @@ class PropagateTest(TaskTest):
 
   def test_success_and_errors(self):
     """We should send webmentions to the unsent and error targets."""
+    self.send_serially()
     self.responses[0].unsent = ['http://1', 'http://2', 'http://3', 'http://8']
     self.responses[0].error = ['http://4', 'http://5', 'http://6', 'http://9']
     self.responses[0].sent = ['http://7']
@@ -1561,6 +1741,35 @@ class PropagateTest(TaskTest):
     self.responses[0].put()
     self.post_task()
 
+  def test_shared_webmention_endpoint_cache(self):
+    """Discovered endpoints should be shared via the datastore."""
+    self.expect_webmention()
+    # second webmention should use the endpoint from the datastore
+    self.expect_webmention(discover=False)
+    self.mox.ReplayAll()
+
+    self.post_task()
+    stored = util.WebmentionEndpoint.get_by_id('http target1')
+    self.assertEqual('http://webmention/endpoint', stored.endpoint)
+    self.assertEqual(NOW + util.WEBMENTION_ENDPOINT_CACHE_TTL, stored.expires)
+
+    # simulate a new instance
+    util.webmention_endpoint_cache.clear()
+    self.responses[0].status = 'new'
+    self.responses[0].put()
+    self.post_task()
+    self.assert_response_is('complete', sent=['http://target1/post/url'])
+
+  def test_shared_webmention_endpoint_cache_expired(self):
+    util.WebmentionEndpoint(id='http target1', endpoint='http://old/endpoint',
+                            expires=NOW).put()
+    self.expect_webmention()
+    self.mox.ReplayAll()
+
+    self.post_task()
+    self.assertEqual('http://webmention/endpoint',
+                     util.WebmentionEndpoint.get_by_id('http target1').endpoint)
+
   def test_cached_webmention_discovery_error(self):
     """Failed webmention discovery should be cached too."""
     self.expect_webmention(endpoint=None)
@@ -1575,6 +1784,57 @@ class PropagateTest(TaskTest):
     self.post_task()
     self.assert_response_is('complete', skipped=['http://target1/post/url'])
 
+  def test_circuit_breaker_opens(self):
+    self.mox.stubs.Set(util, 'DOMAIN_CIRCUIT_FAILURE_THRESHOLD', 2)
+    self.expect_webmention(send_status=500)
+    self.expect_webmention(discover=False, send_status=500)
+    # third time shouldn't make any HTTP requests
+    self.mox.ReplayAll()
+
+    for failures in 1, 2, 2:
+      self.responses[0].status = 'new'
+      self.responses[0].put()
+      self.post_task(expected_status=ERROR_HTTP_RETURN_CODE)
+      self.assert_response_is('error', error=['http://target1/post/url'])
+      self.assertEqual(failures, util.DomainHealth.get_by_id('target1').failures)
+
+    health = util.DomainHealth.get_by_id('target1')
+    self.assertEqual(NOW, health.opened)
+    self.assertEqual('open', health.state())
+
+  def test_circuit_breaker_half_open(self):
+    util.DomainHealth(id='target1', failures=5, opened=NOW - util.DOMAIN_CIRCUIT_COOLDOWN).put()
+    self.responses[0].unsent = ['http://target1/a', 'http://target1/post/url']
+    self.responses[0].put()
+
+    # should only send to the first target, as a probe
+    self.expect_webmention(target='http://target1/a')
+    self.mox.ReplayAll()
+
+    self.post_task(expected_status=ERROR_HTTP_RETURN_CODE)
+    self.assert_response_is('error', sent=['http://target1/a'],
+                            error=['http://target1/post/url'])
+    # probe succeeded, circuit should be closed
+    self.assertIsNone(util.DomainHealth.get_by_id('target1'))
+
+  def test_circuit_breaker_ignores_non_transient_errors(self):
+    self.expect_webmention(send=False).AndRaise(Exception('unparseable'))
+    self.mox.ReplayAll()
+
+    self.post_task(expected_status=ERROR_HTTP_RETURN_CODE)
+    self.assert_response_is('error', error=['http://target1/post/url'])
+    self.assertIsNone(util.DomainHealth.get_by_id('target1'))
+
+  def test_record_domain_health_reloads(self):
+    """Failures are added to the stored state, not a copy loaded earlier."""
+    util.DomainHealth(id='target1', failures=1).put()
+    loaded = util.load_domain_health(['target1'])
+
+    util.DomainHealth(id='target1', failures=3).put()  # another sender
+    util.record_domain_health({'target1': requests.ConnectionError()})
+    self.assertEqual(1, loaded['target1'].failures)
+    self.assertEqual(4, util.DomainHealth.get_by_id('target1').failures)
+
   def test_errors_and_caching_endpoint(self):
     """Only cache on wm endpoint failures, not discovery failures."""
     self.expect_webmention(send=False).AndRaise(requests.ConnectionError())
@@ -1604,6 +1864,9 @@ class PropagateTest(TaskTest):
     self.expect_webmention()
     self.mox.ReplayAll()
 
+    # only test the in-process tier
+    self.mox.stubs.Set(util, 'WEBMENTION_ENDPOINT_CACHE_DATASTORE', False)
+
     # inject a fake time.time into the cache
     now = time.time()
     util.webmention_endpoint_cache = TTLCache(500, 2, timer=lambda: now)
@@ -1623,6 +1886,77 @@ class PropagateTest(TaskTest):
     self.post_task()
     self.assert_response_is('complete', sent=['http://target1/post/url'])
 
+  def test_concurrent_domains(self):
+    """Different domains are sent in parallel, each domain serially."""
+    self.mox.stubs.Set(tasks.SendWebmentions, 'MAX_CONCURRENT_DOMAINS', 3)
+    self.responses[0].unsent = ['http://a/1', 'http://a/2', 'http://b/1',
+                                'http://c/1']
+    self.responses[0].put()
+
+    lock = threading.Lock()
+    in_flight = collections.Counter()
+    max_in_flight = collections.Counter()
+
+    def discover(target, **kwargs):
+      domain = util.domain_from_link(target)
+      with lock:
+        in_flight[domain] += 1
+        max_in_flight[domain] = max(max_in_flight[domain], in_flight[domain])
+      time.sleep(.01)
+      with lock:
+        in_flight[domain] -= 1
+      return f'http://{domain}/endpoint', None
+
+    def send(endpoint, source, target, **kwargs):
+      if target == 'http://c/1':
+        raise requests.ConnectionError()
+      return 'OK'
+
+    self.mox.stubs.Set(tasks.webmention, 'discover', discover)
+    self.mox.stubs.Set(tasks.webmention, 'send', send)
+
+    # record_source_webmention should only be called once per task
+    self.mox.StubOutWithMock(tasks.PropagateResponse, 'record_source_webmention')
+    tasks.PropagateResponse.record_source_webmention([
+      ('http://a/endpoint', 'http://a/1'),
+      ('http://a/endpoint', 'http://a/2'),
+      ('http://b/endpoint', 'http://b/1'),
+    ])
+    self.mox.ReplayAll()
+
+    self.post_task(expected_status=ERROR_HTTP_RETURN_CODE)
+    self.assert_response_is('error', sent=['http://a/1', 'http://a/2', 'http://b/1'],
+                            error=['http://c/1'])
+    self.assertEqual({'a': 1, 'b': 1, 'c': 1}, max_in_flight)
+
+  def test_propagate_batch(self):
+    """One task with multiple responses shares discovery and the source."""
+    self.responses[2].status = 'complete'
+    self.responses[2].put()
+
+    # only discover once, for the first response
+    id = self.sources[0].key.string_id()
+    self.expect_webmention(source_url=f'http://localhost/comment/fake/{id}/a/1_2_a')
+    self.expect_webmention(source_url=f'http://localhost/like/fake/{id}/a/alice',
+                           discover=False, send=True)
+
+    # record_source_webmention should only be called once per task
+    self.mox.StubOutWithMock(tasks.PropagateResponse, 'record_source_webmention')
+    tasks.PropagateResponse.record_source_webmention([
+      ('http://webmention/endpoint', 'http://target1/post/url'),
+      ('http://webmention/endpoint', 'http://target1/post/url'),
+    ])
+    self.mox.ReplayAll()
+
+    super(PropagateTest, self).post_task(params={
+      'response_key': [r.key.urlsafe().decode() for r in self.responses[:3]],
+    })
+    for r in self.responses[:2]:
+      self.assert_response_is('complete', NOW + LEASE_LENGTH,
+                              sent=['http://target1/post/url'], response=r)
+    self.assert_response_is('complete', unsent=['http://target1/post/url'],
+                            response=self.responses[2])
+
   def test_webmention_blocklist(self):
     """Target URLs with domains in the blocklist should be ignored."""
     self.responses[0].unsent = ['http://t.co/bad', 'http://foo/good', 'bad url']
@@ -1738,6 +2072,7 @@ class PropagateTest(TaskTest):
 
   def test_set_webmention_endpoint(self):
     """Should set Source.webmention_endpoint if it's unset."""
+    self.send_serially()
     self.responses[0].unsent = ['http://bar/1', 'http://foo/2']
     self.responses[0].put()
 
@@ -1849,6 +2184,7 @@ class PropagateTest(TaskTest):
 
   def test_webmention_fail_and_succeed(self):
     """All webmentions should be attempted, but any failure sets error status."""
+    self.send_serially()
     self.responses[0].unsent = ['http://first', 'http://second']
     self.responses[0].put()
     self.expect_webmention(target='http://first', send_status=500)
@@ -1862,6 +2198,7 @@ class PropagateTest(TaskTest):
 
   def test_webmention_exception(self):
     """Exceptions on individual target URLs shouldn't stop the whole task."""
+    self.send_serially()
     self.responses[0].unsent = ['http://error', 'http://good']
     self.responses[0].put()
     self.expect_webmention(target='http://error').AndRaise(Exception('foo'))
@@ -1925,6 +2262,7 @@ class PropagateTest(TaskTest):
   def test_response_with_multiple_activities(self):
     """Should use Response.urls_to_activity to generate the source URLs.
     """
+    self.send_serially()
     self.responses[0].activities_json = [
       '{"id": "000"}', '{"id": "111"}', '{"id": "222"}']
     self.responses[0].unsent = ['http://AAA', 'http://BBB', 'http://CCC']
@@ -1,20 +1,24 @@
 """Unit tests for util.py."""
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import time
 import urllib.request, urllib.parse, urllib.error
 
 from flask import Flask, get_flashed_messages, request
 from flask.views import View
+from google.api_core.exceptions import InvalidArgument, ServiceUnavailable
 from google.cloud import ndb
+from google.cloud.tasks_v2.types import Task
 from oauth_dropins import views as oauth_views
 from oauth_dropins.webutil import appengine_info
+from oauth_dropins.webutil.testutil import NOW
 from oauth_dropins.webutil.util import json_dumps, json_loads
 import requests
 from werkzeug.exceptions import BadRequest
 from werkzeug.routing import RequestRedirect
 
 from flask_app import app
-from models import Source
+from models import Response, Source
 from . import testutil
 from .testutil import FakeAuthEntity, FakeGrSource, FakeSource
 import util
@@ -245,6 +249,82 @@ class UtilTest(testutil.AppTest):
     self.assert_equals(('http://orig', 'orig', True),
                        util.get_webmention_target('http://orig'))
 
+  def test_get_webmention_targets(self):
+    self.assert_equals({
+      'http://a/x?utm_source=y': ('http://a/x', 'a', True),
+      'http://facebook.com/z': ('http://facebook.com/z', 'facebook.com', False),
+      'chrome://flags': ('chrome://flags', 'flags', False),
+    }, util.get_webmention_targets([
+      'http://a/x?utm_source=y',
+      'http://facebook.com/z',
+      'chrome://flags',
+      'http://a/x?utm_source=y',
+    ]))
+
+  def test_get_webmention_targets_datastore_cache(self):
+    util.ResolvedUrl(id='http://a/x', url='http://a/final', content_type='text/html',
+                     status=200, expires=NOW + timedelta(hours=1)).put()
+
+    self.assert_equals({
+      'http://a/x': ('http://a/final', 'a', True),
+      'http://b/y': ('http://b/y', 'b', True),
+    }, util.get_webmention_targets(['http://a/x', 'http://b/y']))
+    self.assertEqual(1, util.redirect_cache_stats['datastore_hit'])
+    self.assertEqual('http://b/y', util.ResolvedUrl.get_by_id('http://b/y').url)
+
+  def test_resolve_url_cache(self):
+    self.expect_requests_head('http://orig', redirected_url='http://final')
+    self.mox.ReplayAll()
+
+    expected = util.Resolved('http://final', 'text/html', 200)
+    self.assertEqual(expected, util.resolve_url('http://orig'))
+    self.assertEqual(expected, util.resolve_url('http://orig'))
+    self.assertEqual({'hit': 1, 'miss': 1}, util.redirect_cache_stats)
+
+    stored = util.ResolvedUrl.get_by_id('http://orig')
+    self.assertEqual('http://final', stored.url)
+    self.assertEqual(NOW + util.REDIRECT_CACHE_TTL, stored.expires)
+
+    # in-process cache is cold, datastore isn't
+    util.redirect_cache.clear()
+    self.assertEqual(expected, util.resolve_url('http://orig'))
+    self.assertEqual(1, util.redirect_cache_stats['datastore_hit'])
+
+  def test_resolve_url_cache_negative_ttl(self):
+    self.expect_requests_head('http://orig', status_code=500)
+    self.mox.ReplayAll()
+
+    self.assertEqual(500, util.resolve_url('http://orig').status)
+    self.assertEqual(NOW + util.REDIRECT_CACHE_NEGATIVE_TTL,
+                     util.ResolvedUrl.get_by_id('http://orig').expires)
+
+  def test_resolve_url_cache_expired_in_datastore(self):
+    util.ResolvedUrl(id='http://orig', url='http://old', content_type='text/html',
+                     status=200, expires=NOW).put()
+    self.expect_requests_head('http://orig', redirected_url='http://new')
+    self.mox.ReplayAll()
+
+    self.assertEqual('http://new', util.resolve_url('http://orig').url)
+    self.assertEqual('http://new', util.ResolvedUrl.get_by_id('http://orig').url)
+
+  def test_count_http_calls_in_context(self):
+    self.expect_requests_get('http://foo/bar', 'x')
+    self.expect_requests_get('http://foo/baz', 'y')
+    self.mox.ReplayAll()
+
+    def fetch(url):
+      # threads shouldn't share our ndb context
+      self.assertIsNone(ndb.get_context(raise_context_error=False))
+      return util.requests_get(url).text
+
+    with util.count_http_calls() as calls:
+      util.requests_get('http://foo/bar')
+      with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(util.in_context(fetch), 'http://foo/baz')
+        self.assertEqual('y', future.result())
+
+    self.assertEqual(2, calls.count)
+
   def test_requests_get_too_big(self):
     self.expect_requests_get(
       'http://foo/bar', '',
@@ -264,6 +344,76 @@ class UtilTest(testutil.AppTest):
     self.assertEqual(200, resp.status_code)
     self.assertEqual('xyz', resp.text)
 
+  def test_read_body(self):
+    self.expect_requests_get('http://foo/bar', 'abcdefghij')
+    self.expect_requests_get('http://foo/baz', 'abc')
+    self.mox.ReplayAll()
+
+    resp = util.requests_get('http://foo/bar')
+    self.assertEqual(b'abcd', util.read_body(resp, 4))
+    resp = util.requests_get('http://foo/baz')
+    self.assertEqual(b'abc', util.read_body(resp, 4))
+
+  def test_html_input(self):
+    resp = requests.Response()
+    resp.headers['content-type'] = 'text/html'
+    self.assertEqual(b'\xc3\xa9', util.html_input(resp, b'\xc3\xa9'))
+
+    resp.headers['content-type'] = 'text/html; charset=utf-8'
+    resp.encoding = 'utf-8'
+    self.assertEqual('é', util.html_input(resp, b'\xc3\xa9'))
+
+  def test_fetch_mf2_max_bytes(self):
+    self.expect_requests_get('http://foo/bar', """
+<div class="h-entry"><a class="u-syndication" href="https://fa.ke/1"></a></div>
+<div class="h-entry"><a class="u-syndication" href="https://fa.ke/2"></a></div>""")
+    self.mox.ReplayAll()
+
+    mf2 = util.fetch_mf2('http://foo/bar', max_bytes=80)
+    self.assertEqual(1, len(mf2['items']))
+    self.assertEqual(['https://fa.ke/1'],
+                     mf2['items'][0]['properties']['syndication'])
+
+  def test_fetch_mf2_fast(self):
+    self.expect_requests_get('http://foo/bar', """
+<html>
+<head>
+<link rel="syndication" href="https://fa.ke/1">
+<link rel="feed me" href="/feed">
+<link rel="stylesheet" href="/style.css">
+</head>
+<body class="h-entry">
+<a class="u-url" href="/bar"></a>
+<a class="u-syndication" href="https://fa.ke/2"></a>
+<div class="e-content">hello <b>world</b></div>
+<div class="p-author h-card"><a class="u-url" href="/">me</a></div>
+<div class="h-cite"><a class="u-syndication" href="https://fa.ke/3"></a></div>
+</body>
+</html>""")
+    self.mox.ReplayAll()
+
+    self.assert_equals({
+      'url': 'http://foo/bar',
+      'items': [{
+        'type': ['h-entry'],
+        'properties': {
+          'url': ['http://foo/bar'],
+          'syndication': ['https://fa.ke/2'],
+          'content': [{'html': 'hello <b>world</b>', 'value': 'hello world'}],
+          'author': [{
+            'type': ['h-card'],
+            'properties': {'url': ['http://foo/']},
+            'value': 'me',
+          }],
+        },
+      }],
+      'rels': {
+        'syndication': ['https://fa.ke/1'],
+        'feed': ['http://foo/feed'],
+        'me': ['http://foo/feed'],
+      },
+    }, util.fetch_mf2('http://foo/bar', fast=True))
+
   def test_requests_get_url_blocklist(self):
     resp = util.requests_get(next(iter(util.URL_BLOCKLIST)))
     self.assertEqual(util.HTTP_REQUEST_REFUSED_STATUS_CODE, resp.status_code)
@@ -334,6 +484,85 @@ class UtilTest(testutil.AppTest):
     eta = int(util.to_utc_timestamp(util.now())) + 123
     util.add_task('foo', eta_seconds=eta, x='y', z=None)
 
+  def test_token_bucket(self):
+    bucket = util.TokenBucket(rate=20, burst=2)
+    self.assertTrue(bucket.acquire('a'))
+    self.assertTrue(bucket.acquire('a'))
+    self.assertFalse(bucket.acquire('a'))
+    self.assertTrue(bucket.acquire('b'))
+    # refills after 50ms
+    self.assertTrue(bucket.acquire('a', timeout=.1))
+
+    bucket = util.TokenBucket(rate=.01, burst=1)
+    self.assertTrue(bucket.acquire('a'))
+    self.assertFalse(bucket.acquire('a', timeout=.1))
+
+  def test_task_batch(self):
+    calls = []
+    def create_task(req):
+      body = req.task.app_engine_http_request.body.decode()
+      calls.append(body)
+      if body == 'x=flaky' and calls.count(body) == 1:
+        raise ServiceUnavailable('try again')
+      elif body == 'x=bad':
+        raise InvalidArgument('nope')
+      return Task(name=body)
+
+    self.mox.stubs.Set(util.tasks_client, 'create_task', create_task)
+
+    with util.task_batch() as batch:
+      self.assertIsNone(util.add_task('foo', x='ok'))
+      util.add_task('foo', x='flaky')
+      util.add_task('bar', x='bad')
+      self.assertEqual([], calls)
+
+    self.assertEqual(4, len(calls))
+    self.assertEqual(3, len(batch.requests))
+    self.assertEqual(['x=ok', 'x=flaky'], [t.name for t in batch.results[:2]])
+    self.assertIsInstance(batch.results[2], InvalidArgument)
+
+    [(req, err)] = batch.failed()
+    self.assertTrue(req.parent.endswith('/bar'), req.parent)
+    self.assertIsInstance(err, InvalidArgument)
+    with self.assertRaises(InvalidArgument):
+      batch.raise_for_failures()
+
+    # no batch active, should create immediately
+    self.assertEqual('x=now', util.add_task('foo', x='now').name)
+
+  def test_add_propagate_tasks(self):
+    self.mox.stubs.Set(util, 'MAX_PROPAGATE_BATCH', 2)
+    bodies = []
+    self.mox.stubs.Set(util.tasks_client, 'create_task',
+                       lambda req: bodies.append(urllib.parse.parse_qs(
+                         req.task.app_engine_http_request.body.decode())))
+
+    other = self.sources[1].key
+    responses = [Response(id=str(i), source=self.sources[0].key) for i in range(3)]
+    responses.insert(1, Response(id='other', source=other))
+    util.add_propagate_tasks(responses)
+
+    keys = [r.key.urlsafe().decode() for r in responses]
+    self.assertEqual([
+      {'response_key': [keys[0], keys[2]]},
+      {'response_key': [keys[3]]},
+      {'response_key': [keys[1]]},
+    ], bodies)
+
+  def test_add_poll_task_time_wheel_keeps_pending_updates(self):
+    self.mox.stubs.Set(util, 'POLL_TIME_WHEEL', True)
+    source = self.sources[0]
+    source.put()
+    source.updates = {'poll_status': 'error'}
+
+    eta = util.add_poll_task(source)
+    self.assertEqual({'poll_status': 'error'}, source.updates)
+    self.assertEqual(eta, source.next_poll)
+
+    stored = source.key.get()
+    self.assertEqual(eta, stored.next_poll)
+    self.assertNotEqual('error', stored.poll_status)
+
   def test_host_url(self):
     with app.test_request_context():
       self.assertEqual('http://localhost/', util.host_url())
@@ -357,6 +586,26 @@ class UtilTest(testutil.AppTest):
     with app.test_request_context(query_string=f'key={key}'):
       self.assert_entities_equal(self.sources[0], util.load_source())
 
+  def test_update_response_rate(self):
+    hour = timedelta(hours=1)
+    self.assertEqual(2, util.update_response_rate(None, 4, hour * 2))
+    self.assertEqual(3, util.update_response_rate(3, 4, timedelta()))
+
+    # one half life moves halfway to the new sample
+    half_life = timedelta(days=1)
+    self.assertAlmostEqual(2, util.update_response_rate(
+      4, 0, half_life, half_life=half_life))
+    self.assertAlmostEqual(3, util.update_response_rate(
+      4, 0, half_life / 2, half_life=half_life), delta=.2)
+
+  def test_adaptive_poll_period(self):
+    min, max = timedelta(minutes=5), timedelta(days=1)
+    self.assertEqual(max, util.adaptive_poll_period(0, min, max))
+    self.assertEqual(max, util.adaptive_poll_period(.001, min, max, target=1))
+    self.assertEqual(timedelta(minutes=30),
+                     util.adaptive_poll_period(2, min, max, target=1))
+    self.assertEqual(min, util.adaptive_poll_period(100, min, max, target=1))
+
 
 class RegistrationCallbackTest(testutil.AppTest):
 
@@ -21,9 +21,18 @@ from oauth_dropins.webutil.util import json_dumps, json_loads
 import requests
 from requests import post as orig_requests_post
 
-import flask_app, flask_background, util
+import flask_app, flask_background, models, original_post_discovery, util
 from models import BlogPost, Publish, PublishedPage, Response, Source
 
+# concurrency and batching limits that TestCase.run_serially() sets to 1, with
+# their real values
+SERIAL_LIMITS = {(module, name): getattr(module, name) for module, name in (
+  (util, 'MAX_CONCURRENT_RESOLVES'),
+  (util, 'MAX_CONCURRENT_TASK_ADDS'),
+  (util, 'MAX_PROPAGATE_BATCH'),
+  (original_post_discovery, 'MAX_CONCURRENT_PERMALINK_FETCHES'),
+)}
+
 logger = logging.getLogger(__name__)
 
 
@@ -302,6 +311,11 @@ class TestCase(testutil.TestCase):
     util.BLOCKLIST.add('fa.ke')
 
     util.webmention_endpoint_cache.clear()
+    util.redirect_cache.clear()
+    models.domain_sources_cache.clear()
+    util.redirect_cache_stats.clear()
+    util.domain_health_cache.clear()
+    util.domain_rate_limiter.clear()
     self.stubbed_create_task = False
     tasks_client.create_task = lambda *args, **kwargs: Task(name='foo')
 
@@ -485,6 +499,21 @@ class TestCase(testutil.TestCase):
     resp = orig_requests_post(f'http://0.0.0.0:8089/reset')
     resp.raise_for_status()
 
+  def run_serially(self):
+    """Turns off the concurrent and batched code paths for this test.
+
+    For tests whose mox expectations would otherwise be called from worker
+    threads, which mox doesn't support, or that expect one propagate task per
+    response. Tests of those paths themselves shouldn't use this.
+    """
+    for module, name in SERIAL_LIMITS:
+      self.mox.stubs.Set(module, name, 1)
+
+  def run_concurrently(self):
+    """Undoes :meth:`run_serially`, for tests of the concurrent paths."""
+    for (module, name), val in SERIAL_LIMITS.items():
+      self.mox.stubs.Set(module, name, val)
+
   def stub_create_task(self):
     if not self.stubbed_create_task:
       self.mox.StubOutWithMock(tasks_client, 'create_task')
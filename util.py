@@ -1,18 +1,31 @@
 """Misc utility constants and classes."""
 import binascii
 import collections
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import contextvars
 import copy
 from datetime import datetime, timedelta, timezone
+import hashlib
 import logging
 import os
 import random
 import re
 import threading
+import time
 import urllib.request, urllib.parse, urllib.error
 
-from cachetools import TTLCache
+from cachetools import TLRUCache, TTLCache
 import flask
 from flask import request
+from google.api_core.exceptions import (
+  Aborted,
+  AlreadyExists,
+  DeadlineExceeded,
+  InternalServerError,
+  ServiceUnavailable,
+  TooManyRequests,
+)
 from google.cloud import ndb
 from google.cloud.tasks_v2 import CreateTaskRequest
 from google.protobuf.timestamp_pb2 import Timestamp
@@ -26,6 +39,7 @@ from oauth_dropins.webutil.appengine_config import (
 from oauth_dropins.webutil import appengine_info
 from oauth_dropins.webutil.appengine_info import APP_ID, DEBUG
 from oauth_dropins.webutil.flask_util import error, flash
+from oauth_dropins.webutil.models import StringIdModel
 from oauth_dropins.webutil import util
 from oauth_dropins.webutil.util import *
 import requests
@@ -67,6 +81,10 @@ URL_BLOCKLIST = frozenset((
 
 OPT_OUT_TAGS = frozenset(('#nobot', '#nobridge'))
 
+# fields that as1.activity_changed() compares, except inReplyTo
+ACTIVITY_CHANGED_FIELDS = ('objectType', 'verb', 'to', 'displayName', 'content',
+                           'summary', 'location', 'image')
+
 # URL paths of users who opt into testing new "beta" features and changes
 # before we roll them out to everyone.
 with open(os.path.join(_dir, 'beta_users.txt'), 'rt', encoding='utf-8') as f:
@@ -102,16 +120,329 @@ DOMAINS = (PRIMARY_DOMAIN,) + OTHER_DOMAINS + LOCAL_DOMAINS
 # https://cloud.google.com/appengine/docs/locations
 TASKS_LOCATION = 'us-central1'
 
+# task_batch() flushes create tasks with up to this many threads, and retries
+# each one up to TASK_RETRIES times on these transient errors.
+MAX_CONCURRENT_TASK_ADDS = 10
+TASK_RETRIES = 2
+TRANSIENT_TASK_ERRORS = (Aborted, DeadlineExceeded, InternalServerError,
+                         ServiceUnavailable, TooManyRequests)
+
+# max number of Responses to propagate in a single coalesced propagate task.
+# see add_propagate_tasks().
+MAX_PROPAGATE_BATCH = 10
+
 FEATURES = ('listen', 'publish', 'webmention', 'email')
 
+# adaptive poll scheduling. Poll keeps an exponentially weighted moving average
+# of each source's new responses per hour in Source.response_rate, with this
+# half life, and Source.poll_period() aims for this many new responses per
+# poll, within the source class's ADAPTIVE_POLL_MIN and ADAPTIVE_POLL_MAX.
+# scripts/simulate_polls.py replays historical responses to tune these. Off
+# until we've done that; Poll still keeps response_rate up to date meanwhile.
+ADAPTIVE_POLL = False
+RESPONSE_RATE_HALF_LIFE = timedelta(days=3)
+ADAPTIVE_POLL_TARGET_RESPONSES = .5
+
+# alternative poll dispatcher. when enabled, Poll stores each source's next poll
+# time in Source.next_poll instead of adding a delayed poll task for it, and
+# the /cron/poll_wheel cron job adds named tasks for all sources due before the
+# end of the next tick. task names dedupe repeated adds.
+POLL_TIME_WHEEL = False
+POLL_WHEEL_TICK = timedelta(minutes=5)
+# sources this far past their next_poll probably lost their task. Cloud Tasks
+# won't reuse a task name for a while after the task is gone, so
+# /cron/poll_wheel re-adds them under a new name once per this interval.
+POLL_WHEEL_REPAIR_AFTER = timedelta(hours=1)
+
+# max number of URLs to resolve in parallel in get_webmention_targets()
+MAX_CONCURRENT_RESOLVES = 10
+
+# fetch_mf2() and Webmention.fetch_mf2() stop reading response bodies after
+# this many bytes. webutil rejects anything over MAX_HTTP_RESPONSE_SIZE (2MB)
+# entirely; this is lower because we only need the beginning of the page.
+MAX_MF2_FETCH_BYTES = 1000000
+# rels and h-entry properties that parse_mf2_fast() extracts
+FAST_MF2_RELS = ('syndication', 'feed', 'me', 'canonical', 'shortlink')
+FAST_MF2_PROPERTIES = ('url', 'syndication', 'content', 'author')
+
 webmention_endpoint_cache_lock = threading.RLock()
 webmention_endpoint_cache = TTLCache(5000, 60 * 60 * 2)  # 2h expiration
+# whether webmention endpoints are also shared across instances via
+# WebmentionEndpoint entities in the datastore
+WEBMENTION_ENDPOINT_CACHE_DATASTORE = True
+WEBMENTION_ENDPOINT_CACHE_TTL = timedelta(hours=2)
+
+# per target domain circuit breaker for outbound webmentions. this many
+# consecutive transient errors (timeouts, connection errors, 5xx, 429) opens a
+# domain's circuit, which defers its targets without any network I/O until the
+# cooldown passes. then it's half-open: one probe goes through, and its result
+# closes or re-opens the circuit.
+DOMAIN_CIRCUIT_FAILURE_THRESHOLD = 5
+DOMAIN_CIRCUIT_COOLDOWN = timedelta(minutes=30)
+# whether circuit breaker state is shared across instances via DomainHealth
+# entities. otherwise it's only kept in memory.
+DOMAIN_HEALTH_DATASTORE = True
+
+# per target domain token bucket rate limit for outbound webmention requests,
+# in process: requests per second, burst size, and how long to wait for a token
+DOMAIN_RATE_LIMIT = 2
+DOMAIN_RATE_LIMIT_BURST = 10
+DOMAIN_RATE_LIMIT_MAX_WAIT = timedelta(seconds=10)
+
+# redirect resolution cache for resolve_url(). failed resolutions expire sooner.
+REDIRECT_CACHE_TTL = timedelta(days=1)
+REDIRECT_CACHE_NEGATIVE_TTL = timedelta(hours=1)
+# whether resolve_url() also stores resolutions in the datastore, as
+# ResolvedUrl entities, so that they survive instance restarts
+REDIRECT_CACHE_DATASTORE = True
+# don't store longer URLs in the datastore, since they're the key id
+REDIRECT_CACHE_MAX_DATASTORE_URL_LENGTH = 500
+
+# count_http_calls() counter for the current context
+_http_calls = contextvars.ContextVar('http_calls', default=None)
+
+# Result of following a URL's redirects.
+Resolved = collections.namedtuple('Resolved', ('url', 'content_type', 'status'))
+
+
+def redirect_cache_ttl(resolved):
+  """Returns how long to cache a :class:`Resolved`, as a :class:`datetime.timedelta`."""
+  return (REDIRECT_CACHE_TTL if resolved.status // 100 in (2, 3)
+          else REDIRECT_CACHE_NEGATIVE_TTL)
+
+
+redirect_cache_lock = threading.RLock()
+redirect_cache = TLRUCache(
+  10000, lambda key, resolved, now: now + redirect_cache_ttl(resolved).total_seconds())
+# counts of 'hit', 'datastore_hit', and 'miss'
+redirect_cache_stats = collections.Counter()
+
+
+class WebmentionEndpoint(StringIdModel):
+  """Datastore tier of the webmention endpoint cache.
+
+  Key id is the :func:`webmention_endpoint_cache_key`. ``endpoint`` is the
+  discovered endpoint URL, or ``NONE`` if there wasn't one.
+  """
+  endpoint = ndb.StringProperty(indexed=False)
+  expires = ndb.DateTimeProperty(tzinfo=timezone.utc)
+  updated = ndb.DateTimeProperty(auto_now=True, tzinfo=timezone.utc)
+
+
+class DomainDeferred(Exception):
+  """A webmention target was deferred without sending.
+
+  Its domain's circuit breaker is open, or it's rate limited.
+  """
+
+
+class DomainHealth(StringIdModel):
+  """Circuit breaker state for a webmention target domain.
+
+  Key id is the domain. Only stored while the domain has recent errors, deleted
+  when it recovers.
+  """
+  # consecutive transient errors
+  failures = ndb.IntegerProperty(default=0)
+  # when the circuit was opened, or last re-opened. None if it's closed.
+  opened = ndb.DateTimeProperty(tzinfo=timezone.utc)
+  last_error = ndb.TextProperty()
+  updated = ndb.DateTimeProperty(auto_now=True, tzinfo=timezone.utc)
+
+  def state(self):
+    """Returns 'closed', 'open', or 'half-open'."""
+    if not self.opened:
+      return 'closed'
+    elif util.now() < self.opened + DOMAIN_CIRCUIT_COOLDOWN:
+      return 'open'
+    return 'half-open'
+
+  def healthy(self):
+    return not self.failures and not self.opened
+
+  def record(self, error=None):
+    """Records the result of sending to this domain.
+
+    Args:
+      error (BaseException): transient error, or None on success
+
+    Returns:
+      bool: True if the state changed, False otherwise
+    """
+    before = (self.failures, self.opened)
+
+    if error is None:
+      self.failures = 0
+      self.opened = self.last_error = None
+    else:
+      self.failures += 1
+      self.last_error = str(error)
+      if self.opened or self.failures >= DOMAIN_CIRCUIT_FAILURE_THRESHOLD:
+        logger.info(f'Opening circuit breaker for {self.key.id()} after {self.failures} errors')
+        self.opened = util.now()
+
+    return (self.failures, self.opened) != before
+
+
+domain_health_lock = threading.RLock()
+domain_health_cache = TTLCache(
+  5000, DOMAIN_CIRCUIT_COOLDOWN.total_seconds() * 4)
+
+
+class TokenBucket:
+  """Thread safe, in-process token bucket rate limiter with a bucket per key."""
+
+  def __init__(self, rate, burst):
+    """Constructor.
+
+    Args:
+      rate (float): tokens added per second
+      burst (int): bucket size
+    """
+    self.rate = rate
+    self.burst = burst
+    self.lock = threading.Lock()
+    # maps key to (tokens, time.monotonic() when last refilled). idle buckets
+    # are full after burst / rate seconds, so they can expire then.
+    self.buckets = TTLCache(10000, burst / rate)
+
+  def acquire(self, key, timeout=0):
+    """Takes a token for the given key, waiting for one if necessary.
+
+    Args:
+      key (str)
+      timeout (float): max seconds to wait
+
+    Returns:
+      bool: True if we got a token, False if we timed out
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+          self.buckets[key] = (tokens - 1, now)
+          return True
+        self.buckets[key] = (tokens, now)
+        wait = (1 - tokens) / self.rate
+
+      if now + wait > deadline:
+        return False
+      time.sleep(wait)
+
+  def clear(self):
+    with self.lock:
+      self.buckets.clear()
+
+
+domain_rate_limiter = TokenBucket(DOMAIN_RATE_LIMIT, DOMAIN_RATE_LIMIT_BURST)
+
+
+class ResolvedUrl(StringIdModel):
+  """Datastore tier of the :func:`resolve_url` redirect cache.
+
+  Key id is the cleaned input URL.
+  """
+  url = ndb.StringProperty(indexed=False)
+  content_type = ndb.StringProperty(indexed=False)
+  status = ndb.IntegerProperty(indexed=False)
+  expires = ndb.DateTimeProperty(tzinfo=timezone.utc)
+  updated = ndb.DateTimeProperty(auto_now=True, tzinfo=timezone.utc)
+
+
+class HttpCalls:
+  """Number of HTTP requests made inside a :func:`count_http_calls` block."""
+  def __init__(self):
+    self.count = 0
+    self._lock = threading.Lock()
+
+  def add(self):
+    with self._lock:
+      self.count += 1
+
+
+def count_http_call():
+  """Counts one HTTP call in the current :func:`count_http_calls` block, if any.
+
+  Called by our own HTTP wrappers, eg :func:`requests_get` and
+  :func:`resolve_url`, and by callers of silo APIs, which count each API call
+  as one, even if granary makes more than one request for it.
+  """
+  calls = _http_calls.get()
+  if calls:
+    calls.add()
+
+
+@contextlib.contextmanager
+def count_http_calls():
+  """Counts the HTTP calls made inside this block.
+
+  Only includes calls counted with :func:`count_http_call`, including in
+  threads started with :func:`in_context`.
+
+  Yields:
+    HttpCalls
+  """
+  calls = HttpCalls()
+  token = _http_calls.set(calls)
+  try:
+    yield calls
+  finally:
+    _http_calls.reset(token)
+
+
+def in_context(fn):
+  """Wraps a function to run in a thread with the caller's HTTP call counter.
+
+  For thread pools, which don't propagate contextvars, so that
+  :func:`count_http_calls` includes their requests. Only the counter carries
+  over, not the whole context, since that would share the caller's ndb
+  context, which isn't thread safe, with the thread.
+
+  Args:
+    fn (callable)
+
+  Returns:
+    callable
+  """
+  calls = _http_calls.get()
+
+  def run(*args, **kwargs):
+    token = _http_calls.set(calls)
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      _http_calls.reset(token)
+
+  return run
+
+
+def poll_eta(source):
+  """Returns when a source should be polled next.
+
+  Adds its poll period to now, randomized to within +/- 20% to try to spread
+  out tasks and prevent thundering herds.
+
+  Args:
+    source (models.Source)
+
+  Returns:
+    datetime
+  """
+  return util.now() + source.poll_period() * random.uniform(.8, 1.2)
 
 
 def add_poll_task(source, now=False):
   """Adds a poll task for the given source entity.
 
-  Pass ``now=True`` to insert a ``poll-now`` task.
+  Pass ``now=True`` to insert a ``poll-now`` task. Otherwise, if
+  ``POLL_TIME_WHEEL`` is enabled, just stores the source's next poll time in
+  :attr:`models.Source.next_poll` for ``/cron/poll_wheel`` to dispatch.
+
+  Returns:
+    datetime: when the task is scheduled to run
   """
   if now:
     queue = 'poll-now'
@@ -120,44 +451,163 @@ def add_poll_task(source, now=False):
     queue = 'poll'
     eta_seconds = int(util.to_utc_timestamp(util.now()))
     if source.AUTO_POLL:
-      # add poll period. randomize task ETA to within +/- 20% to try to spread
-      # out tasks and prevent thundering herds.
-      eta_seconds += int(source.poll_period().total_seconds() * random.uniform(.8, 1.2))
+      eta = poll_eta(source)
+      if POLL_TIME_WHEEL:
+        # write only next_poll, and leave the caller's pending updates alone
+        pending = source.updates
+        source.updates = {'next_poll': eta}
+        try:
+          type(source).put_updates(source)
+        finally:
+          source.updates = pending
+        source.next_poll = eta
+        return eta
+      eta_seconds = int(util.to_utc_timestamp(eta))
 
   add_task(queue, eta_seconds=eta_seconds, source_key=source.key.urlsafe().decode(),
            last_polled=source.last_polled.strftime(POLL_TASK_DATETIME_FORMAT))
 
+  return (datetime.fromtimestamp(eta_seconds, timezone.utc)
+          if eta_seconds is not None else util.now())
+
+
+def add_wheel_poll_task(key, next_poll, repair=None):
+  """Adds a ``poll`` task for ``/cron/poll_wheel``.
+
+  The task's name is derived from the source and its next poll time, so that
+  adding it again fails with :class:`AlreadyExists` until the source's
+  :attr:`models.Source.next_poll` changes. The next poll time is also a task
+  param, so that :class:`tasks.Poll` can drop the task if the source has been
+  polled since, eg by a ``poll-now`` task.
+
+  Args:
+    key (ndb.Key): source
+    next_poll (datetime)
+    repair (int): optional, appended to the task name so that a task that
+      was lost can be re-added while Cloud Tasks still blocks its old name
+  """
+  key_str = key.urlsafe().decode()
+  eta_seconds = int(util.to_utc_timestamp(next_poll))
+  task_name = f'poll-{key_str}-{eta_seconds}'
+  if repair is not None:
+    task_name += f'-repair-{repair}'
+  add_task('poll', eta_seconds=eta_seconds, task_name=task_name,
+           source_key=key_str, next_poll=str(eta_seconds))
+
+
+def update_response_rate(rate, responses, elapsed,
+                         half_life=RESPONSE_RATE_HALF_LIFE):
+  """Updates an exponentially weighted moving average of responses per hour.
+
+  Each poll is weighted by how long it covered, so that the estimate decays by
+  half every ``half_life`` regardless of how often we poll.
+
+  Args:
+    rate (float): current estimate, responses per hour, or None if we don't
+      have one yet
+    responses (int): number of new responses found in this poll
+    elapsed (datetime.timedelta): time since the previous poll
+    half_life (datetime.timedelta)
+
+  Returns:
+    float: responses per hour, or ``rate`` if ``elapsed`` isn't positive
+  """
+  hours = elapsed.total_seconds() / 3600
+  if hours <= 0:
+    return rate
+
+  sample = responses / hours
+  if rate is None:
+    return sample
+
+  weight = 1 - .5 ** (elapsed / half_life)
+  return rate + weight * (sample - rate)
+
+
+def adaptive_poll_period(rate, min_period, max_period,
+                         target=ADAPTIVE_POLL_TARGET_RESPONSES):
+  """Returns how often to poll a source based on its response rate.
+
+  Args:
+    rate (float): responses per hour, from :func:`update_response_rate`
+    min_period (datetime.timedelta)
+    max_period (datetime.timedelta)
+    target (float): expected number of new responses per poll to aim for
+
+  Returns:
+    datetime.timedelta: between ``min_period`` and ``max_period``
+  """
+  if not rate or rate <= 0:
+    return max_period
+
+  return max(min_period, min(max_period, timedelta(hours=target / rate)))
+
 
 def add_propagate_task(entity):
   """Adds a propagate task for the given response entity."""
   add_task('propagate', response_key=entity.key.urlsafe().decode())
 
 
+def add_propagate_tasks(entities):
+  """Adds coalesced propagate tasks for the given response entities.
+
+  Groups entities by source, then adds one propagate task for each group of up
+  to ``MAX_PROPAGATE_BATCH`` entities, with all of their keys in repeated
+  ``response_key`` params.
+
+  Args:
+    entities (sequence of models.Response)
+  """
+  by_source = {}
+  for entity in entities:
+    by_source.setdefault(entity.source, []).append(entity)
+
+  for group in by_source.values():
+    for i in range(0, len(group), MAX_PROPAGATE_BATCH):
+      keys = [e.key.urlsafe().decode() for e in group[i:i + MAX_PROPAGATE_BATCH]]
+      add_task('propagate', response_key=keys[0] if len(keys) == 1 else keys)
+
+
 def add_propagate_blogpost_task(entity):
   """Adds a propagate-blogpost task for the given response entity."""
   add_task('propagate-blogpost', key=entity.key.urlsafe().decode())
 
 
+def add_refetch_task(source):
+  """Adds a refetch task for the given source entity."""
+  add_task('refetch', source_key=source.key.urlsafe().decode())
+
+
 def add_discover_task(source, post_id, type=None):
   """Adds a discover task for the given source and silo post id."""
   add_task('discover', source_key=source.key.urlsafe().decode(),
            post_id=post_id, type=type)
 
 
-def add_task(queue, eta_seconds=None, **kwargs):
+def add_task(queue, eta_seconds=None, task_name=None, **kwargs):
   """Adds a Cloud Tasks task for the given entity.
 
+  If a :func:`task_batch` is active in this thread, the task is added to it
+  and created when the batch exits. Otherwise it's created immediately.
+
   Args:
     queue (str): queue name
     entity (Source or Webmentions)
     eta_seconds (int): optional
-    kwargs: added to task's POST body (form-encoded)
+    task_name (str): optional. Cloud Tasks rejects tasks with the same name as
+      a recent task with :class:`AlreadyExists`.
+    kwargs: added to task's POST body (form-encoded). list values become
+      repeated params.
+
+  Returns:
+    :class:`google.cloud.tasks_v2.Task`, or None if the task was batched or
+    we're running locally
   """
   params = {
     'app_engine_http_request': {
       'http_method': 'POST',
       'relative_uri': f'/_ah/queue/{queue}',
-      'body': urllib.parse.urlencode(util.trim_nulls(kwargs)).encode(),
+      'body': urllib.parse.urlencode(util.trim_nulls(kwargs), doseq=True).encode(),
       # https://googleapis.dev/python/cloudtasks/latest/gapic/v2/types.html#google.cloud.tasks_v2.types.AppEngineHttpRequest.headers
       'headers': {'Content-Type': 'application/x-www-form-urlencoded'},
     }
@@ -166,11 +616,124 @@ def add_task(queue, eta_seconds=None, **kwargs):
     params['schedule_time'] = Timestamp(seconds=eta_seconds)
 
   queue_path = tasks_client.queue_path(APP_ID, TASKS_LOCATION, queue)
+  if task_name:
+    params['name'] = f'{queue_path}/tasks/{task_name}'
   if appengine_info.LOCAL_SERVER:
     logger.info(f'Would add task: {queue_path} {params}')
-  else:
-    task = tasks_client.create_task(CreateTaskRequest(parent=queue_path, task=params))
-    logger.info(f'Added {queue} task {task.name} with ETA {eta_seconds}: {params}')
+    return None
+
+  req = CreateTaskRequest(parent=queue_path, task=params)
+  batch = getattr(_task_batches, 'current', None)
+  if batch is not None:
+    batch.requests.append(req)
+    return None
+
+  task = tasks_client.create_task(req)
+  logger.info(f'Added {queue} task {task.name} with ETA {eta_seconds}: {params}')
+  return task
+
+
+def _create_task(req):
+  """Creates a task, retrying on transient errors.
+
+  Args:
+    req (CreateTaskRequest)
+
+  Returns:
+    :class:`google.cloud.tasks_v2.Task`
+  """
+  for attempt in range(TASK_RETRIES + 1):
+    try:
+      return tasks_client.create_task(req)
+    except TRANSIENT_TASK_ERRORS as e:
+      if attempt == TASK_RETRIES:
+        raise
+      logger.info(f'Retrying {req.parent} task after transient error: {e}')
+
+
+class TaskBatch:
+  """Tasks collected by :func:`task_batch`, created together when it exits.
+
+  Attributes:
+    requests (list of CreateTaskRequest): tasks to create, in the order they
+      were added
+    results (list): populated by :meth:`flush`, one per request, in the same
+      order: the created :class:`google.cloud.tasks_v2.Task` on success, or the
+      exception on failure
+  """
+  def __init__(self):
+    self.requests = []
+    self.results = []
+
+  def flush(self):
+    """Creates all pending tasks concurrently. Doesn't raise.
+
+    Returns:
+      list, :attr:`results` for just the tasks created by this call
+    """
+    reqs = self.requests[len(self.results):]
+    if not reqs:
+      return []
+
+    def create(req):
+      try:
+        return _create_task(req)
+      except BaseException as e:
+        return e
+
+    if len(reqs) == 1 or MAX_CONCURRENT_TASK_ADDS <= 1:
+      results = [create(req) for req in reqs]
+    else:
+      workers = min(len(reqs), MAX_CONCURRENT_TASK_ADDS)
+      with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(create, reqs))
+
+    for req, result in zip(reqs, results):
+      if isinstance(result, BaseException):
+        logger.warning(f'Adding {req.parent} task failed: {result}')
+      else:
+        logger.info(f'Added {req.parent} task {result.name}')
+
+    self.results.extend(results)
+    return results
+
+  def failed(self):
+    """Returns the tasks that couldn't be created.
+
+    Returns:
+      list of (CreateTaskRequest, exception) tuples
+    """
+    return [(req, result) for req, result in zip(self.requests, self.results)
+            if isinstance(result, BaseException)]
+
+  def raise_for_failures(self):
+    """Raises the first exception from :meth:`failed`, if any."""
+    failed = self.failed()
+    if failed:
+      raise failed[0][1]
+
+
+_task_batches = threading.local()
+
+
+@contextlib.contextmanager
+def task_batch():
+  """Context manager that batches :func:`add_task` calls in this thread.
+
+  Tasks are created concurrently when the block exits, even if it raised, so
+  that tasks added before an error still get created, as they would without
+  batching. Batches can nest; each one flushes its own tasks.
+
+  Yields:
+    :class:`TaskBatch`
+  """
+  outer = getattr(_task_batches, 'current', None)
+  batch = _task_batches.current = TaskBatch()
+  try:
+    yield batch
+  finally:
+    _task_batches.current = outer
+    batch.flush()
 
 
 class Redirect(RequestRedirect):
@@ -230,6 +793,173 @@ def webmention_endpoint_cache_key(url):
   return ' '.join(parts)
 
 
+def prefetch_webmention_endpoints(urls):
+  """Loads cached webmention endpoints from the datastore into memory.
+
+  Uses a single ``get_multi`` for all keys that aren't already in the
+  in-process ``webmention_endpoint_cache``.
+
+  Args:
+    urls (iterable of str): target URLs
+
+  Returns:
+    set of str: cache keys that are now in ``webmention_endpoint_cache``
+  """
+  keys = {webmention_endpoint_cache_key(url) for url in urls}
+  with webmention_endpoint_cache_lock:
+    cached = {key for key in keys if key in webmention_endpoint_cache}
+
+  missing = sorted(keys - cached)
+  if (missing and WEBMENTION_ENDPOINT_CACHE_DATASTORE
+      and _can_use_datastore_cache()):
+    now = util.now()
+    entities = ndb.get_multi(ndb.Key(WebmentionEndpoint, key) for key in missing)
+    with webmention_endpoint_cache_lock:
+      for entity in entities:
+        if entity and entity.expires > now:
+          logger.debug(f'Loaded cached webmention endpoint {entity.key.id()}: {entity.endpoint}')
+          webmention_endpoint_cache[entity.key.id()] = entity.endpoint
+          cached.add(entity.key.id())
+
+  return cached
+
+
+def store_webmention_endpoints(keys):
+  """Shares cached webmention endpoints with other instances via the datastore.
+
+  Args:
+    keys (iterable of str): :func:`webmention_endpoint_cache_key` values. Keys
+      that aren't in ``webmention_endpoint_cache`` are ignored.
+  """
+  if not WEBMENTION_ENDPOINT_CACHE_DATASTORE or not _can_use_datastore_cache():
+    return
+
+  expires = util.now() + WEBMENTION_ENDPOINT_CACHE_TTL
+  entities = []
+  with webmention_endpoint_cache_lock:
+    for key in keys:
+      endpoint = webmention_endpoint_cache.get(key)
+      if endpoint:
+        entities.append(WebmentionEndpoint(id=key, endpoint=endpoint,
+                                           expires=expires))
+  if entities:
+    ndb.put_multi(entities)
+
+
+def invalidate_webmention_endpoints(urls):
+  """Clears cached webmention endpoints for the given URLs in all tiers.
+
+  Args:
+    urls (iterable of str): target URLs
+  """
+  keys = {webmention_endpoint_cache_key(url) for url in urls}
+  with webmention_endpoint_cache_lock:
+    for key in keys:
+      webmention_endpoint_cache.pop(key, None)
+
+  if keys and WEBMENTION_ENDPOINT_CACHE_DATASTORE and _can_use_datastore_cache():
+    ndb.delete_multi(ndb.Key(WebmentionEndpoint, key) for key in keys)
+
+
+def load_domain_health(domains):
+  """Loads circuit breaker state for webmention target domains.
+
+  Uses a single ``get_multi`` if the datastore tier is enabled and usable,
+  otherwise the in-process ``domain_health_cache``.
+
+  Args:
+    domains (iterable of str)
+
+  Returns:
+    dict: maps str domain to :class:`DomainHealth`. Domains without stored
+    state get a new, healthy entity.
+  """
+  domains = sorted(set(domains))
+  if not domains:
+    return {}
+
+  if DOMAIN_HEALTH_DATASTORE and _can_use_datastore_cache():
+    entities = ndb.get_multi(ndb.Key(DomainHealth, domain) for domain in domains)
+  else:
+    with domain_health_lock:
+      entities = [domain_health_cache.get(domain) for domain in domains]
+
+  return {domain: entity or DomainHealth(id=domain)
+          for domain, entity in zip(domains, entities)}
+
+
+def store_domain_health(healths):
+  """Stores changed circuit breaker state. Deletes it for healthy domains.
+
+  Args:
+    healths (iterable of :class:`DomainHealth`)
+  """
+  unhealthy = []
+  healthy = []
+  for health in healths:
+    (healthy if health.healthy() else unhealthy).append(health)
+
+  with domain_health_lock:
+    for health in healthy:
+      domain_health_cache.pop(health.key.id(), None)
+    for health in unhealthy:
+      domain_health_cache[health.key.id()] = health
+
+  if DOMAIN_HEALTH_DATASTORE and _can_use_datastore_cache():
+    if unhealthy:
+      ndb.put_multi(unhealthy)
+    if healthy:
+      ndb.delete_multi(health.key for health in healthy)
+
+
+def record_domain_health(results):
+  """Records webmention send results in domains' circuit breakers.
+
+  With the datastore tier, each domain's read-modify-write is its own
+  transaction, so concurrent senders don't lose each other's updates.
+
+  Args:
+    results (dict): maps str domain to its transient error, or None if it
+      responded
+  """
+  if DOMAIN_HEALTH_DATASTORE and _can_use_datastore_cache():
+    healths = [_record_domain_health(domain, error)
+               for domain, error in results.items()]
+  else:
+    healths = []
+    for domain, error in results.items():
+      with domain_health_lock:
+        health = domain_health_cache.get(domain) or DomainHealth(id=domain)
+      if health.record(error):
+        healths.append(health)
+
+  with domain_health_lock:
+    for health in healths:
+      if health.healthy():
+        domain_health_cache.pop(health.key.id(), None)
+      else:
+        domain_health_cache[health.key.id()] = health
+
+
+@ndb.transactional()
+def _record_domain_health(domain, error):
+  """Transactionally records one domain's result. Returns its :class:`DomainHealth`."""
+  key = ndb.Key(DomainHealth, domain)
+  health = key.get() or DomainHealth(id=domain)
+  if health.record(error):
+    if health.healthy():
+      key.delete()
+    else:
+      health.put()
+  return health
+
+
+def _can_use_datastore_cache():
+  """Returns True if we have an ndb context and aren't in a transaction."""
+  ctx = ndb.get_context(raise_context_error=False)
+  return ctx is not None and not ctx.in_transaction()
+
+
 def report_error(msg, **kwargs):
   """Reports an error to StackDriver Error Reporting.
 
@@ -264,18 +994,193 @@ def requests_get(url, **kwargs):
     resp._content = resp._text.encode()
     return resp
 
+  count_http_call()
   kwargs.setdefault('headers', {}).update(request_headers(url=url))
   return util.requests_get(url, **kwargs)
 
 
-def fetch_mf2(url, **kwargs):
-  """Injects :func:`requests_get` into :func:`oauth_dropins.webutil.util.fetch_mf2`."""
-  return util.fetch_mf2(url, get_fn=requests_get, **kwargs)
+def read_body(resp, max_bytes):
+  """Reads at most ``max_bytes`` of a streamed response's body, then closes it.
+
+  Reads into a local buffer with :meth:`requests.Response.iter_content` and
+  doesn't touch ``resp``'s own body, so use the returned bytes instead of
+  ``resp.content`` or ``resp.text`` afterward.
+
+  Args:
+    resp (requests.Response)
+    max_bytes (int)
+
+  Returns:
+    bytes:
+  """
+  body = bytearray()
+  for chunk in resp.iter_content(chunk_size=64 * 1024):
+    body += chunk
+    if len(body) > max_bytes:
+      logger.info(f'Truncating {resp.url} response body to {max_bytes} bytes')
+      del body[max_bytes:]
+      break
+
+  resp.close()
+  return bytes(body)
+
+
+def html_input(resp, body):
+  """Returns a body from :func:`read_body` as input for HTML parsing.
+
+  Follows :func:`oauth_dropins.webutil.util.parse_html`: only decodes it if
+  ``Content-Type`` has an explicit charset, otherwise leaves it as bytes so
+  that BeautifulSoup can detect the encoding, eg from ``<meta charset>``.
+
+  Args:
+    resp (requests.Response)
+    body (bytes)
+
+  Returns:
+    str or bytes:
+  """
+  if 'charset' in (resp.headers.get('content-type') or ''):
+    return body.decode(resp.encoding or 'utf-8', errors='replace')
+  return body
+
+
+def fetch_mf2(url, fast=False, max_bytes=None, **kwargs):
+  """Fetches a URL and parses its microformats2.
+
+  Like :func:`oauth_dropins.webutil.util.fetch_mf2`, but uses
+  :func:`requests_get` and reads at most ``max_bytes`` of the response body.
+
+  Only use ``fast`` where missing some mf2 is ok. It doesn't support implied
+  properties, backcompat, or children.
+
+  Args:
+    url (str): if it has a fragment, only that element is parsed
+    fast (bool): whether to parse with :func:`parse_mf2_fast` instead of
+      mf2py
+    max_bytes (int): defaults to ``MAX_MF2_FETCH_BYTES``
+    kwargs: passed through to :func:`requests_get`
+
+  Returns:
+    dict: parsed mf2 data, including the final URL after redirects in the top
+    level ``url`` field, or None if the URL has a fragment and it isn't found
+  """
+  resp = requests_get(util.fragmentless(url), **kwargs)
+  resp.raise_for_status()
+  html = html_input(resp, read_body(resp, max_bytes or MAX_MF2_FETCH_BYTES))
+
+  id = urllib.parse.urlparse(url).fragment
+  parse = parse_mf2_fast if fast else util.parse_mf2
+  mf2 = parse(html, url=resp.url, id=id)
+  if mf2:
+    mf2['url'] = resp.url
+  return mf2
+
+
+def parse_mf2_fast(input, url=None, id=None):
+  """Extracts just the microformats2 that Bridgy uses from HTML, without mf2py.
+
+  Much faster than :func:`oauth_dropins.webutil.util.parse_mf2` on big pages,
+  but only supports a small subset of mf2: the rels in ``FAST_MF2_RELS``, and
+  explicit ``FAST_MF2_PROPERTIES`` on top level ``h-entry`` items. No implied
+  properties, no backcompat, no value class pattern, and no children.
+
+  Args:
+    input (str, bytes, or requests.Response): HTML
+    url (str): optional, base URL for relative URLs. Defaults to the response's
+      URL.
+    id (str): optional id of specific element to parse. Defaults to the whole
+      page.
+
+  Returns:
+    dict: mf2 data with ``items`` and ``rels``, or None if id is provided and
+    not found
+  """
+  if isinstance(input, requests.Response) and not url:
+    url = input.url
+
+  soup = parse_html(input)
+  base = soup.find('base', href=True)
+  if base:
+    url = urllib.parse.urljoin(url or '', base['href'])
+
+  if id:
+    soup = soup.find(id=id)
+    if not soup:
+      return None
+
+  def absolute(val):
+    val = val.strip()
+    return urllib.parse.urljoin(url, val) if url else val
+
+  def roots(elem):
+    return [cls for cls in elem.get('class') or [] if cls.startswith('h-')]
+
+  def props(elem):
+    for cls in elem.get('class') or []:
+      prefix, _, name = cls.partition('-')
+      if prefix in ('p', 'u', 'dt', 'e') and name in FAST_MF2_PROPERTIES:
+        yield prefix, name
+
+  def value(elem, prefix):
+    if roots(elem):
+      item = parse_item(elem)
+      urls = item['properties'].get('url')
+      item['value'] = (urls[0] if prefix == 'u' and urls
+                       else elem.get_text().strip())
+      return item
+    elif prefix == 'u':
+      for attr in 'href', 'src', 'data', 'poster':
+        if elem.get(attr):
+          return absolute(elem[attr])
+      return elem.get('value') or elem.get_text().strip()
+    elif prefix == 'e':
+      return {'html': elem.decode_contents().strip(),
+              'value': elem.get_text().strip()}
+    return elem.get('value') or elem.get('title') or elem.get_text().strip()
+
+  def parse_item(elem):
+    item = {'type': roots(elem), 'properties': {}}
+
+    def collect(parent):
+      for child in parent.find_all(True, recursive=False):
+        for prefix, name in props(child):
+          item['properties'].setdefault(name, []).append(value(child, prefix))
+        if not roots(child):
+          collect(child)
+
+    collect(elem)
+    return item
+
+  items = []
+
+  def find_items(elem):
+    if roots(elem):
+      if 'h-entry' in roots(elem):
+        items.append(parse_item(elem))
+    else:
+      for child in elem.find_all(True, recursive=False):
+        find_items(child)
+
+  find_items(soup)
+
+  rels = {}
+  for link in soup.find_all(('a', 'area', 'link'), rel=True, href=True):
+    link_rels = link['rel']
+    if isinstance(link_rels, str):
+      link_rels = link_rels.split()
+    for rel in link_rels:
+      if rel in FAST_MF2_RELS:
+        href = absolute(link['href'])
+        if href not in rels.setdefault(rel, []):
+          rels[rel].append(href)
+
+  return {'items': items, 'rels': rels}
 
 
 def requests_post(url, **kwargs):
   """Wraps :func:`requests.post` with our headers."""
   kwargs.setdefault('headers', {}).update(request_headers(url=url))
+  count_http_call()
   return util.requests_post(url, **kwargs)
 
 
@@ -284,6 +1189,128 @@ def follow_redirects(url):
   return util.follow_redirects(url, headers=request_headers(url=url))
 
 
+def _can_use_redirect_datastore(url):
+  """Returns True if :func:`resolve_url` can cache this URL in the datastore."""
+  return (REDIRECT_CACHE_DATASTORE and _can_use_datastore_cache()
+          and len(url) <= REDIRECT_CACHE_MAX_DATASTORE_URL_LENGTH)
+
+
+def prefetch_resolved_urls(urls):
+  """Loads cached URL resolutions from the datastore into memory.
+
+  Uses a single ``get_multi`` for all URLs that aren't already in the
+  in-process ``redirect_cache``, so that :func:`resolve_url` can run in threads,
+  which don't have an ndb context, and still use the datastore tier.
+
+  Args:
+    urls (iterable of str): should already be cleaned with :func:`clean_url`
+
+  Returns:
+    list of str: URLs that weren't in either tier, for
+    :func:`store_resolved_urls` after they're resolved
+  """
+  urls = {url for url in urls if _can_use_redirect_datastore(url)}
+  with redirect_cache_lock:
+    missing = sorted(url for url in urls if url not in redirect_cache)
+  if not missing:
+    return []
+
+  now = util.now()
+  entities = ndb.get_multi(ndb.Key(ResolvedUrl, url) for url in missing)
+  misses = []
+  with redirect_cache_lock:
+    for url, entity in zip(missing, entities):
+      if entity and entity.expires > now:
+        redirect_cache_stats['datastore_hit'] += 1
+        redirect_cache[url] = Resolved(entity.url, entity.content_type,
+                                       entity.status)
+      else:
+        misses.append(url)
+
+  return misses
+
+
+def store_resolved_urls(urls):
+  """Stores URL resolutions from ``redirect_cache`` in the datastore.
+
+  Uses a single ``put_multi``.
+
+  Args:
+    urls (iterable of str): from :func:`prefetch_resolved_urls`. URLs that
+      aren't in ``redirect_cache`` are ignored.
+  """
+  if not REDIRECT_CACHE_DATASTORE or not _can_use_datastore_cache():
+    return
+
+  now = util.now()
+  entities = []
+  with redirect_cache_lock:
+    for url in urls:
+      resolved = redirect_cache.get(url)
+      if resolved:
+        entities.append(ResolvedUrl(
+          id=url, url=resolved.url, content_type=resolved.content_type,
+          status=resolved.status, expires=now + redirect_cache_ttl(resolved)))
+  if entities:
+    ndb.put_multi(entities)
+
+
+def resolve_url(url, datastore=True):
+  """Follows a URL's redirects, with a two tier cache.
+
+  The first tier is the in-process ``redirect_cache``. The second, if
+  ``REDIRECT_CACHE_DATASTORE`` is True, is :class:`ResolvedUrl` entities in the
+  datastore. It's skipped if there's no ndb context, eg in a thread, or we're
+  inside a transaction. :func:`get_webmention_targets` loads and stores the
+  second tier itself, in batches, around its threads.
+
+  Successful resolutions are cached for ``REDIRECT_CACHE_TTL``, failures for
+  ``REDIRECT_CACHE_NEGATIVE_TTL``. Hits and misses are counted in
+  ``redirect_cache_stats``.
+
+  Args:
+    url (str): should already be cleaned with :func:`clean_url`
+    datastore (bool): whether to use the datastore tier
+
+  Returns:
+    Resolved:
+  """
+  with redirect_cache_lock:
+    resolved = redirect_cache.get(url)
+  if resolved:
+    redirect_cache_stats['hit'] += 1
+    return resolved
+
+  use_datastore = datastore and _can_use_redirect_datastore(url)
+  if use_datastore:
+    entity = ResolvedUrl.get_by_id(url)
+    if entity and entity.expires > util.now():
+      redirect_cache_stats['datastore_hit'] += 1
+      resolved = Resolved(entity.url, entity.content_type, entity.status)
+      with redirect_cache_lock:
+        redirect_cache[url] = resolved
+      return resolved
+
+  redirect_cache_stats['miss'] += 1
+  count_http_call()
+  # bypass webutil's own follow_redirects cache
+  resp = util.follow_redirects.__wrapped__(url, headers=request_headers(url=url))
+  resolved = Resolved(resp.url, resp.headers.get('content-type') or '',
+                      resp.status_code)
+
+  with redirect_cache_lock:
+    redirect_cache[url] = resolved
+    if resolved.url != url:
+      redirect_cache.setdefault(resolved.url, resolved)
+
+  if use_datastore:
+    ResolvedUrl(id=url, url=resolved.url, content_type=resolved.content_type,
+                status=resolved.status,
+                expires=util.now() + redirect_cache_ttl(resolved)).put()
+
+  return resolved
+
+
 def request_headers(url=None, source=None):
   if url and util.domain_from_link(url) in CONNEG_DOMAINS:
     return REQUEST_HEADERS_CONNEG
@@ -291,7 +1318,8 @@ def request_headers(url=None, source=None):
   return {}
 
 
-def get_webmention_target(url, resolve=True, replace_test_domains=True):
+def get_webmention_target(url, resolve=True, replace_test_domains=True,
+                          datastore=True):
   """Resolves a URL and decides whether we should try to send it a webmention.
 
   Note that this ignores failed HTTP requests, ie the boolean in the returned
@@ -302,6 +1330,7 @@ def get_webmention_target(url, resolve=True, replace_test_domains=True):
     resolve (bool): whether to follow redirects
     replace_test_domains (bool): whether to replace test user domains with
       localhost
+    datastore (bool): passed through to :func:`resolve_url`
 
   Returns:
     (str url, str pretty domain, bool should send) tuple: target info.
@@ -318,10 +1347,10 @@ def get_webmention_target(url, resolve=True, replace_test_domains=True):
   send = True
   if resolve:
     # this follows *all* redirects, until the end
-    resolved = follow_redirects(url)
-    html = (resolved.headers.get('content-type', '').split(';')[0]
+    resolved = resolve_url(url, datastore=datastore)
+    html = (resolved.content_type.split(';')[0]
             in ('text/html', 'text/mf2+html'))
-    send = html and resolved.status_code != util.HTTP_RESPONSE_TOO_BIG_STATUS_CODE
+    send = html and resolved.status != util.HTTP_RESPONSE_TOO_BIG_STATUS_CODE
     url, domain, _ = get_webmention_target(
       resolved.url, resolve=False, replace_test_domains=replace_test_domains)
 
@@ -335,6 +1364,38 @@ def get_webmention_target(url, resolve=True, replace_test_domains=True):
   return url, domain, send
 
 
+def get_webmention_targets(urls, **kwargs):
+  """Resolves multiple URLs concurrently with :func:`get_webmention_target`.
+
+  Uses a thread pool of up to ``MAX_CONCURRENT_RESOLVES`` threads. Loads and
+  stores the :func:`resolve_url` datastore tier in this thread, in batches,
+  with :func:`prefetch_resolved_urls` and :func:`store_resolved_urls`.
+
+  Args:
+    urls (iterable of str)
+    kwargs: passed through to :func:`get_webmention_target`
+
+  Returns:
+    dict: maps each input URL to its (str url, str pretty domain, bool should
+    send) tuple from :func:`get_webmention_target`
+  """
+  urls = list(dict.fromkeys(urls))  # dedupe, preserve order
+  misses = (prefetch_resolved_urls(util.clean_url(url) for url in urls)
+            if kwargs.get('resolve', True) else [])
+
+  def resolve(url):
+    return get_webmention_target(url, datastore=False, **kwargs)
+
+  if len(urls) <= 1 or MAX_CONCURRENT_RESOLVES <= 1:
+    targets = {url: resolve(url) for url in urls}
+  else:
+    with ThreadPoolExecutor(max_workers=min(len(urls), MAX_CONCURRENT_RESOLVES)) as executor:
+      targets = dict(zip(urls, executor.map(in_context(resolve), urls)))
+
+  store_resolved_urls(misses)
+  return targets
+
+
 def in_webmention_blocklist(domain):
   """Returns True if the domain or its root domain is in ``BLOCKLIST``."""
   domain = domain.lower()
@@ -370,6 +1431,32 @@ def is_opt_out(actor):
   return False
 
 
+def activity_fingerprint(activity):
+  """Returns a hash of the fields that :func:`as1.activity_changed` compares.
+
+  If two activities have different fingerprints, :func:`as1.activity_changed`
+  would say they changed, and vice versa. Used to detect changed responses in
+  :meth:`tasks.Poll.backfeed` without storing or parsing the responses
+  themselves.
+
+  Args:
+    activity (dict): ActivityStreams activity or object
+
+  Returns:
+    str: hex digest
+  """
+  def fields(obj):
+    vals = {field: obj.get(field) for field in ACTIVITY_CHANGED_FIELDS}
+    in_reply_to = obj.get('inReplyTo')
+    if isinstance(in_reply_to, dict):
+      in_reply_to = {k: v for k, v in in_reply_to.items() if k != 'author'}
+    vals['inReplyTo'] = in_reply_to
+    return vals
+
+  data = trim_nulls([fields(activity), fields(as1.get_object(activity))])
+  return hashlib.md5(json_dumps(data, sort_keys=True).encode()).hexdigest()
+
+
 def prune_activity(activity, source):
   """Prunes an activity down to just id, url, content, to, and object, in place.
 
@@ -64,6 +64,7 @@ class Webmention(View):
     try:
       resp = util.requests_get(url)
       resp.raise_for_status()
+      body = util.read_body(resp, util.MAX_MF2_FETCH_BYTES)
     except werkzeug.exceptions.HTTPException:
       # raised by us, probably via self.error()
       raise
@@ -74,10 +75,10 @@ class Webmention(View):
       self.error(f'Could not fetch source URL {url}')
 
     if self.entity:
-      self.entity.html = resp.text
+      self.entity.html = body.decode(resp.encoding or 'utf-8', errors='replace')
 
     # parse microformats
-    soup = util.parse_html(resp)
+    soup = util.parse_html(util.html_input(resp, body))
     mf2 = util.parse_mf2(soup, url=resp.url, id=id)
     if id and not mf2:
       self.error(f'Got fragment {id} but no element found with that id.')
@@ -103,7 +104,8 @@ class Webmention(View):
           doc = str(post)
           mf2 = util.parse_mf2(doc, resp.url)
 
-    logger.debug(f'Parsed microformats2: {json_dumps(mf2, indent=2)}')
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug(f'Parsed microformats2: {json_dumps(mf2, indent=2)}')
     items = mf2.get('items', [])
     if require_mf2 and (not items or not items[0]):
       self.error('No microformats2 data found in ' + resp.url, data=mf2, html=f"""